@@ -0,0 +1,265 @@
+'''
+Deadline based scheduler for reading the devices at their own rates.  Every
+channel is read on a fixed grid of deadlines, start + n*period, rather than
+sleeping for a period after each read, so the time the reads take never
+accumulates into drift.  Channels which fall due together are read in one
+batch so the bus can group them by baud rate.
+
+When the bus cannot keep up, a channel which has already missed its next
+deadline skips the missed ones instead of trying to catch up in a burst, and the
+overrun is counted.  The lateness of every read against its deadline is
+recorded as jitter.
+
+Channels on different buses (different serial ports) are read by a worker
+thread per bus, in parallel, each on its own grid of deadlines, so one slow
+port never holds up the channels on another.  The workers take the
+transaction priority of the thread which called run().
+
+Classes:
+
+    acquisition_scheduler -> reads a set of channels at fixed rates
+'''
+import threading, math
+from rs485 import transaction_priority, current_priority
+
+class acquisition_scheduler:
+    '''
+    A class which reads channels at fixed rates, with a worker per bus.
+
+    ...
+
+    Attributes
+    ----------
+    bus: bus object
+        the bus channels are read on unless add_channel() gives another
+    clock: run_clock object
+        time base for the deadlines and the acquisition times
+
+    Public Methods
+    --------------
+    add_channel(name,rate,baudrate,query,bus)
+    run(on_sample,running)
+    stop()
+    stats()
+    load()
+    '''
+
+    def __init__(self,bus,clock) -> None:
+        self.bus = bus
+        self.clock = clock
+        self._channels = {}
+        self._stop = threading.Event()
+
+    def add_channel(self,name,rate,baudrate,query,bus=None):
+        '''
+        Adds a channel to be read.
+
+            Parameters:
+                name (str): name of the channel
+                rate (float): reads per second
+                baudrate (int): line speed the device is read at
+                query (function): takes no arguments and returns the reading,
+                    raising a Warning if the device does not answer
+                bus (bus object): the bus the device is on, by default the
+                    scheduler's
+            Returns:
+                None
+        '''
+        self._channels[name] = {
+            'bus':bus if bus is not None else self.bus,
+            'period':1/rate,
+            'baudrate':baudrate,
+            'query':query,
+            'origin':0,
+            'tick':0,
+            'deadline':0,
+            'samples':0,
+            'failures':0,
+            'overruns':0,
+            'skipped':0,
+            'jitter_sum':0,
+            'jitter_max':0,
+            'duration_sum':0,
+        }
+
+    def run(self,on_sample,running=None):
+        '''
+        Reads the channels until stopped.  Blocks, so it is normally run in its
+        own thread.
+
+            Parameters:
+                on_sample (function): called after every batch of reads as
+                    on_sample(tick_time,readings), where tick_time is the
+                    deadline of the batch and readings maps each channel read
+                    to a (value, acquisition time) tuple.  The value is None if
+                    the device did not answer.  Times are in seconds on the
+                    clock.  Each bus reads its own batches, but the calls are
+                    made one at a time.
+                running (function): optional, takes no arguments; the scheduler
+                    also stops once it returns False
+            Returns:
+                None
+        '''
+        self._stop.clear()
+        start = self.clock.now()
+        buses = {}
+        for name,channel in self._channels.items():
+            channel['origin'] = start
+            channel['tick'] = 0
+            channel['deadline'] = start
+            buses.setdefault(channel['bus'],[]).append(name)
+        if len(buses) <= 1:
+            for bus,names in buses.items():
+                self.__Worker(bus,names,on_sample,running)
+            return
+
+        lock = threading.Lock()
+        def serialized(tick_time,readings):
+            with lock:
+                on_sample(tick_time,readings)
+        level = current_priority()
+        errors = []
+        def worker(bus,names):
+            with transaction_priority(level):
+                try:
+                    self.__Worker(bus,names,serialized,running)
+                except Exception as error:
+                    errors.append(error)
+                finally:
+                    # One worker ending stops the others, so a failure does
+                    # not leave the log with some buses missing.
+                    self._stop.set()
+        workers = [threading.Thread(target=worker,args=(bus,names),
+            daemon=True) for bus,names in buses.items()]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def stop(self):
+        '''
+        Stops the scheduler.  Returns immediately; run() returns once the
+        batch in progress has finished.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        self._stop.set()
+
+    def stats(self):
+        '''
+        Reports the timing of each channel.
+
+            Parameters:
+                None
+            Returns:
+                stats (dict): for each channel, the rate, the number of samples
+                    and failed reads, the number of overruns and deadlines
+                    skipped, the mean and max jitter and the mean read time,
+                    all times in seconds
+        '''
+        stats = {}
+        for name,channel in self._channels.items():
+            samples = channel['samples']
+            stats[name] = {
+                'rate':1/channel['period'],
+                'samples':samples,
+                'failures':channel['failures'],
+                'overruns':channel['overruns'],
+                'skipped':channel['skipped'],
+                'jitter_mean':channel['jitter_sum']/samples if samples else 0,
+                'jitter_max':channel['jitter_max'],
+                'duration_mean':channel['duration_sum']/samples if samples
+                    else 0,
+            }
+        return stats
+
+    def load(self):
+        '''
+        Estimates the fraction of the bus time the channels need at their
+        rates, from the measured read times, for the busiest bus.  Above 1
+        that bus cannot keep up and its channels will overrun.
+
+            Parameters:
+                None
+            Returns:
+                load (float)
+        '''
+        stats = self.stats()
+        loads = {}
+        for name,channel in self._channels.items():
+            loads[channel['bus']] = loads.get(channel['bus'],0) + \
+                stats[name]['duration_mean']*stats[name]['rate']
+        return max(loads.values(),default=0)
+
+    def __Worker(self,bus,names,on_sample,running):
+        '''
+        Reads the channels of one bus until stopped.
+        '''
+        channels = {name:self._channels[name] for name in names}
+        while not self._stop.is_set():
+            if running is not None and not running():
+                break
+            deadline = min(channel['deadline']
+                for channel in channels.values())
+            wait = deadline - self.clock.now()
+            if wait > 0 and self._stop.wait(wait):
+                break
+            now = self.clock.now()
+            due = sorted((name for name,channel in channels.items()
+                if channel['deadline'] <= now),
+                key=lambda name: channels[name]['deadline'])
+            if not due:
+                # Woken before the deadline, so there is nothing to read and
+                # nothing to publish yet.
+                continue
+            results = bus.batch([(channels[name]['baudrate'],
+                self.__Timed(name)) for name in due])
+            readings = {}
+            for name,(value,started,finished) in zip(due,results):
+                self.__Record(name,started,finished,value is None)
+                readings[name] = (value,(started + finished)/2)
+            on_sample(deadline,readings)
+
+    def __Timed(self,name):
+        '''
+        Returns a job for the bus which reads a channel and times the read.
+        '''
+        query = self._channels[name]['query']
+        def timed_query():
+            started = self.clock.now()
+            try:
+                value = query()
+            except Warning:
+                value = None
+            return value,started,self.clock.now()
+        return timed_query
+
+    def __Record(self,name,started,finished,failed):
+        '''
+        Records a read and moves the channel on to its next deadline.
+        '''
+        channel = self._channels[name]
+        jitter = max(started - channel['deadline'],0)
+        channel['samples'] = channel['samples'] + 1
+        if failed:
+            channel['failures'] = channel['failures'] + 1
+        channel['jitter_sum'] = channel['jitter_sum'] + jitter
+        channel['jitter_max'] = max(channel['jitter_max'],jitter)
+        channel['duration_sum'] = channel['duration_sum'] + finished - started
+        # Deadlines are computed from the tick count rather than by adding the
+        # period each time, so rounding never accumulates.
+        channel['tick'] = channel['tick'] + 1
+        deadline = channel['origin'] + channel['tick']*channel['period']
+        now = self.clock.now()
+        if deadline <= now:
+            missed = math.floor((now - deadline)/channel['period']) + 1
+            channel['overruns'] = channel['overruns'] + 1
+            channel['skipped'] = channel['skipped'] + missed
+            channel['tick'] = channel['tick'] + missed
+            deadline = channel['origin'] + channel['tick']*channel['period']
+        channel['deadline'] = deadline
@@ -0,0 +1,107 @@
+'''
+Runs a recipe and its logging in a process of their own, publishing every
+reading and the progress of the run to the shared memory telemetry ring in
+shared_telemetry.py.  The GUI starts this process, or any terminal can, and
+the GUI only reads the ring, so it can be closed and reopened without
+disturbing the run.
+
+The run is stopped through the ring's stop request, or by SIGTERM or Ctrl-C,
+after which the devices are put in the recipe's safe state.
+
+Run from the repository root:
+
+    python acquisition_process.py recipe_file log_file [--devices devices.json]
+
+Functions:
+
+    run(recipe_filename,log_filename,name,log_freq,rates) -> runs the recipe
+'''
+import threading, time, signal, argparse
+from recipe import recipe
+from devices import device_config
+from shared_telemetry import telemetry_writer, default_name
+
+def run(recipe_filename,log_filename,name=default_name,log_freq=1,rates=None,
+    capacity=1 << 20,device_file=None):
+    '''
+    Runs a recipe and logs it, publishing to a telemetry ring.  Blocks until
+    the run has finished and the ring has been removed.
+
+        Parameters:
+            recipe_filename (str): recipe file
+            log_filename (str): log file, binary if it ends in .cvdlog
+            name (str): name of the telemetry ring
+            log_freq (float): logging frequency in Hz for devices without a
+                rate in rates
+            rates (dict): logging rates, see recipe.logging(); by default
+                recipe.log_rates
+            capacity (int): readings the ring holds
+            device_file (str): device map, by default recipe.device_file
+        Returns:
+            completed (bool): False if the recipe was stopped or failed
+    '''
+    if rates is None:
+        rates = recipe.log_rates
+    if device_file is None:
+        device_file = recipe.device_file
+    run_recipe = recipe(recipe_filename,devices=device_config(device_file))
+    writer = telemetry_writer(name,capacity,run_start=time.time())
+    # The recipe's live readings go straight into the ring.
+    run_recipe.live = writer
+    stop = lambda *args: run_recipe.stop()
+    signal.signal(signal.SIGTERM,stop)
+    signal.signal(signal.SIGINT,stop)
+
+    run_recipe.logging_state = True
+    log_task = threading.Thread(target=run_recipe.logging,
+        args=(log_freq,log_filename),kwargs={'rates':rates})
+    log_task.start()
+    result = {'completed':False,'failed':False}
+    def run_task_body():
+        try:
+            result['completed'] = run_recipe.run(progress=writer.set_progress)
+        except Exception as error:
+            print('Recipe failed: ' + str(error))
+            result['failed'] = True
+    run_task = threading.Thread(target=run_task_body)
+    writer.set_state('running')
+    run_task.start()
+    try:
+        # The main thread only watches for a stop request, and stays free to
+        # take signals.
+        while run_task.is_alive():
+            if writer.stop_requested():
+                run_recipe.stop()
+            run_task.join(0.05)
+    finally:
+        run_recipe.stop()
+        run_task.join()
+        log_task.join()
+        completed = result['completed']
+        if not completed:
+            if not run_recipe.safe_state():
+                print('Not every device could be put in its safe state.')
+        if result['failed']:
+            writer.set_state('failed')
+        elif completed:
+            writer.set_state('completed')
+        else:
+            writer.set_state('stopped')
+        # Give readers a last look at the final state before the ring goes.
+        time.sleep(1)
+        writer.close()
+    return completed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs a recipe in its own '
+        'process, publishing to the shared memory telemetry ring.')
+    parser.add_argument('recipe',help='recipe file')
+    parser.add_argument('log',help='log file, binary if it ends in .cvdlog')
+    parser.add_argument('--name',default=default_name,
+        help='name of the telemetry ring')
+    parser.add_argument('--freq',type=float,default=1,
+        help='logging frequency in Hz for devices without a default rate')
+    parser.add_argument('--devices',default=None,
+        help='device map, by default devices.json')
+    args = parser.parse_args()
+    run(args.recipe,args.log,args.name,args.freq,device_file=args.devices)
@@ -0,0 +1,586 @@
+'''
+Asyncio drivers for the devices on the RS-485 network of the tube furnace CVD
+system.  These sit alongside the blocking classes in equipment.py and reuse
+their frame building and reply parsing, but wait for replies on the event loop
+instead of blocking in serial.Serial.read, so a single loop can drive several
+buses, timers and the telemetry stream without a thread for each.
+
+The serial transport puts the port in non-blocking mode and has the event loop
+watch its file descriptor, so this layer only works on platforms where
+loop.add_reader accepts serial ports (Linux and macOS).  A port should be
+driven either by these drivers or by the blocking ones, not both at once.
+
+Classes:
+
+    aio_bus -> event loop owner of a serial port shared by several devices
+    aio_MFC -> mass flow controller
+    aio_furnace -> tube furnace
+    aio_pressure_trans -> pressure transducer
+
+Functions:
+
+    get_aio_bus(port) -> the shared aio_bus object for a given port
+'''
+import asyncio, struct
+import serial
+from equipment import MFC, furnace, pressure_trans, modbus_exception
+from modbus import register_span, decode_registers
+
+class aio_bus:
+    '''
+    A class which owns a serial port on behalf of the event loop and serializes
+    every transaction made on it.
+
+    ...
+
+    Attributes
+    ----------
+    port: str
+        the path of the serial port, e.g. '/dev/ttyUSB0'
+    timeout: float
+        the read timeout in seconds
+    ser: serial.Serial object
+        the open, non-blocking serial port, or None until the first transaction
+    baudrate: int
+        the baud rate the port is currently configured for
+
+    Public Methods
+    --------------
+    transaction(baudrate,exchange)
+    write(data)
+    read(size)
+    read_until(expected)
+    close()
+    '''
+
+    def __init__(self,port='/dev/ttyUSB0',timeout=3) -> None:
+        self.port = port
+        self.timeout = timeout
+        self.ser = None
+        self.baudrate = None
+        self._lock = None
+        self._data = None
+        self._buffer = bytearray()
+
+    async def transaction(self,baudrate,exchange):
+        '''
+        Runs a single write/read exchange with exclusive access to the port.
+
+            Parameters:
+                baudrate (int): the baud rate the device expects
+                exchange (coroutine function): called with this bus as its only
+                    argument, should write the command and read the reply
+            Returns:
+                whatever exchange returns
+        '''
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            self._data = asyncio.Event()
+        async with self._lock:
+            self.__Configure(baudrate)
+            return await exchange(self)
+
+    def write(self,data):
+        '''
+        Discards any stale input and writes a command.  Commands are a few tens
+        of bytes at most so they go straight into the driver's buffer.
+
+            Parameters:
+                data (bytes): the complete command
+            Returns:
+                None
+        '''
+        self._buffer.clear()
+        try:
+            self.ser.write(data)
+        except (serial.SerialException,OSError):
+            self.__Drop()
+            raise Warning('Lost connection to serial port ' + self.port)
+
+    async def read(self,size):
+        '''
+        Waits for a number of bytes to arrive.  Like serial.Serial.read, fewer
+        bytes are returned if the timeout expires first.
+
+            Parameters:
+                size (int): number of bytes to read
+            Returns:
+                data (bytes)
+        '''
+        await self.__WaitFor(lambda: len(self._buffer) >= size)
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+    async def read_until(self,expected):
+        '''
+        Waits for a terminator to arrive.  Like serial.Serial.read_until,
+        whatever has arrived is returned if the timeout expires first.
+
+            Parameters:
+                expected (bytes): the terminator
+            Returns:
+                data (bytes): including the terminator if it arrived
+        '''
+        await self.__WaitFor(lambda: self._buffer.find(expected) >= 0)
+        end = self._buffer.find(expected)
+        if end < 0:
+            end = len(self._buffer)
+        else:
+            end = end + len(expected)
+        data = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        return data
+
+    def close(self):
+        '''
+        Closes the serial port.  It will be reopened by the next transaction,
+        which may run on another event loop.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        if self.ser:
+            self.__Drop()
+        # The lock and event belong to the loop which made them.
+        if self._lock is not None and not self._lock.locked():
+            self._lock = None
+            self._data = None
+
+    async def __WaitFor(self,done):
+        '''
+        Sleeps on the event loop until a condition on the receive buffer is met
+        or the timeout expires.
+
+            Parameters:
+                done (function): returns True once enough data has arrived
+            Returns:
+                None
+        '''
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        while not done() and self.ser is not None:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            self._data.clear()
+            try:
+                await asyncio.wait_for(self._data.wait(),remaining)
+            except asyncio.TimeoutError:
+                break
+
+    def __OnReadable(self):
+        '''
+        Called by the event loop whenever the port has data waiting.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except (serial.SerialException,OSError):
+            # The adapter was unplugged or reset underneath us.
+            self.__Drop()
+            data = b''
+        self._buffer += data
+        self._data.set()
+
+    def __Configure(self,baudrate):
+        '''
+        Opens the port if required and switches the baud rate only if it
+        differs from the current setting.
+
+            Parameters:
+                baudrate (int): the required baud rate
+            Returns:
+                None
+        '''
+        if self.ser is None:
+            try:
+                self.ser = serial.Serial(port=self.port,baudrate=baudrate,
+                    timeout=0)
+            except (serial.SerialException,OSError):
+                raise Warning('Unable to open serial port ' + self.port)
+            asyncio.get_running_loop().add_reader(self.ser.fileno(),
+                self.__OnReadable)
+            self.baudrate = baudrate
+        elif baudrate != self.baudrate:
+            self.ser.baudrate = baudrate
+            self.baudrate = baudrate
+            self.ser.reset_input_buffer()
+            self._buffer.clear()
+
+    def __Drop(self):
+        '''
+        Stops watching the port and closes it.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        try:
+            asyncio.get_running_loop().remove_reader(self.ser.fileno())
+        except (RuntimeError,ValueError,OSError):
+            pass
+        try:
+            self.ser.close()
+        except (serial.SerialException,OSError):
+            pass
+        self.ser = None
+        self.baudrate = None
+        if self._data:
+            self._data.set()
+
+_aio_buses = {}
+
+def get_aio_bus(port='/dev/ttyUSB0'):
+    '''
+    Returns the aio_bus object for a port, creating it the first time the port
+    is requested so that every device on the port shares it.
+
+        Parameters:
+            port (str): the path of the serial port
+        Returns:
+            aio_bus object
+    '''
+    if port not in _aio_buses:
+        _aio_buses[port] = aio_bus(port)
+    return _aio_buses[port]
+
+class aio_MFC:
+    '''
+    Asyncio driver for the mass flow controllers.  Unlike the blocking MFC
+    class, failures are raised as Warning rather than printed.
+
+    ...
+
+    Attributes
+    ----------
+    address: int
+        the address used for serial comms
+    device: equipment.MFC object
+        supplies the frames and reply parsing
+    bus: aio_bus object
+        the shared bus object which owns the serial port the MFCs are on
+
+    Public Methods
+    --------------
+    set_flow(set_point)
+    query_flow()
+    query_op_mode()
+    '''
+
+    max_attempts = 6
+
+    def __init__(self,address,port='/dev/ttyUSB0') -> None:
+        self.address = address
+        self.device = MFC(address,port)
+        self.bus = get_aio_bus(port)
+
+    async def set_flow(self,set_point):
+        '''
+        Set a flow rate.
+
+            Parameters:
+                set_point (float): the desired set point
+            Returns:
+                None
+        '''
+        await self.__send_command('SX!',set_point)
+
+    async def query_flow(self):
+        '''
+        Queries the current flow rate.
+
+            Parameters:
+                None
+            Returns:
+                flow_rate (float): the mass flow rate measured by the device
+        '''
+        return await self.__send_command('FX?',parse=float)
+
+    async def query_op_mode(self):
+        '''
+        Queries the operating mode.
+
+            Parameters:
+                None
+            Returns:
+                mode (str): the operating mode reported by the MFC
+        '''
+        return await self.__send_command('OM?')
+
+    async def __send_command(self,command_text,command_value='',parse=None):
+        '''
+        Sends a command until a valid reply comes back.
+
+            Parameters:
+                command_text (str): the unique command identifier
+                command_value (str): an optional value for the command
+                parse (function): optional, turns the returned text into the
+                    result; a reply it raises ValueError for is retried
+            Returns:
+                returned_text (str): the text between the 'ACK' and the ';',
+                    or what parse returned for it
+        '''
+        command = self.device._Frame(command_text,command_value)
+        for attempt in range(self.max_attempts):
+            reply = await self.bus.transaction(self.device.baudrate,
+                lambda stream: self.__exchange(stream,command))
+            returned_text = self.device._ParseReply(reply)
+            if returned_text is None:
+                continue
+            if parse is None:
+                return returned_text
+            try:
+                return parse(returned_text)
+            except ValueError:
+                # The checksum passed but the value is garbled.
+                pass
+        raise Warning('Unsuccessful communication with MFC ' + str(self.address))
+
+    async def __exchange(self,stream,command):
+        '''
+        Writes a command and reads back the reply including the checksum.
+        '''
+        stream.write(command)
+        reply = await stream.read_until(b';')
+        # append the checksum characters
+        return reply + await stream.read(2)
+
+class aio_furnace:
+    '''
+    Asyncio driver for the tube furnace.
+
+    ...
+
+    Attributes
+    ----------
+    device: equipment.furnace object
+        supplies the frames, register map decoding and CRC checks
+    bus: aio_bus object
+        the shared bus object which owns the serial port the furnace is on
+
+    Public Methods
+    --------------
+    set_temp(setpoint)
+    query_temp()
+    read_registers(start,count)
+    query_registers(names)
+    query_process()
+    '''
+
+    max_attempts = 6
+
+    def __init__(self,address,port='/dev/ttyUSB0') -> None:
+        self.device = furnace(address,port)
+        self.bus = get_aio_bus(port)
+
+    async def set_temp(self,setpoint):
+        '''
+        Set the temperature of the furnace.
+
+            Parameters:
+                setpoint (int)
+            Returns:
+                None
+        '''
+        await self.__send_command(self.device._set_temp_frame(setpoint),8,0x10)
+
+    async def query_temp(self):
+        '''
+        Check the current temperature as reported by the furnace.
+
+            Parameters:
+                None
+            Returns:
+                temperature (int)
+        '''
+        response = await self.__send_command(self.device.query_temp_frame,7,0x03)
+        return int.from_bytes(response[3:-2],byteorder='big')
+
+    async def read_registers(self,start,count):
+        '''
+        Reads a contiguous block of holding registers in a single transaction.
+
+            Parameters:
+                start (int): address of the first register
+                count (int): number of registers to read
+            Returns:
+                values (tuple): the unsigned value of each register
+        '''
+        response = await self.__send_command(
+            self.device._read_frame(start,count),5 + count*2,0x03)
+        return struct.unpack_from('>' + str(count) + 'H',response,3)
+
+    async def query_registers(self,names):
+        '''
+        Queries a set of named fields from the register map with one block
+        read covering all of them.
+
+            Parameters:
+                names (iterable): field names from modbus.furnace_registers
+            Returns:
+                fields (dict): the value of each field in engineering units
+        '''
+        start,count = register_span(names)
+        values = await self.read_registers(start,count)
+        return decode_registers(values,start,names)
+
+    async def query_process(self):
+        '''
+        Queries the temperature, active setpoint and heater output in a single
+        transaction.  Falls back to query_temp() if the controller rejects the
+        block read, like furnace.QueryProcess().
+
+            Parameters:
+                None
+            Returns:
+                fields (dict): with keys 'Temp', 'Setpoint' and 'Output'
+        '''
+        if self.device.block_read:
+            try:
+                return await self.query_registers(self.device.process_fields)
+            except modbus_exception:
+                self.device.block_read = False
+        fields = dict.fromkeys(self.device.process_fields)
+        fields['Temp'] = await self.query_temp()
+        return fields
+
+    async def __send_command(self,command,response_length,function_code):
+        '''
+        Sends a command until a response with a correct CRC and no error
+        message comes back.  A timed out or corrupted response is retried; a
+        valid exception reply raises modbus_exception straight away, since it
+        would only be repeated.
+
+            Parameters:
+                command (bytes): the entire MODBUS command including CRC
+                response_length (int): expected response length
+                function_code (int): the MODBUS function code
+            Returns:
+                response (bytes): raw bytes received including CRC
+        '''
+        for attempt in range(self.max_attempts):
+            response,error_flag = await self.bus.transaction(
+                self.device.baudrate,
+                lambda stream: self.__exchange(stream,command,response_length,
+                function_code))
+            if len(response) < 2 or not self.device._CheckCRC(response):
+                continue
+            if error_flag:
+                raise modbus_exception('Tube furnace returned MODBUS '
+                    'exception ' + str(response[2]) + '.',response[2])
+            return response
+        raise Warning('Unsuccessful communication with tube furnace.')
+
+    async def __exchange(self,stream,command,response_length,function_code):
+        '''
+        Writes a command and reads back either a normal response or an error
+        message.
+        '''
+        stream.write(command)
+        response = await stream.read(2)
+        if len(response) < 2:
+            # Timed out, which the caller retries.
+            return response, False
+        remaining,error_flag = self.device._RemainingLength(response,
+            response_length,function_code)
+        if remaining:
+            response = response + await stream.read(remaining)
+        return response, error_flag
+
+class aio_pressure_trans:
+    '''
+    Asyncio driver for the Omega PX409-485 pressure transducer.
+
+    ...
+
+    Attributes
+    ----------
+    address: str
+        the address used for serial comms
+    device: equipment.pressure_trans object
+        supplies the frames and reply parsing
+    bus: aio_bus object
+        the shared bus object which owns the serial port the transducer is on
+
+    Public Methods
+    --------------
+    query_pressure()
+    report_status()
+    '''
+
+    max_attempts = 6
+
+    def __init__(self,address,port='/dev/ttyUSB0') -> None:
+        self.address = str(address)
+        self.device = pressure_trans(address,port)
+        self.bus = get_aio_bus(port)
+
+    async def query_pressure(self):
+        '''
+        Query the current pressure.
+
+            Parameters:
+                None
+            Returns:
+                pressure (float): the pressure value in whatever units the
+                    transducer is currently set to
+        '''
+        return await self.__send_command(self.device.query_frame,
+            self.device._ParsePressure)
+
+    async def report_status(self):
+        '''
+        Check to see if the pressure transducer is online.
+
+            Parameters:
+                None
+            Returns:
+                status (bool)
+        '''
+        try:
+            await self.__send_command(self.device.status_frame)
+        except Warning:
+            return False
+        return True
+
+    async def __send_command(self,command,parse=None):
+        '''
+        Sends a command until a valid reply comes back.
+
+            Parameters:
+                command (ascii bytes): the complete command
+                parse (function): optional, turns the decoded reply into the
+                    result; a reply it raises ValueError for is retried
+            Returns:
+                reply (str): the decoded reply, or what parse returned for it
+        '''
+        for attempt in range(self.max_attempts):
+            reply = await self.bus.transaction(self.device.baudrate,
+                lambda stream: self.__exchange(stream,command))
+            reply = self.device._ParseReply(reply)
+            if reply is None:
+                continue
+            if parse is None:
+                return reply
+            try:
+                return parse(reply)
+            except ValueError:
+                # The reply was mangled too badly to find a number in it.
+                pass
+        raise Warning('Unsuccessful communication with pressure transducer ' +
+            self.address)
+
+    async def __exchange(self,stream,command):
+        '''
+        Writes a command and reads back the reply up to the closing '>'.
+        '''
+        stream.write(command)
+        return await stream.read_until(b'>')
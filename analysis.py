@@ -0,0 +1,345 @@
+'''
+Loads recipe logs into NumPy arrays and works out statistics for each recipe
+step, so a run can be checked without going through the log by hand.
+
+The step boundaries are worked out from the log the same way recipe.run()
+moves through the recipe: a step starts with its setpoints, waits until the
+temperature is within the settle tolerance of the setpoint, then holds for the
+step time.
+
+For each step the statistics are:
+
+    mean and std of every channel over the step
+    mean and RMS error of each flow against its setpoint while holding
+    time taken for the temperature to settle, and the overshoot past the
+        setpoint in the direction it was moving
+    pressure drift as a least squares slope, and the change over the step
+
+Everything is computed with whole-column operations, so a multi hour log
+costs little more than loading it.
+
+Functions:
+
+    load_log(filename) -> dict of column name -> array, from a CSV or binary log
+    load_schedule(filename) -> times, temps and flow of a recipe file
+    channel(log,name) -> times and values of the samples of a channel
+    step_bounds(log,times,temps,tolerance) -> start, settle and end of each step
+    step_stats(log,times,temps,flow,tolerance) -> statistics of each step
+'''
+import csv, warnings
+import numpy
+import binary_log
+from schedule import parse_setpoint
+
+# Bytes which can appear in a row of numbers: digits, signs, points,
+# exponents, nan, inf and the separators.
+_number_bytes = numpy.zeros(256,dtype=bool)
+_number_bytes[list(b'0123456789+-.eEnNaAiIfFtTyY,\n')] = True
+
+def load_log(filename):
+    '''
+    Loads a log written by recipe.logging(), in either format.
+
+        Parameters:
+            filename (str): filename including the file extension
+        Returns:
+            log (dict): column name -> numpy.ndarray of float64.  Values which
+                were not read are NaN; CSV rows which cannot be read are left
+                out.
+    '''
+    with open(filename,'rb') as file:
+        is_binary = file.read(len(binary_log.magic)) == binary_log.magic
+    if is_binary:
+        return {name:numpy.asarray(values,dtype=float)
+            for name,values in binary_log.columns(filename).items()}
+
+    with open(filename,'rb') as file:
+        names = file.readline().decode('utf-8').strip().split(',')
+        text = file.read()
+    values = _ParseRows(text,len(names))
+    return {name:values[:,i] for i,name in enumerate(names)}
+
+def load_schedule(filename):
+    '''
+    Reads the step schedule of a recipe file without connecting to any of the
+    devices.
+
+        Parameters:
+            filename (str): recipe file
+        Returns:
+            times (list): hold time of each step in seconds
+            temps (list): furnace setpoint each step settles at, the start of
+                the ramp for a ramped step
+            flow (dict): gas -> list of the flow setpoint of each step, NaN
+                for a ramped step since it has no single setpoint
+    '''
+    steps = []
+    with open(filename,'r') as file:
+        for line in file:
+            if line[0] != '#':
+                steps.append([parse_setpoint(value)
+                    for value in line.strip().split(',')])
+            if line[:8] == '#Columns':
+                columns = line[10:].strip().split(',')
+    times = []
+    temps = []
+    flow = {}
+    for i,column in enumerate(columns):
+        if column == 'Time':
+            times = [step[i][1] for step in steps]
+        elif column == 'Temp':
+            temps = [end if start is None else start
+                for start,end in (step[i] for step in steps)]
+        else:
+            flow[column] = [end if start is None else numpy.nan
+                for start,end in (step[i] for step in steps)]
+    return times,temps,flow
+
+def channel(log,name):
+    '''
+    Returns the samples of one channel with their own acquisition times, or
+    the Time column for logs without them.
+
+        Parameters:
+            log (dict): as returned by load_log()
+            name (str): column name
+        Returns:
+            times (numpy.ndarray): seconds since the start of the log
+            values (numpy.ndarray)
+    '''
+    values = log[name]
+    times = log.get(name + binary_log.time_suffix,log['Time'])
+    read = ~numpy.isnan(values)
+    return times[read],values[read]
+
+def step_bounds(log,times,temps,tolerance=2):
+    '''
+    Works out when each step of a recipe ran.  Steps whose start or settle is
+    not in the log are NaN from there on.
+
+        Parameters:
+            log (dict): as returned by load_log()
+            times (list): hold time of each step in seconds
+            temps (list): furnace setpoint of each step
+            tolerance (float): settle tolerance of the run in degrees
+        Returns:
+            bounds (numpy.ndarray): one (start, settled, end) row per step, in
+                seconds since the start of the log
+    '''
+    temp_time,temp = channel(log,'Temp') if 'Temp' in log else (None,None)
+    bounds = numpy.full((len(times),3),numpy.nan)
+    start = 0.0
+    for i,hold in enumerate(times):
+        settled = start
+        if temp is not None and len(temps) > i:
+            close = numpy.abs(temp - temps[i]) <= tolerance
+            later = numpy.searchsorted(temp_time,start)
+            hits = numpy.flatnonzero(close[later:])
+            if len(hits) == 0:
+                bounds[i,0] = start
+                break
+            settled = temp_time[later + hits[0]]
+        bounds[i] = (start,settled,settled + hold)
+        start = settled + hold
+    return bounds
+
+def step_stats(log,times,temps,flow,tolerance=2,bounds=None):
+    '''
+    Works out the statistics of each step of a run.
+
+        Parameters:
+            log (dict): as returned by load_log()
+            times (list): hold time of each step in seconds
+            temps (list): furnace setpoint of each step
+            flow (dict): gas -> list of the flow setpoint of each step
+            tolerance (float): settle tolerance of the run in degrees
+            bounds (numpy.ndarray): step boundaries, by default worked out by
+                step_bounds()
+        Returns:
+            stats (list): a dict per step with 'start', 'settled', 'end',
+                'settle_time', 'overshoot', 'press_drift' (per second),
+                'press_change', 'mean' and 'std' (dicts by channel) and
+                'flow_error' (gas -> dict with 'setpoint', 'mean' and 'rms')
+    '''
+    if bounds is None:
+        bounds = step_bounds(log,times,temps,tolerance)
+    starts = bounds[:,0]
+    settles = bounds[:,1]
+    ends = numpy.where(numpy.isnan(bounds[:,2]),numpy.inf,bounds[:,2])
+    stats = [{
+        'step':i,
+        'start':bounds[i,0],
+        'settled':bounds[i,1],
+        'end':bounds[i,2],
+        'settle_time':bounds[i,1] - bounds[i,0],
+        'mean':{},
+        'std':{},
+        'flow_error':{},
+    } for i in range(len(bounds))]
+
+    for name in log:
+        if name == 'Time' or binary_log.is_time(name):
+            continue
+        t,x = channel(log,name)
+        # Sums of squares lose precision on a large offset, so work relative
+        # to the mean of the whole channel.
+        offset = numpy.mean(x) if len(x) else 0
+        count,total,squares = _Sums(t,x - offset,starts,ends)
+        with numpy.errstate(invalid='ignore',divide='ignore'):
+            mean = total/count
+            std = numpy.sqrt(numpy.maximum(squares/count - mean**2,0))
+            mean = mean + offset
+        for i in range(len(bounds)):
+            stats[i]['mean'][name] = mean[i]
+            stats[i]['std'][name] = std[i]
+
+    for gas,setpoints in flow.items():
+        if gas not in log:
+            continue
+        t,x = channel(log,gas)
+        # Index the setpoint of the step each sample falls in, then sum the
+        # errors over the hold part of each step.
+        setpoint = numpy.asarray(setpoints,dtype=float)
+        step = numpy.clip(numpy.searchsorted(starts,t,side='right') - 1,0,
+            len(setpoint) - 1)
+        count,total,squares = _Sums(t,x - setpoint[step],settles,ends)
+        with numpy.errstate(invalid='ignore',divide='ignore'):
+            mean = total/count
+            rms = numpy.sqrt(squares/count)
+        for i in range(len(bounds)):
+            stats[i]['flow_error'][gas] = {'setpoint':setpoint[i],
+                'mean':mean[i],'rms':rms[i]}
+
+    if 'Temp' in log and len(temps):
+        t,x = channel(log,'Temp')
+        for i in range(len(bounds)):
+            inside = slice(*numpy.searchsorted(t,(starts[i],ends[i])))
+            before = numpy.searchsorted(t,starts[i]) - 1
+            if numpy.isnan(starts[i]) or inside.start == inside.stop:
+                stats[i]['overshoot'] = numpy.nan
+                continue
+            # The direction of the change decides which side is overshoot.
+            previous = x[before] if before >= 0 else x[inside][0]
+            if temps[i] >= previous:
+                overshoot = numpy.max(x[inside]) - temps[i]
+            else:
+                overshoot = temps[i] - numpy.min(x[inside])
+            stats[i]['overshoot'] = max(overshoot,0)
+
+    if 'Press' in log:
+        t,x = channel(log,'Press')
+        for i in range(len(bounds)):
+            inside = slice(*numpy.searchsorted(t,(starts[i],ends[i])))
+            step_time = t[inside]
+            step_press = x[inside]
+            if len(step_press) < 2:
+                stats[i]['press_drift'] = numpy.nan
+                stats[i]['press_change'] = numpy.nan
+                continue
+            # Least squares slope about the step means.
+            step_time = step_time - step_time.mean()
+            stats[i]['press_drift'] = numpy.dot(step_time,
+                step_press - step_press.mean())/numpy.dot(step_time,step_time)
+            stats[i]['press_change'] = step_press[-1] - step_press[0]
+    return stats
+
+def _Sums(times,values,starts,ends):
+    '''
+    Counts and sums the values, and their squares, between each start and end
+    using cumulative sums so every interval costs the same.
+    '''
+    first = numpy.searchsorted(times,numpy.nan_to_num(starts,nan=numpy.inf))
+    last = numpy.searchsorted(times,ends)
+    last = numpy.maximum(first,last)
+    total = numpy.concatenate(([0],numpy.cumsum(values)))
+    squares = numpy.concatenate(([0],numpy.cumsum(values*values)))
+    return last - first,total[last] - total[first],\
+        squares[last] - squares[first]
+
+def _ParseRows(text,width):
+    '''
+    Parses the rows of a CSV log in one pass over the whole text.  A row of
+    the wrong width, e.g. one cut short by a crash, or with a value which is
+    not a number is dropped, so it cannot shift the rows after it.  Empty
+    values, left by logs with several rates, are NaN.
+    '''
+    data = numpy.frombuffer(text.replace(b'\r',b'').rstrip(b'\n') + b'\n',
+        dtype=numpy.uint8)
+    ends = numpy.flatnonzero(data == ord('\n'))
+    starts = numpy.concatenate(([0],ends[:-1] + 1))
+    # Count the commas and the bytes which cannot be part of a number on each
+    # line from where they fall between the line ends.
+    commas = numpy.flatnonzero(data == ord(','))
+    others = numpy.flatnonzero(~_number_bytes[data])
+    keep = (numpy.searchsorted(commas,ends) - \
+        numpy.searchsorted(commas,starts) == width - 1) & \
+        (numpy.searchsorted(others,ends) == numpy.searchsorted(others,starts)) \
+        & (ends > starts)
+    rows = int(keep.sum())
+    if not rows:
+        return numpy.empty((0,width))
+    kept = data[numpy.repeat(keep,ends - starts + 1)]
+    # Join the rows into one list of values and fill the empty values in with
+    # 0, to be replaced with NaN once parsed.
+    kept[kept == ord('\n')] = ord(',')
+    commas = numpy.flatnonzero(kept == ord(','))
+    empty = numpy.concatenate(([0],commas + 1)) == \
+        numpy.concatenate((commas,[len(kept)]))
+    empty = empty[:-1]
+    field_starts = numpy.concatenate(([0],commas[:-1] + 1))
+    kept = numpy.insert(kept[:-1],field_starts[empty],ord('0'))
+    # A value like 1.2.3 stops the parse short, with an error or, in older
+    # numpy, a warning.
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('error',DeprecationWarning)
+            values = numpy.fromstring(kept.tobytes(),sep=',')
+    except (ValueError,DeprecationWarning):
+        return _ReadRows(text,width)
+    if len(values) != rows*width:
+        return _ReadRows(text,width)
+    values[empty] = numpy.nan
+    return values.reshape(rows,width)
+
+def _ReadRows(text,width):
+    '''
+    Parses the rows of a CSV log one at a time, for the rare log whose
+    malformed values get past the checks in _ParseRows().
+    '''
+    rows = []
+    for row in csv.reader(text.decode('utf-8').splitlines()):
+        if len(row) != width:
+            continue
+        try:
+            rows.append([float(value) if value else numpy.nan
+                for value in row])
+        except ValueError:
+            continue
+    return numpy.array(rows,dtype=float).reshape(len(rows),width)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Prints the statistics of '
+        'each step of a recipe run.')
+    parser.add_argument('log',help='log of the run, CSV or binary')
+    parser.add_argument('recipe',help='recipe file the run used')
+    parser.add_argument('--tolerance',type=float,default=2,
+        help='settle tolerance of the run in degrees')
+    args = parser.parse_args()
+
+    times,temps,flow = load_schedule(args.recipe)
+    log = load_log(args.log)
+    for stats in step_stats(log,times,temps,flow,args.tolerance):
+        print('Step ' + str(stats['step'] + 1) + ': ' +
+            '%.1f-%.1f s, settled after %.1f s, overshoot %.1f C' %
+            (stats['start'],stats['end'],stats['settle_time'],
+            stats['overshoot'] if 'overshoot' in stats else numpy.nan))
+        for name in stats['mean']:
+            print('    %-10s mean %10.3f  std %8.3f' % (name,
+                stats['mean'][name],stats['std'][name]))
+        for gas,error in stats['flow_error'].items():
+            print('    %-10s setpoint %8.1f  error mean %8.3f  rms %8.3f' %
+                (gas,error['setpoint'],error['mean'],error['rms']))
+        if 'press_drift' in stats:
+            print('    pressure drift %.4f per s, change %.3f' %
+                (stats['press_drift'],stats['press_change']))
@@ -0,0 +1,59 @@
+'''
+Micro-benchmark comparing the table driven CRC in modbus.py against the bit by
+bit, string based CRC the furnace driver used previously.
+
+Run from the repository root:
+
+    python benchmarks/crc_benchmark.py
+'''
+import sys, timeit
+sys.path.append('.')
+from modbus import crc16
+
+def legacy_CRC(msg):
+    '''
+    The original furnace.__CRC implementation, kept here as the baseline.
+
+        Parameters:
+            msg (str or bytearray): the MODBUS message without the 2 final
+                CRC bytes
+        Returns:
+            error_check_code (str): the CRC result formatted as a four-
+                character string representing 2 bytes in hexadecimal
+    '''
+    if type(msg) is str:
+        msg = bytearray.fromhex(msg)
+    CRC = 0xFFFF
+    for num in msg:
+        CRC = CRC^num
+        for i in range(8):
+            flag = CRC%2
+            CRC = CRC >> 1
+            if flag:
+                CRC = CRC^0xA001
+    error_check_code = hex(CRC)[2:]
+    while len(error_check_code) < 4:
+        error_check_code = '0' + error_check_code
+    error_check_code = error_check_code[2:] + error_check_code[0:2]
+    error_check_code = error_check_code.upper()
+    return error_check_code
+
+# A QueryTemp command and a typical reply to it.
+frames = {
+    'command': '050300010001',
+    'reply': '0503020015',
+}
+
+if __name__ == '__main__':
+    number = 20000
+    for name in frames:
+        hex_frame = frames[name]
+        raw_frame = bytes.fromhex(hex_frame)
+        assert bytes.fromhex(legacy_CRC(hex_frame)) == crc16(raw_frame)
+        legacy = timeit.timeit(lambda: bytearray.fromhex(legacy_CRC(hex_frame)),
+            number=number)
+        table = timeit.timeit(lambda: crc16(raw_frame),number=number)
+        print(name + ' (' + str(len(raw_frame)) + ' bytes): legacy ' +
+            str(round(legacy/number*1e6,2)) + ' us, table ' +
+            str(round(table/number*1e6,2)) + ' us, ' +
+            str(round(legacy/table,1)) + 'x faster')
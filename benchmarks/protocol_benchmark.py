@@ -0,0 +1,205 @@
+'''
+Micro-benchmarks for the protocol code paths which run thousands of times per
+recipe: the furnace CRC, MFC frame building and validation, PX409 reply
+parsing, and complete request/response cycles against the emulator.
+
+Each case reports operations per second and percentiles of the per-call
+latency.  Results can be written to JSON and compared against an earlier run
+so regressions show up between versions.
+
+Run from the repository root:
+
+    python benchmarks/protocol_benchmark.py --output new.json
+    python benchmarks/protocol_benchmark.py --compare old.json
+'''
+import sys, time, json, argparse, platform, subprocess, io, contextlib
+sys.path.append('.')
+from modbus import crc16
+from equipment import MFC, furnace, pressure_trans
+from emulator import emulator
+
+def measure(function,batch=100,samples=200,warmup=10):
+    '''
+    Times a function.  The throughput is timed over batches of calls, so the
+    timer overhead is negligible; the latency percentiles come from as many
+    calls again timed one by one, less the cost of reading the timer.
+
+        Parameters:
+            function (function): takes no arguments
+            batch (int): calls per timed batch, larger for faster functions so
+                the timer overhead is negligible
+            samples (int): number of timed batches
+            warmup (int): untimed batches run first
+        Returns:
+            result (dict): ops_per_sec and the p50, p90, p99 and max per-call
+                latency in microseconds
+    '''
+    clock = time.perf_counter
+    for i in range(warmup):
+        for j in range(batch):
+            function()
+    total = 0
+    for i in range(samples):
+        start = clock()
+        for j in range(batch):
+            function()
+        total = total + clock() - start
+    # The cost of reading the timer, taken off each call timed on its own.
+    reads = []
+    for i in range(1000):
+        start = clock()
+        reads.append(clock() - start)
+    overhead = sorted(reads)[len(reads)//2]
+    times = []
+    for i in range(samples*batch):
+        start = clock()
+        function()
+        times.append(max(clock() - start - overhead,0))
+    times.sort()
+    def percentile(p):
+        return times[min(int(p/100*len(times)),len(times)-1)]*1e6
+    return {
+        'ops_per_sec':samples*batch/total,
+        'p50_us':percentile(50),
+        'p90_us':percentile(90),
+        'p99_us':percentile(99),
+        'max_us':times[-1]*1e6,
+    }
+
+def protocol_cases():
+    '''
+    Builds the functions timed for the protocol layer, without any I/O.
+
+        Parameters:
+            None
+        Returns:
+            cases (dict): name -> function taking no arguments
+    '''
+    mfc = MFC(103,port='unused')
+    press = pressure_trans(123,port='unused')
+    query = bytes.fromhex('050300010003')
+    reply = bytes.fromhex('05030600150016001e')
+    reply = reply + crc16(reply)
+    mfc_reply = '@@@103ACK100.025;'
+    mfc_reply = mfc_reply + ('%02X' % (sum(mfc_reply.encode('ascii')) & 0xFF))
+    mfc_raw = mfc_reply.encode('ascii')
+    press_reply = '@123 745.563\r\n>'
+    # The private methods are reached through their mangled names.
+    return {
+        'crc16_command':lambda: crc16(query),
+        'crc16_reply':lambda: crc16(memoryview(reply)[:-2]),
+        'mfc_build_command':lambda: mfc._MFC__BuildCommand('SX!',100.0),
+        'mfc_cached_command':lambda: mfc._Frame('SX!',100.0),
+        'mfc_query_frame':lambda: mfc._Frame('FX?'),
+        'mfc_command_checksum':lambda: mfc._MFC__CommandChecksum('@@@103FX?;'),
+        'mfc_validate_response':lambda: mfc._MFC__ValidateResponse(mfc_reply),
+        'mfc_parse_reply':lambda: mfc._ParseReply(mfc_raw),
+        'press_parse_pressure':lambda: press._ParsePressure(press_reply),
+    }
+
+def loopback_cases(port):
+    '''
+    Builds the functions timed for complete request/response cycles against
+    an emulator with no added latency.
+
+        Parameters:
+            port (str): the emulator's pseudo-terminal
+        Returns:
+            cases (dict): name -> function taking no arguments
+    '''
+    mfc = MFC(103,port=port)
+    oven = furnace(5,port=port)
+    press = pressure_trans(123,port=port)
+    return {
+        'cycle_mfc_query_flow':mfc.QueryFlow,
+        'cycle_mfc_set_flow':lambda: mfc.SetFlow(100),
+        'cycle_furnace_query_temp':oven.QueryTemp,
+        'cycle_furnace_query_process':oven.QueryProcess,
+        'cycle_furnace_set_temp':lambda: oven.SetTemp(25),
+        'cycle_press_query_pressure':press.QueryPressure,
+    }
+
+def run(quick=False):
+    '''
+    Runs every case.
+
+        Parameters:
+            quick (bool): take fewer samples, for a fast sanity check
+        Returns:
+            report (dict): metadata and the result of each case
+    '''
+    samples = 20 if quick else 200
+    results = {}
+    for name,function in protocol_cases().items():
+        results[name] = measure(function,batch=100,samples=samples)
+
+    sim = emulator(latency=0)
+    sim.add_mfc(103)
+    sim.add_furnace(5)
+    sim.add_pressure_trans(123)
+    port = sim.start()
+    try:
+        # The drivers print every reading, which would dominate the timings.
+        with contextlib.redirect_stdout(io.StringIO()):
+            for name,function in loopback_cases(port).items():
+                results[name] = measure(function,batch=1,samples=samples,
+                    warmup=5)
+    finally:
+        sim.stop()
+
+    try:
+        commit = subprocess.run(['git','rev-parse','--short','HEAD'],
+            capture_output=True,text=True).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'timestamp':time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit':commit,
+        'python':platform.python_version(),
+        'machine':platform.machine(),
+        'results':results,
+    }
+
+def print_report(report,baseline=None):
+    '''
+    Prints a table of the results, with the change in throughput against a
+    baseline report if one is given.
+
+        Parameters:
+            report (dict): as returned by run()
+            baseline (dict): an earlier report, or None
+        Returns:
+            None
+    '''
+    header = '%-30s %12s %10s %10s %10s' % ('case','ops/s','p50 us',
+        'p90 us','p99 us')
+    if baseline:
+        header = header + ' %10s' % 'vs base'
+    print(header)
+    for name,result in report['results'].items():
+        line = '%-30s %12.0f %10.2f %10.2f %10.2f' % (name,
+            result['ops_per_sec'],result['p50_us'],result['p90_us'],
+            result['p99_us'])
+        if baseline and name in baseline['results']:
+            ratio = result['ops_per_sec']/baseline['results'][name]['ops_per_sec']
+            line = line + ' %9.2fx' % ratio
+        print(line)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--output',help='write the results to this JSON file')
+    parser.add_argument('--compare',help='JSON file from an earlier run')
+    parser.add_argument('--quick',action='store_true',
+        help='take fewer samples')
+    args = parser.parse_args()
+
+    report = run(args.quick)
+    baseline = None
+    if args.compare:
+        with open(args.compare,'r') as file:
+            baseline = json.load(file)
+    print_report(report,baseline)
+    if args.output:
+        with open(args.output,'w') as file:
+            json.dump(report,file,indent=2)
@@ -0,0 +1,226 @@
+'''
+Compact binary format for the recipe logs.  A log is a short self-describing
+header followed by fixed-width records, one per sample, so a whole run can be
+memory-mapped straight into NumPy arrays without parsing any text.
+
+Layout:
+
+    magic (8 bytes) -> b'CVDLOG\\x00\\x00'
+    version (uint16), reserved (uint16), JSON length (uint32), little-endian
+    JSON -> {'fields': [[name, dtype], ...], 'metadata': {...}}, padded with
+        spaces so the records start on a 64 byte boundary
+    records -> packed rows of the fields, appended as the run goes on
+
+Time and the per-channel acquisition times (columns ending in _time) are stored
+as float64 and every other channel as a float32, which holds every reading the
+devices report.  Missing readings are stored as NaN.  A
+record cut short by a crash is ignored when the log is loaded.
+
+Functions:
+
+    log_dtype(names) -> record type for the given columns
+    is_time(name) -> whether a column holds times
+    header(dtype,metadata) -> header bytes
+    read_header(file) -> record type, header length and metadata
+    pack(samples,dtype) -> record bytes for a list of samples
+    load(filename) -> memory-mapped structured array of the records
+    columns(filename) -> dict of column name -> array
+    to_csv(filename,csv_filename) -> writes the CSV layout used by the logs
+    from_csv(csv_filename,filename) -> converts a CSV log
+'''
+import struct, json, csv, time, math, os
+import numpy
+
+magic = b'CVDLOG\x00\x00'
+version = 1
+extension = '.cvdlog'
+time_dtype = '<f8'
+time_suffix = '_time'
+value_dtype = '<f4'
+alignment = 64
+_prefix = struct.Struct('<8sHHI')
+
+def log_dtype(names):
+    '''
+    Builds the record type for a log.
+
+        Parameters:
+            names (list): column names in file order
+        Returns:
+            dtype (numpy.dtype): structured record type
+    '''
+    return numpy.dtype([(name,time_dtype if is_time(name) else value_dtype)
+        for name in names])
+
+def is_time(name):
+    '''
+    Returns whether a column holds times rather than readings.
+
+        Parameters:
+            name (str): column name
+        Returns:
+            is_time (bool)
+    '''
+    return name == 'Time' or name.endswith(time_suffix)
+
+def header(dtype,metadata=None):
+    '''
+    Builds the header written at the start of a log.
+
+        Parameters:
+            dtype (numpy.dtype): record type of the log
+            metadata (dict): anything JSON serializable to keep with the log
+        Returns:
+            header (bytes): a multiple of 64 bytes long
+    '''
+    if metadata is None:
+        metadata = {}
+    metadata = dict(metadata)
+    metadata.setdefault('created',time.strftime('%Y-%m-%dT%H:%M:%S'))
+    fields = [[name,dtype.fields[name][0].str] for name in dtype.names]
+    text = json.dumps({'fields':fields,'metadata':metadata}).encode('utf-8')
+    length = _prefix.size + len(text)
+    text = text + b' '*(-length % alignment)
+    return _prefix.pack(magic,version,0,len(text)) + text
+
+def read_header(file):
+    '''
+    Reads the header at the start of a log.
+
+        Parameters:
+            file (file): log opened in binary mode, positioned at the start
+        Returns:
+            dtype (numpy.dtype): record type of the log
+            length (int): length of the header in bytes
+            metadata (dict): metadata stored with the log
+    '''
+    prefix = file.read(_prefix.size)
+    if len(prefix) < _prefix.size:
+        raise ValueError('File is too short to be a binary log.')
+    file_magic,file_version,reserved,text_length = _prefix.unpack(prefix)
+    if file_magic != magic:
+        raise ValueError('File is not a binary log.')
+    if file_version > version:
+        raise ValueError('Binary log version ' + str(file_version) +
+            ' is newer than this reader.')
+    info = json.loads(file.read(text_length).decode('utf-8'))
+    dtype = numpy.dtype([tuple(field) for field in info['fields']])
+    return dtype,_prefix.size + text_length,info['metadata']
+
+def pack(samples,dtype):
+    '''
+    Packs samples into records.
+
+        Parameters:
+            samples (list): dicts of column name -> value.  Columns not in the
+                record type are ignored and missing ones are stored as NaN.
+            dtype (numpy.dtype): record type of the log
+        Returns:
+            records (bytes)
+    '''
+    nan = math.nan
+    rows = [tuple(nan if sample.get(name) is None else sample[name]
+        for name in dtype.names) for sample in samples]
+    return numpy.array(rows,dtype=dtype).tobytes()
+
+def load(filename):
+    '''
+    Memory-maps the records of a log.  Nothing is read until it is used.
+
+        Parameters:
+            filename (str): filename including the file extension
+        Returns:
+            records (numpy.ndarray): read-only structured array, one element
+                per sample, with a field per column
+    '''
+    with open(filename,'rb') as file:
+        dtype,length,metadata = read_header(file)
+    count = (os.path.getsize(filename) - length)//dtype.itemsize
+    if count == 0:
+        # numpy cannot map an empty region.
+        return numpy.zeros(0,dtype=dtype)
+    return numpy.memmap(filename,dtype=dtype,mode='r',offset=length,
+        shape=(count,))
+
+def columns(filename):
+    '''
+    Loads a log as separate column arrays.
+
+        Parameters:
+            filename (str): filename including the file extension
+        Returns:
+            columns (dict): column name -> numpy.ndarray view of the log
+    '''
+    records = load(filename)
+    return {name:records[name] for name in records.dtype.names}
+
+def to_csv(filename,csv_filename):
+    '''
+    Converts a binary log to the CSV layout written by recipe.logging().
+
+        Parameters:
+            filename (str): binary log
+            csv_filename (str): CSV file to write
+        Returns:
+            None
+    '''
+    records = load(filename)
+    names = records.dtype.names
+    with open(csv_filename,'w',newline='') as file:
+        log_writer = csv.writer(file)
+        log_writer.writerow(names)
+        for record in records:
+            log_writer.writerow([_Text(value) for value in record])
+
+def _Text(value):
+    '''
+    Formats a value the way the CSV logs are written.  The numpy scalars print
+    the shortest text which reads back to the same value, so 745.686 stays
+    745.686 rather than gaining a float32 tail.
+    '''
+    if math.isnan(value):
+        return ''
+    if value == int(value):
+        return str(int(value))
+    return str(value)
+
+def from_csv(csv_filename,filename,metadata=None):
+    '''
+    Converts a CSV log to a binary log.
+
+        Parameters:
+            csv_filename (str): CSV log with a header row
+            filename (str): binary log to write
+            metadata (dict): metadata to store with the log
+        Returns:
+            None
+    '''
+    with open(csv_filename,'r',newline='') as file:
+        reader = csv.reader(file)
+        names = next(reader)
+        dtype = log_dtype(names)
+        rows = [tuple(float(value) if value else math.nan for value in row)
+            for row in reader if row]
+    if metadata is None:
+        metadata = {}
+    metadata = dict(metadata)
+    metadata.setdefault('source',os.path.basename(csv_filename))
+    with open(filename,'wb') as file:
+        file.write(header(dtype,metadata))
+        file.write(numpy.array(rows,dtype=dtype).tobytes())
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Converts recipe logs '
+        'between the CSV layout and the binary format.')
+    parser.add_argument('source',help='log to convert; binary logs are '
+        'recognised by their header')
+    parser.add_argument('destination',help='file to write')
+    args = parser.parse_args()
+
+    with open(args.source,'rb') as file:
+        is_binary = file.read(len(magic)) == magic
+    if is_binary:
+        to_csv(args.source,args.destination)
+    else:
+        from_csv(args.source,args.destination)
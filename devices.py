@@ -0,0 +1,184 @@
+'''
+Map of the devices in the CVD system, read from a JSON file (devices.json next
+to this file by default), so the ports, addresses and line settings of the
+devices can be changed without touching the code.
+
+The file has two sections.  "buses" gives the framing of each serial port
+(bytesize, parity and stopbits, 8N1 if a port is not listed).  "devices" lists
+each device with its name, its protocol (the equipment class which talks to
+it: "MFC", "furnace" or "pressure_trans"), the port it is on, its address,
+optionally its baud rate, and for MFCs the other names a recipe column may use
+for the gas.  The furnace must be named "Furnace" and the pressure transducer
+"Press".
+
+Devices on different ports are on different buses, and are read in parallel
+while logging, so spreading them over several USB to RS-485 adapters shortens
+each poll.
+
+Classes:
+
+    device_config -> the devices of the system, read from a file
+'''
+import json, os
+from equipment import MFC, furnace, pressure_trans
+from rs485 import get_bus
+
+default_file = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    'devices.json')
+protocols = {'MFC':MFC,'furnace':furnace,'pressure_trans':pressure_trans}
+# Devices every system has, and the protocol each must use.
+required = {'Furnace':'furnace','Press':'pressure_trans'}
+
+class device_config:
+    '''
+    A class which reads the device map and creates the devices in it.
+
+    ...
+
+    Attributes
+    ----------
+    filename: str
+        the file the map was read from
+    buses: dict
+        port -> line settings of the port
+    devices: dict
+        device name -> its entry in the file
+
+    Public Methods
+    --------------
+    name(alias)
+    create(name,protocol)
+    ports()
+    '''
+
+    def __init__(self,filename=default_file) -> None:
+        '''
+        Raises ValueError listing every problem found in the file.
+        '''
+        self.filename = filename
+        with open(filename,'r') as file:
+            config = json.load(file)
+        self.buses = config.get('buses',{})
+        self.devices = {}
+        self._aliases = {}
+        problems = []
+        used = {}
+        # Devices left out of the map because their entries are unusable.
+        rejected = set()
+        for i,entry in enumerate(config.get('devices',[])):
+            label = entry.get('name','Device ' + str(i + 1))
+            missing = [key for key in ('name','protocol','port','address')
+                if key not in entry]
+            if missing:
+                problems.append(label + ': missing ' + ', '.join(missing) + '.')
+                rejected.add(label)
+                continue
+            if not isinstance(entry['name'],str):
+                problems.append(label + ': the name must be a string.')
+                rejected.add(label)
+                continue
+            if entry['protocol'] not in protocols:
+                problems.append(label + ': unknown protocol ' +
+                    str(entry['protocol']) + '.')
+            if not isinstance(entry['port'],str):
+                problems.append(label + ': the port must be a string.')
+                rejected.add(label)
+                continue
+            # bool is an int too, but never a valid address or baud rate.
+            for key in ('address','baudrate'):
+                if key in entry and (type(entry[key]) is not int or
+                    entry[key] < 0):
+                    problems.append(label + ': the ' + key + ' must be a '
+                        'whole number, not ' + json.dumps(entry[key]) + '.')
+            if type(entry['address']) is not int:
+                rejected.add(label)
+                continue
+            aliases = entry.get('aliases',[])
+            if not isinstance(aliases,list) or \
+                not all(isinstance(alias,str) for alias in aliases):
+                problems.append(label + ': the aliases must be a list of '
+                    'strings.')
+                aliases = []
+            location = (entry['port'],entry['address'])
+            if location in used:
+                problems.append(label + ': address ' + str(entry['address']) +
+                    ' on ' + entry['port'] + ' is already used by ' +
+                    used[location] + '.')
+            used[location] = label
+            for alias in [entry['name']] + aliases:
+                if alias in self._aliases:
+                    problems.append(label + ': the name ' + alias +
+                        ' is already used by ' + self._aliases[alias] + '.')
+                self._aliases[alias] = entry['name']
+            self.devices[entry['name']] = entry
+        for name,protocol in required.items():
+            if name in rejected:
+                continue
+            if name not in self.devices:
+                problems.append('There is no device named ' + name + '.')
+            elif self.devices[name]['protocol'] != protocol:
+                problems.append(name + ': the protocol must be ' + protocol +
+                    '.')
+        for port,settings in self.buses.items():
+            unknown = set(settings) - {'bytesize','parity','stopbits'}
+            if unknown:
+                problems.append(port + ': unknown line settings ' +
+                    ', '.join(sorted(unknown)) + '.')
+        if problems:
+            raise ValueError('Invalid device file ' + filename + ':\n' +
+                '\n'.join(problems))
+
+    def name(self,alias):
+        '''
+        Returns the name of a device from any of its names, e.g. 'Helium'
+        from 'He'.
+
+            Parameters:
+                alias (str): a name or alias of a device
+            Returns:
+                name (str)
+
+        Raises KeyError if no device has that name.
+        '''
+        if alias not in self._aliases:
+            raise KeyError('No device named ' + alias + ' in ' +
+                self.filename + '.')
+        return self._aliases[alias]
+
+    def create(self,alias,protocol=None):
+        '''
+        Creates the object which talks to a device, on the bus of its port.
+
+            Parameters:
+                alias (str): a name or alias of the device
+                protocol (str): the protocol the device must use, None for
+                    any
+            Returns:
+                device (MFC, furnace or pressure_trans object)
+
+        Raises KeyError if no device has that name, and ValueError if it uses
+        another protocol.
+        '''
+        entry = self.devices[self.name(alias)]
+        if protocol is not None and entry['protocol'] != protocol:
+            raise ValueError(alias + ' is a ' + entry['protocol'] +
+                ' device, not ' + protocol + '.')
+        port = entry['port']
+        # Creates the bus with the port's line settings before the device
+        # asks for it.
+        get_bus(port,**self.buses.get(port,{}))
+        device = protocols[entry['protocol']](entry['address'],port=port)
+        if 'baudrate' in entry:
+            device.baudrate = entry['baudrate']
+        return device
+
+    def ports(self):
+        '''
+        Returns the ports which have devices on them.
+
+            Parameters:
+                None
+            Returns:
+                ports (list)
+        '''
+        return sorted(set(entry['port'] for entry in self.devices.values()))
@@ -0,0 +1,458 @@
+'''
+Emulates the devices on the RS-485 network of the tube furnace CVD system on a
+Linux pseudo-terminal, so the drivers in equipment.py can be benchmarked and
+tested without the furnace rig.  The emulator speaks the same three protocols
+as the real hardware:
+
+    MFCs -> '@@@<addr><command>;' frames followed by a two character checksum
+    furnace -> MODBUS RTU with CRC-16 (functions 03, 07 and 10)
+    PX409 pressure transducer -> '#<addr>P' ASCII queries
+
+Replies can be delayed, jittered and corrupted with dropped bytes, leading
+garbage and bad checksums.  Flows follow their setpoints with a first order lag
+and the furnace ramps towards its setpoint at a fixed rate.  The faults and
+the measurement noise all come from one generator, so an emulator given a seed
+replays the same run.
+
+Point the equipment classes at the emulator through their port argument:
+
+    sim = emulator()
+    sim.add_mfc(103)
+    sim.add_furnace(5)
+    sim.add_pressure_trans(123)
+    sim.start()
+    furnace(5,port=sim.port).QueryTemp()
+
+Or run this file to leave an emulator with the default devices running.
+
+Classes:
+
+    emulator -> the pseudo-terminal and the device models behind it
+'''
+import os, tty, select, threading, time, random, math, struct
+from modbus import crc16, furnace_registers
+
+class _mfc_model:
+    '''
+    A mass flow controller whose flow follows its setpoint with a first order
+    lag.
+    '''
+
+    def __init__(self,address,flow=0,time_constant=1.0,noise=0,
+        rng=random) -> None:
+        self.address = address
+        self.setpoint = flow
+        self.flow = flow
+        self.time_constant = time_constant
+        self.noise = noise
+        self._random = rng
+        self._last = time.monotonic()
+
+    def update(self,now):
+        '''
+        Advances the flow to the current time.
+        '''
+        dt = now - self._last
+        self._last = now
+        self.flow = self.setpoint + (self.flow - self.setpoint)* \
+            math.exp(-dt/self.time_constant)
+
+    def handle(self,body):
+        '''
+        Answers a command, given the text between the address and the ';'.
+        Returns the text to put between 'ACK' and ';', or None for a NAK.
+        '''
+        command,value = body[:3],body[3:]
+        if command == 'FX?':
+            return '%.3f' % (self.flow + self._random.gauss(0,self.noise))
+        elif command == 'SX!':
+            self.setpoint = float(value)
+            return value
+        elif command == 'OM?':
+            return 'RUN'
+        elif command == 'CA!':
+            self.address = int(value)
+            return value
+        return None
+
+class _furnace_model:
+    '''
+    A furnace controller which ramps towards its setpoint at a fixed rate and
+    reports a heater output proportional to the remaining error.
+    '''
+
+    def __init__(self,address,temp=25,ramp_rate=1.0,fields=None) -> None:
+        self.address = address
+        self.fields = fields if fields is not None else tuple(furnace_registers)
+        self.temp = temp
+        self.setpoint = temp
+        self.ramp_rate = ramp_rate
+        self._last = time.monotonic()
+
+    def update(self,now):
+        '''
+        Advances the temperature to the current time.
+        '''
+        dt = now - self._last
+        self._last = now
+        step = self.ramp_rate*dt
+        error = self.setpoint - self.temp
+        if abs(error) <= step:
+            self.temp = self.setpoint
+        else:
+            self.temp = self.temp + math.copysign(step,error)
+
+    def registers(self):
+        '''
+        Returns the current holding register values keyed by address.
+        '''
+        output = min(max((self.setpoint - self.temp)*2,0),100)
+        values = {
+            'Temp':int(round(self.temp)),
+            'Setpoint':int(self.setpoint),
+            'Output':int(round(output*furnace_registers['Output'][1])),
+            'Alarm':0,
+        }
+        return {furnace_registers[name][0]:values[name] for name in self.fields}
+
+class _pressure_model:
+    '''
+    A PX409 pressure transducer reading a constant pressure plus noise.
+    '''
+
+    def __init__(self,address,pressure=745.0,noise=0,rng=random) -> None:
+        self.address = address
+        self.pressure = pressure
+        self.noise = noise
+        self._random = rng
+
+    def update(self,now):
+        '''
+        The pressure is constant, so there is nothing to advance.
+        '''
+        pass
+
+    def read(self):
+        '''
+        Returns the pressure to report, with its noise.
+        '''
+        return self.pressure + self._random.gauss(0,self.noise)
+
+class emulator:
+    '''
+    A class which opens a pseudo-terminal and answers the frames written to it
+    as the networked devices would.
+
+    ...
+
+    Attributes
+    ----------
+    port: str
+        path of the pseudo-terminal the drivers should open, None until start()
+    latency: float
+        delay before each reply in seconds
+    jitter: float
+        the reply delay varies uniformly by up to this many seconds either way
+    drop_rate: float
+        probability of each reply byte being lost
+    garbage_rate: float
+        probability of a reply being preceded by a few random bytes
+    checksum_error_rate: float
+        probability of a reply having a corrupted checksum or CRC
+    frames: int
+        number of frames answered so far
+
+    Public Methods
+    --------------
+    add_mfc(address)
+    add_furnace(address)
+    add_pressure_trans(address)
+    start()
+    stop()
+    '''
+
+    def __init__(self,latency=0.005,jitter=0,drop_rate=0,garbage_rate=0,
+        checksum_error_rate=0,seed=None) -> None:
+        self.port = None
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.garbage_rate = garbage_rate
+        self.checksum_error_rate = checksum_error_rate
+        self.frames = 0
+        self._random = random.Random(seed)
+        self._mfcs = {}
+        self._furnaces = {}
+        self._transducers = {}
+        self._buffer = bytearray()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add_mfc(self,address,flow=0,time_constant=1.0,noise=0):
+        '''
+        Adds an MFC to the network.
+
+            Parameters:
+                address (int): the MFC address
+                flow (float): initial flow and setpoint in sccm
+                time_constant (float): time constant of the flow response in s
+                noise (float): standard deviation of the reported flow
+            Returns:
+                None
+        '''
+        self._mfcs[str(address)] = _mfc_model(address,flow,time_constant,noise,
+            self._random)
+
+    def add_furnace(self,address,temp=25,ramp_rate=1.0,fields=None):
+        '''
+        Adds a furnace controller to the network.
+
+            Parameters:
+                address (int): the MODBUS address
+                temp (float): initial temperature and setpoint in C
+                ramp_rate (float): heating and cooling rate in C/s
+                fields (tuple): names from modbus.furnace_registers of the
+                    registers the controller has, all of them by default;
+                    reading any other register gets an exception reply
+            Returns:
+                None
+        '''
+        self._furnaces[address] = _furnace_model(address,temp,ramp_rate,fields)
+
+    def add_pressure_trans(self,address,pressure=745.0,noise=0):
+        '''
+        Adds a PX409 pressure transducer to the network.
+
+            Parameters:
+                address (int): the transducer address
+                pressure (float): the pressure to report
+                noise (float): standard deviation of the reported pressure
+            Returns:
+                None
+        '''
+        self._transducers[str(address)] = _pressure_model(address,pressure,
+            noise,self._random)
+
+    def start(self):
+        '''
+        Opens the pseudo-terminal and starts answering frames in a background
+        thread.
+
+            Parameters:
+                None
+            Returns:
+                port (str): path of the pseudo-terminal
+        '''
+        self._master,self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.__Serve,daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        '''
+        Stops answering frames and closes the pseudo-terminal.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+            os.close(self._master)
+            os.close(self._slave)
+
+    def __Serve(self):
+        '''
+        Reads whatever the drivers write and answers each complete frame.
+        '''
+        while not self._stop.is_set():
+            ready,_,_ = select.select([self._master],[],[],0.05)
+            if not ready:
+                continue
+            try:
+                self._buffer += os.read(self._master,1024)
+            except OSError:
+                return
+            frame = self.__NextFrame()
+            while frame is not None:
+                reply = self.__Answer(frame)
+                if reply:
+                    self.__Send(reply)
+                frame = self.__NextFrame()
+
+    def __NextFrame(self):
+        '''
+        Removes the next complete frame from the receive buffer.  Returns None
+        if no complete frame has arrived yet.
+        '''
+        buffer = self._buffer
+        while buffer and buffer[0] in b'\r\n':
+            del buffer[0]
+        if not buffer:
+            return None
+        if buffer[0] == ord('@'):
+            end = buffer.find(b';')
+            if end < 0 or len(buffer) < end + 3:
+                return None
+            length = end + 3
+        elif buffer[0] == ord('#'):
+            end = buffer.find(b'\r\n')
+            if end < 0:
+                return None
+            length = end + 2
+        else:
+            # MODBUS RTU has no delimiters, so the length comes from the
+            # function code.
+            if len(buffer) < 2:
+                return None
+            if buffer[1] == 0x03:
+                length = 8
+            elif buffer[1] == 0x07:
+                length = 4
+            elif buffer[1] == 0x10:
+                if len(buffer) < 7:
+                    return None
+                length = 9 + buffer[6]
+            else:
+                # Unknown frame, resynchronize by dropping the buffer.
+                buffer.clear()
+                return None
+            if len(buffer) < length:
+                return None
+        frame = bytes(buffer[:length])
+        del buffer[:length]
+        return frame
+
+    def __Answer(self,frame):
+        '''
+        Builds the reply to a complete frame, or returns None if the addressed
+        device would stay silent.
+        '''
+        self.frames = self.frames + 1
+        now = time.monotonic()
+        if frame[0] == ord('@'):
+            return self.__AnswerMFC(frame,now)
+        elif frame[0] == ord('#'):
+            return self.__AnswerPressure(frame,now)
+        return self.__AnswerModbus(frame,now)
+
+    def __AnswerMFC(self,frame,now):
+        '''
+        Answers an MFC frame, with a NAK if the command checksum is wrong.
+        '''
+        text = frame.decode('ascii',errors='ignore')
+        body = text[:text.index(';')+1]
+        body = body[body.rindex('@'):]
+        checksum = '%02X' % (sum(body.encode('ascii')) & 0xFF)
+        address = body[1:4]
+        model = self._mfcs.get(address)
+        if model is None:
+            return None
+        model.update(now)
+        returned = None
+        if text[-2:] == checksum:
+            returned = model.handle(body[4:-1])
+        if returned is None:
+            reply = '@@@' + address + 'NAK;'
+        else:
+            reply = '@@@' + address + 'ACK' + returned + ';'
+        checksum = '%02X' % (sum(reply.encode('ascii')) & 0xFF)
+        if self._random.random() < self.checksum_error_rate:
+            checksum = '%02X' % ((int(checksum,16) + 1) & 0xFF)
+        return (reply + checksum).encode('ascii')
+
+    def __AnswerPressure(self,frame,now):
+        '''
+        Answers a PX409 query.
+        '''
+        text = frame.decode('ascii',errors='ignore').strip()
+        for address in self._transducers:
+            if text.startswith('#' + address):
+                model = self._transducers[address]
+                command = text[1+len(address):]
+                break
+        else:
+            return None
+        model.update(now)
+        if command == 'P':
+            pressure = model.read()
+            reply = '@' + address + ' ' + ('%.3f' % pressure) + '\r\n>'
+        elif command == 'ENQ':
+            reply = '@' + address + ' PX409-485\r\n>'
+        else:
+            return None
+        if self._random.random() < self.checksum_error_rate:
+            # There is no checksum, so corrupt the address instead.
+            reply = reply.replace('@','!',1)
+        return reply.encode('ascii')
+
+    def __AnswerModbus(self,frame,now):
+        '''
+        Answers a MODBUS RTU frame.  Frames with a bad CRC get no reply, as on
+        a real MODBUS network.
+        '''
+        model = self._furnaces.get(frame[0])
+        if model is None or crc16(frame[:-2]) != frame[-2:]:
+            return None
+        model.update(now)
+        function_code = frame[1]
+        if function_code == 0x03:
+            start,count = struct.unpack_from('>HH',frame,2)
+            registers = model.registers()
+            if all(start+i in registers for i in range(count)):
+                values = [registers[start+i] for i in range(count)]
+                reply = bytes((frame[0],0x03,2*count)) + \
+                    struct.pack('>' + str(count) + 'H',*values)
+            else:
+                # Illegal data address.
+                reply = bytes((frame[0],0x03 + 128,2))
+        elif function_code == 0x10:
+            start,count = struct.unpack_from('>HH',frame,2)
+            if start == 0x0077:
+                model.setpoint = struct.unpack_from('>H',frame,7)[0]
+            reply = frame[:6]
+        elif function_code == 0x07:
+            reply = bytes((frame[0],0x07,0))
+        else:
+            reply = bytes((frame[0],function_code + 128,1))
+        CRC = crc16(reply)
+        if self._random.random() < self.checksum_error_rate:
+            CRC = bytes((CRC[0] ^ 0xFF,CRC[1]))
+        return reply + CRC
+
+    def __Send(self,reply):
+        '''
+        Writes a reply after the configured latency, applying the faults.
+        '''
+        delay = self.latency
+        if self.jitter:
+            delay = delay + self._random.uniform(-self.jitter,self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self.drop_rate:
+            reply = bytes(byte for byte in reply
+                if self._random.random() >= self.drop_rate)
+        if self._random.random() < self.garbage_rate:
+            garbage = bytes(self._random.randrange(256)
+                for i in range(self._random.randint(1,4)))
+            reply = garbage + reply
+        os.write(self._master,reply)
+
+if __name__ == '__main__':
+    sim = emulator()
+    for address in (101,102,103,104):
+        sim.add_mfc(address)
+    sim.add_furnace(5)
+    sim.add_pressure_trans(123)
+    print('Emulator listening on ' + sim.start())
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sim.stop()
@@ -1,4 +1,7 @@
-import serial
+import serial, struct, functools, time
+from rs485 import get_bus, rtt_estimator
+from metrics import recorder
+from modbus import crc16, register_span, decode_registers
 '''
 Python classes for the various devices connected to the RS-485 network for the
 tube furnace CVD system.
@@ -8,8 +11,27 @@ Classes:
     MFC -> mass flow controller
     furnace -> tube furnace
     pressure_trans -> pressure transducer
+    modbus_exception -> a MODBUS exception reply from the furnace
 '''
 
+class modbus_exception(Warning):
+    '''
+    Raised when the furnace answers with a MODBUS exception reply, e.g. for a
+    register it does not have.  The furnace did answer, so the command is not
+    retried.
+
+    ...
+
+    Attributes
+    ----------
+    code: int
+        the MODBUS exception code
+    '''
+
+    def __init__(self,message,code) -> None:
+        super().__init__(message)
+        self.code = code
+
 class MFC:
     '''
     A class for the mass flow controllers in the system.  Includes methods 
@@ -21,9 +43,15 @@ class MFC:
     ----------
     address: int
         the address used for serial comms
-    ser: serial.Serial object
-        the serial object set up with the parameters for communication with the 
-        MFCs
+    bus: rs485.bus object
+        the shared bus object which owns the serial port the MFCs are on
+    baudrate: int
+        the baud rate used for communication with the MFCs
+    rtt: rs485.rtt_estimator object
+        tracks the MFC's response time and sets the read timeouts from it
+    query_frames: dict
+        the complete frames for the queries which take no value, built once
+        since they never change for a given MFC
 
     Public Methods
     --------------
@@ -33,10 +61,20 @@ class MFC:
     QueryOpMode()
     '''
 
-    def __init__(self,address) -> None:
+    # Lowest and highest flow set point accepted by a recipe, in sccm.
+    flow_limits = (0,1000)
+
+    def __init__(self,address,port='/dev/ttyUSB0') -> None:
         self.address = address
-        import serial
-        self.ser = serial.Serial(port='/dev/ttyUSB0',baudrate=9600,timeout=3)
+        self.baudrate = 9600
+        self.bus = get_bus(port)
+        self.rtt = rtt_estimator()
+        # Frames with a value, such as set points, are memoized as they are
+        # used.  Recipes only ever use a handful of distinct set points.  The
+        # cache is typed since 500 and 500.0 make different frames.
+        self._cached_command = functools.lru_cache(maxsize=32,typed=True)(self.__BuildCommand)
+        self.query_frames = {command_text:self.__BuildCommand(command_text,'')
+            for command_text in ('FX?','OM?')}
 
     def SetFlow(self,set_point):
         '''
@@ -46,12 +84,15 @@ class MFC:
                 set_point (float): the desired set point
             Returns:
                 None
+
+        Raises Warning if the MFC does not accept the set point.
         '''
         try:
             self.__SendCommand('SX!',set_point)
             print('Flow set to ' + str(set_point) + ' sccm.')
         except Warning:
-            print('Unsuccessful communication with MFC ' + str(self.address))
+            raise Warning('Unsuccessful communication with MFC ' +
+                str(self.address))
 
     def ChangeAddress(self,new_address):
         '''
@@ -78,9 +119,8 @@ class MFC:
                 flow_rate (float): the mass flow rate measured by the device
         '''
         try:
-            reply_text = self.__SendCommand('FX?')
-            print('Flow reported as ' + reply_text + 'sccm.')
-            flow_rate = float(reply_text)
+            flow_rate = self.__SendCommand('FX?',parse=float)
+            print('Flow reported as ' + str(flow_rate) + 'sccm.')
             return flow_rate
         except Warning:
             print('Unsuccessful communication with MFC ' + str(self.address))
@@ -103,7 +143,7 @@ class MFC:
             print('Unsuccessful communication with MFC ' + str(self.address))
             return False
 
-    def __SendCommand(self,command_text,command_value=''):
+    def __SendCommand(self,command_text,command_value='',parse=None):
         '''
         Send a command to an MFC object over serial connection.
 
@@ -113,45 +153,131 @@ class MFC:
                 command_value (str): an optional argument when an additional
                     value is required, such as the mass flow rate value when
                     setting a new mass flow rate
+                parse (function): optional, turns the returned text into the
+                    result; a reply it raises ValueError for is retried
             Returns:
                 returned_text (str): the portion of the returned serial message 
                     between the 'ACK', and the end of message character ';' -
-                    sometimes empty depending on the command.
+                    sometimes empty depending on the command; or what parse
+                    returned for it
         '''
-        command = self.__BuildCommand(command_text,command_value)
+        command = self._Frame(command_text,command_value)
+        device = 'MFC ' + str(self.address)
         send_status = False
         max_iter = 5
         comm_attempts = 0
+        start = time.monotonic()
         while not send_status:
             comm_attempts = comm_attempts + 1
             # print('Sending: ' + str(command))
-            self.ser.write(command)
-            reply = self.ser.read_until(expected=bytes(';','ascii'))
-            # append the checksum characters
-            reply = reply + self.ser.read(size=2)
-            reply = reply.decode('ascii',errors = 'ignore')
-            # print('Received: ' + str(reply))
-            # Try except statement to deal with the frequent weirdness
-            # at the start of the replies
             try:
-                pos = reply.rindex('@')
-                reply = '@@' + reply[pos:]
-            except ValueError:
-                pass
-            # print('Interpreted as: ' + str(reply))
-            
-            send_status = self.__ValidateResponse(reply)
-            
-            # Parse return message from the reply.
+                reply,rtt = self.bus.transaction(self.baudrate,
+                    lambda ser: self.__Exchange(ser,command),
+                    timeout=self.rtt.timeout(comm_attempts))
+            except Warning:
+                # The port itself failed, which the bus has already retried.
+                recorder.attempt(self.bus.port,self.baudrate,device,
+                    command_text,'timeout',None,len(command),0)
+                recorder.transaction(device,command_text,comm_attempts,
+                    time.monotonic()-start,False)
+                raise Warning('Unsuccessful communication with MFC ' + str(self.address))
+            returned_text = self._ParseReply(reply)
+            send_status = returned_text is not None
+            if send_status and parse is not None:
+                try:
+                    returned_text = parse(returned_text)
+                except ValueError:
+                    # The checksum passed but the value is garbled.
+                    send_status = False
             if send_status:
-                start_pos = reply.index('ACK')
-                end_pos = reply.index(';')
-                returned_text = reply[start_pos+3:end_pos]
+                self.rtt.update(rtt)
+                outcome = 'ok'
+            elif b';' not in reply:
+                outcome = 'timeout'
+            else:
+                outcome = 'checksum'
+            recorder.attempt(self.bus.port,self.baudrate,device,command_text,
+                outcome,rtt,len(command),len(reply))
+
+            if not send_status:
+                if comm_attempts > max_iter:
+                    recorder.transaction(device,command_text,comm_attempts,
+                        time.monotonic()-start,False)
+                    raise Warning('Unsuccessful communication with MFC ' + str(self.address))
+                time.sleep(self.rtt.backoff(comm_attempts))
+
+        recorder.transaction(device,command_text,comm_attempts,
+            time.monotonic()-start,True)
+        return returned_text
 
-            if comm_attempts > max_iter:
-                raise Warning('Unsuccessful communication with MFC ' + str(self.address))
+    def _Frame(self,command_text,command_value=''):
+        '''
+        Returns the complete frame for a command, either one of the prebuilt
+        query frames or one from the memoized cache.  Shared with the asyncio
+        drivers.
 
-        return returned_text
+            Parameters:
+                command_text (str): the unique command identifier
+                command_value (str): an optional value for the command
+            Returns:
+                command (ascii bytes): the complete command including checksum
+        '''
+        if command_value == '' and command_text in self.query_frames:
+            return self.query_frames[command_text]
+        return self._cached_command(command_text,command_value)
+
+    def _ParseReply(self,reply):
+        '''
+        Validates a raw reply and extracts the returned text.  Shared with the
+        asyncio drivers.
+
+            Parameters:
+                reply (bytes): the raw reply including the checksum characters
+            Returns:
+                returned_text (str): the portion of the reply between the 'ACK'
+                    and the ';', or None if the reply is not valid
+        '''
+        reply = reply.decode('ascii',errors = 'ignore')
+        # print('Received: ' + str(reply))
+        # Try except statement to deal with the frequent weirdness
+        # at the start of the replies
+        try:
+            pos = reply.rindex('@')
+            reply = '@@' + reply[pos:]
+        except ValueError:
+            pass
+        # print('Interpreted as: ' + str(reply))
+
+        # A reply which lost its ';' or ran into the next one can't be checked.
+        if reply.count(';') != 1:
+            return None
+        if not self.__ValidateResponse(reply):
+            return None
+
+        # Parse return message from the reply.
+        start_pos = reply.index('ACK')
+        end_pos = reply.index(';')
+        return reply[start_pos+3:end_pos]
+
+    def __Exchange(self,ser,command):
+        '''
+        Writes a command to the serial port and reads back the reply.  Called by
+        the bus while it holds the port.
+
+            Parameters:
+                ser (serial.Serial object): the open serial port
+                command (ascii bytes): the complete command
+            Returns:
+                reply (bytes): the raw reply including the checksum characters
+                rtt (float): time from the write to the end of the reply in
+                    seconds
+        '''
+        start = time.monotonic()
+        ser.write(command)
+        reply = ser.read_until(expected=bytes(';','ascii'))
+        # append the checksum characters
+        reply = reply + ser.read(size=2)
+        return reply,time.monotonic() - start
 
     def __BuildCommand(self,command_text,command_value):
         '''
@@ -239,26 +365,56 @@ class furnace:
     ----------
     address: str
         the address used for serial comms over MODBUS as a two digit hex byte
-    ser: serial.Serial object
-        the serial object set up with the parameters for communication with the 
-        furnace
+    address_byte: int
+        the same address as an integer, used when building the frames
+    query_temp_frame: bytes
+        the complete QueryTemp frame, built once
+    status_frame: bytes
+        the complete ReportStatus frame, built once
+    bus: rs485.bus object
+        the shared bus object which owns the serial port the furnace is on
+    baudrate: int
+        the baud rate used for communication with the furnace
+    rtt: rs485.rtt_estimator object
+        tracks the furnace's response time and sets the read timeouts from it
+    block_read: bool
+        whether QueryProcess() reads its fields in one block; cleared if the
+        controller rejects the block, after which it reads the temperature
+        only
 
     Public Methods
     --------------
     SetTemp(setpoint)
     QueryTemp()
+    ReadRegisters(start,count)
+    QueryRegisters(names)
+    QueryProcess()
     ChangeAddress()
     ReportStatus()
     '''
 
-    def __init__(self,address) -> None:
+    # Fields returned by QueryProcess().
+    process_fields = ('Temp','Setpoint','Output')
+    # Lowest and highest setpoint accepted by a recipe, in C.
+    setpoint_limits = (0,1200)
+
+    def __init__(self,address,port='/dev/ttyUSB0') -> None:
         self.address = hex(address)[2:]
         # If the address is only one char, add a leading zero for compatibility
         # with methods
         if len(self.address) == 1:
             self.address = '0' + self.address
-        import serial
-        self.ser = serial.Serial(port='/dev/ttyUSB0',baudrate=9600,timeout=3)
+        self.address_byte = address
+        self.baudrate = 9600
+        self.bus = get_bus(port)
+        self.rtt = rtt_estimator()
+        self.block_read = True
+        self.query_temp_frame = self.__BuildFrame(struct.pack('>BBHH',
+            self.address_byte,0x03,0x0001,1))
+        self.status_frame = self.__BuildFrame(struct.pack('>BB',
+            self.address_byte,0x07))
+        self._set_temp_frame = functools.lru_cache(maxsize=32,typed=True)(self.__BuildSetTemp)
+        self._read_frame = functools.lru_cache(maxsize=32,typed=True)(self.__BuildRead)
 
     def SetTemp(self,setpoint):
         '''
@@ -269,19 +425,9 @@ class furnace:
             Returns:
                 None
         '''
-        function_code = '10'
-        address = '0077'
-        no_of_words = '0001'
-        no_of_bytes = '02'
-        data = hex(setpoint)[2:].upper()
+        function_code = 0x10
         response_length = 8
-        # Prepend leading zeros
-        while len(data) < 4:
-            data = '0' + data
-        command = self.address + function_code + address + no_of_words + \
-            no_of_bytes + data
-        CRC = self.__CRC(command)
-        command += CRC
+        command = self._set_temp_frame(setpoint)
         try:
             self.__SendCommand(command,response_length,function_code)
             print('Temperature set to ' + str(setpoint) + ' C.')
@@ -297,13 +443,10 @@ class furnace:
             Returns:
                 temperature (int): temperature reported by the furnace
         '''
-        function_code = '03'
-        address = '0001'
-        no_of_words = '0001'
-        response_length = 5 + int(no_of_words,base=16)*2
-        command = self.address + function_code + address + no_of_words
-        CRC = self.__CRC(command)
-        command += CRC
+        function_code = 0x03
+        no_of_words = 1
+        response_length = 5 + no_of_words*2
+        command = self.query_temp_frame
         try:
             response = self.__SendCommand(command,response_length,function_code)
             temperature = int.from_bytes(response[3:-2],byteorder='big')
@@ -313,15 +456,74 @@ class furnace:
 
         return temperature
 
+    def ReadRegisters(self,start,count):
+        '''
+        Reads a contiguous block of holding registers in a single transaction.
+
+            Parameters:
+                start (int): address of the first register
+                count (int): number of registers to read
+            Returns:
+                values (tuple): the unsigned value of each register
+        '''
+        function_code = 0x03
+        response_length = 5 + count*2
+        command = self._read_frame(start,count)
+        try:
+            response = self.__SendCommand(command,response_length,function_code)
+        except modbus_exception:
+            raise
+        except Warning:
+            raise Warning('Unsuccessful communication with tube furnace.')
+        return struct.unpack_from('>' + str(count) + 'H',response,3)
+
+    def QueryRegisters(self,names):
+        '''
+        Queries a set of named fields from the register map with one block
+        read covering all of them.
+
+            Parameters:
+                names (iterable): field names from modbus.furnace_registers
+            Returns:
+                fields (dict): the value of each field in engineering units
+        '''
+        start,count = register_span(names)
+        values = self.ReadRegisters(start,count)
+        return decode_registers(values,start,names)
+
+    def QueryProcess(self):
+        '''
+        Queries the temperature, active setpoint and heater output in a single
+        transaction.  The setpoint and output registers are not confirmed for
+        every controller, so if the controller rejects the block read this
+        falls back to QueryTemp(), now and from then on, with the setpoint and
+        output as None.
+
+            Parameters:
+                None
+            Returns:
+                fields (dict): with keys 'Temp', 'Setpoint' and 'Output'
+        '''
+        if self.block_read:
+            try:
+                fields = self.QueryRegisters(self.process_fields)
+                print('Temperature is ' + str(fields['Temp']) + ' C.')
+                return fields
+            except modbus_exception as error:
+                print('Tube furnace rejected the block read (exception ' +
+                    str(error.code) + '), reading the temperature only.')
+                self.block_read = False
+        fields = dict.fromkeys(self.process_fields)
+        fields['Temp'] = self.QueryTemp()
+        return fields
+
     def ChangeAddress(self,new_address):
         pass
 
     def ReportStatus(self):
-        function_code = '07'
+        function_code = 0x07
         response_length = 5
-        command = self.address + function_code
-        CRC = self.__CRC(command)
-        command += CRC
+        command = self.status_frame
         try:
             response = self.__SendCommand(command,response_length,function_code)
         except Warning:
@@ -332,121 +534,225 @@ class furnace:
         # comms warning then we'll assume everything is functioning as intended.
         return True
 
-    
+    def __BuildSetTemp(self,setpoint):
+        '''
+        Builds the frame which writes a new temperature setpoint.
+
+            Parameters:
+                setpoint (int)
+            Returns:
+                command (bytes): the complete MODBUS command including CRC
+        '''
+        function_code = 0x10
+        address = 0x0077
+        no_of_words = 1
+        no_of_bytes = 2
+        command = struct.pack('>BBHHBH',self.address_byte,function_code,address,
+            no_of_words,no_of_bytes,setpoint)
+        return self.__BuildFrame(command)
+
+    def __BuildRead(self,start,count):
+        '''
+        Builds the frame which reads a block of holding registers.
+
+            Parameters:
+                start (int): address of the first register
+                count (int): number of registers to read
+            Returns:
+                command (bytes): the complete MODBUS command including CRC
+        '''
+        command = struct.pack('>BBHH',self.address_byte,0x03,start,count)
+        return self.__BuildFrame(command)
+
+    def __BuildFrame(self,command):
+        '''
+        Appends the CRC to a MODBUS command.
+
+            Parameters:
+                command (bytes): the MODBUS command without the CRC
+            Returns:
+                command (bytes): the complete MODBUS command including CRC
+        '''
+        return command + crc16(command)
+
     def __SendCommand(self,command,response_length,function_code):
         '''
         Private method responsible for repeatedly sending the command until a
         response is received with correct CRC and no error message.
 
             Parameters:
-                command (str): the entire MODBUS command
+                command (bytes): the entire MODBUS command including CRC
                 response_length (int): expected response length
-                function_code (str): the two-byte MODBUS function code
+                function_code (int): the MODBUS function code
             Returns:
-                response (bytearray): raw bytes received including CRC
+                response (bytes): raw bytes received including CRC
         '''
-        self.ser = serial.Serial(port='/dev/ttyUSB0',baudrate=9600,timeout=3)
-        # print('Command before byte conversion: ' + command)
-        command = bytes.fromhex(command)
+        device = 'furnace ' + str(self.address_byte)
+        label = self.__Label(command)
         send_status = False
         max_iter = 5
         comm_attempts = 0
+        start = time.monotonic()
         while not send_status:
             comm_attempts = comm_attempts + 1
             # print('Sending: ' + str(command))
-            self.ser.write(command)
             try:
-                valid,error_flag,response = self.__ReceiveResponse(response_length,function_code)
+                valid,error_flag,response,rtt = self.bus.transaction(
+                    self.baudrate,
+                    lambda ser: self.__Exchange(ser,command,response_length,
+                    function_code),
+                    timeout=self.rtt.timeout(comm_attempts,response_length,
+                    self.baudrate))
             except Warning:
+                # The port itself failed, which the bus has already retried.
+                recorder.attempt(self.bus.port,self.baudrate,device,label,
+                    'timeout',None,len(command),0)
+                recorder.transaction(device,label,comm_attempts,
+                    time.monotonic()-start,False)
                 raise Warning('Unsuccessful communication with tube furnace.')
 
             if valid and not(error_flag):
                 send_status = True
+                self.rtt.update(rtt)
+                outcome = 'ok'
                 # print('Received: ' + str(response))
-
-            if comm_attempts > max_iter:
-                raise Warning('Unsuccessful communication with tube furnace.')
+            elif len(response) < 2:
+                # No reply before the read timed out; retried like a bad one.
+                outcome = 'timeout'
+            elif not valid:
+                outcome = 'checksum'
+            else:
+                outcome = 'error'
+            recorder.attempt(self.bus.port,self.baudrate,device,label,outcome,
+                rtt,len(command),len(response))
+            if outcome == 'error':
+                # A valid exception reply would only be repeated.
+                recorder.transaction(device,label,comm_attempts,
+                    time.monotonic()-start,False)
+                raise modbus_exception('Tube furnace returned MODBUS exception '
+                    + str(response[2]) + ' for ' + label + '.',response[2])
+
+            if not send_status:
+                if comm_attempts > max_iter:
+                    recorder.transaction(device,label,comm_attempts,
+                        time.monotonic()-start,False)
+                    raise Warning('Unsuccessful communication with tube furnace.')
+                time.sleep(self.rtt.backoff(comm_attempts))
+        recorder.transaction(device,label,comm_attempts,time.monotonic()-start,
+            True)
         return response
 
-    def __ReceiveResponse(self,response_length,function_code):
+    def __Label(self,command):
+        '''
+        Names a command for the communication metrics, e.g. 'read 0001+3'.
+
+            Parameters:
+                command (bytes): the entire MODBUS command including CRC
+            Returns:
+                label (str)
+        '''
+        function_code = command[1]
+        if function_code == 0x03:
+            return 'read ' + command[2:4].hex() + '+' + \
+                str(int.from_bytes(command[4:6],byteorder='big'))
+        elif function_code == 0x10:
+            return 'write ' + command[2:4].hex()
+        elif function_code == 0x07:
+            return 'status'
+        return '%02x' % function_code
+
+    def __Exchange(self,ser,command,response_length,function_code):
+        '''
+        Writes a command to the serial port and listens for the response.
+        Called by the bus while it holds the port.
+
+            Parameters:
+                ser (serial.Serial object): the open serial port
+                command (bytes): the entire MODBUS command
+                response_length (int): expected response length
+                function_code (int): the MODBUS function code
+            Returns:
+                the valid, error_flag and response values from
+                    __ReceiveResponse
+                rtt (float): time from the write to the end of the response in
+                    seconds
+        '''
+        # MODBUS frames have no delimiters, so any bytes left over from a
+        # corrupted reply would throw the framing of this one off.
+        ser.reset_input_buffer()
+        start = time.monotonic()
+        ser.write(command)
+        valid,error_flag,response = self.__ReceiveResponse(ser,response_length,
+            function_code)
+        return valid,error_flag,response,time.monotonic() - start
+
+    def __ReceiveResponse(self,ser,response_length,function_code):
         '''
         Private method which listens for a MODBUS response.  Checks if the
         response is an error message and inspects the CRC value.
 
             Parameters:
+                ser (serial.Serial object): the open serial port
                 response_length (int): the anticipated length of the response in
                     bytes
-                function_code (str): the two-byte MODBUS function code
+                function_code (int): the MODBUS function code
             Returns:
                 valid (bool): whether the CRC checks out
                 error_flag (bool): whether the message is an error message
-                response (bytearray): raw bytes received including CRC
+                response (bytes): raw bytes received including CRC
         '''
-        valid = False
-        error_flag = False
-        function_code = int.from_bytes(bytes.fromhex(function_code),byteorder='big')
-        response = self.ser.read(size=2)
+        response = ser.read(size=2)
         # print(response)
         
-        # First, check to make sure we got a message back.
-        try:
-            response[1]
-        except IndexError:
-            raise Warning('Unsuccessful communication with tube furnace.')
-
-        # Check the second byte to see if we have a legitimate response or an
-        # error message.  If we have an error message, the second byte will be
-        # the function code plus 128.
-        if response[1] == function_code:
-            response = response + self.ser.read(size=(response_length-2))
-        elif response[1] == function_code + 128:
-            response = response + self.ser.read(size=3)
-            error_flag = True
+        # First, check to make sure we got a message back.  If not the read
+        # timed out, which the caller retries.
+        if len(response) < 2:
+            return False, False, response
 
-        returned_CRC = response[-2:]
-        calculated_CRC = self.__CRC(response[:-2])
-        calculated_CRC = bytearray.fromhex(calculated_CRC)
+        remaining,error_flag = self._RemainingLength(response,response_length,
+            function_code)
+        if remaining:
+            response = response + ser.read(size=remaining)
 
-        if calculated_CRC == returned_CRC:
-            valid = True
+        valid = self._CheckCRC(response)
         
         return valid, error_flag, response
 
-    def __CRC(self,msg):
+    def _RemainingLength(self,header,response_length,function_code):
         '''
-        Performs a cyclinc redundancy check in the format specified by the
-        furnace documentation.
+        Works out how many more bytes to read once the first two bytes of a
+        response have arrived.  Shared with the asyncio drivers.
 
             Parameters:
-                msg (str or bytearray): the MODBUS message without the 2 final
-                    CRC bytes
+                header (bytes): the first two bytes of the response
+                response_length (int): expected length of a normal response
+                function_code (int): the MODBUS function code
             Returns:
-                error_check_code (str): the CRC result formatted as a four-
-                    character string representing 2 bytes in hexadecimal
+                remaining (int): number of bytes still to read
+                error_flag (bool): whether the response is an error message
         '''
-        if type(msg) is str:
-            msg = bytearray.fromhex(msg)
-        CRC = 0xFFFF
-        for num in msg:
-            CRC = CRC^num               # bitwise XOR
-            for i in range(8):
-                flag = CRC%2            # tells us if last bit is 1 or 0
-                CRC = CRC >> 1          # bit shift right
-                if flag:
-                    CRC = CRC^0xA001
-        error_check_code = hex(CRC)[2:]
-        # Prepend leading zeros
-        while len(error_check_code) < 4:
-            error_check_code = '0' + error_check_code
+        # Check the second byte to see if we have a legitimate response or an
+        # error message.  If we have an error message, the second byte will be
+        # the function code plus 128.
+        if header[1] == function_code:
+            return response_length-2, False
+        elif header[1] == function_code + 128:
+            return 3, True
+        return 0, False
 
-        # For some reason they flip the bit order...
-        # error_check_code = hex(CRC)[2:]
-        error_check_code = error_check_code[2:] + error_check_code[0:2]
-        error_check_code = error_check_code.upper()
-        # print('CRC: ' + hex(CRC))
-        # print('CRC code: ' + error_check_code)
+    def _CheckCRC(self,response):
+        '''
+        Checks the CRC at the end of a response.  Shared with the asyncio
+        drivers.
 
-        return error_check_code
+            Parameters:
+                response (bytes): raw bytes received including CRC
+            Returns:
+                valid (bool): whether the CRC checks out
+        '''
+        # Check the CRC in place rather than copying the frame.
+        frame = memoryview(response)
+        return crc16(frame[:-2]) == frame[-2:]
 
 class pressure_trans:
     '''
@@ -458,19 +764,31 @@ class pressure_trans:
     ----------
     address: str
         the address used for serial comms
-    ser: serial.Serial object
-        the serial object set up with the parameters for communication with the 
-        Omega PX409-485 pressure transducer
+    bus: rs485.bus object
+        the shared bus object which owns the serial port the Omega PX409-485
+        pressure transducer is on
+    baudrate: int
+        the baud rate used for communication with the transducer
+    rtt: rs485.rtt_estimator object
+        tracks the transducer's response time and sets the read timeouts from
+        it
+    query_frame: bytes
+        the complete QueryPressure command, built once
+    status_frame: bytes
+        the complete ReportStatus command, built once
 
     Public Methods
     --------------
     QueryPressure()
     ReportStatus()
     '''
-    def __init__(self,address) -> None:
-        import serial
-        self.ser = serial.Serial(port='/dev/ttyUSB0',baudrate=115200,timeout=3)
+    def __init__(self,address,port='/dev/ttyUSB0') -> None:
+        self.baudrate = 115200
+        self.bus = get_bus(port)
+        self.rtt = rtt_estimator()
         self.address = str(address)
+        self.query_frame = bytes('#' + self.address + 'P\r\n','ascii')
+        self.status_frame = bytes('#' + self.address + 'ENQ\r\n','ascii')
 
     def QueryPressure(self):
         '''
@@ -482,10 +800,8 @@ class pressure_trans:
                 pressure (float): the pressure value in whatever units the
                     transducer is currently set to
         '''
-        command = '#' + self.address + 'P\r\n'
         try:
-            reply = self.__SendCommand(command)
-            pressure = self.__ParsePressure(reply)
+            pressure = self.__SendCommand(self.query_frame,self._ParsePressure)
             print('Reported pressure: ' + str(pressure) + ' torr.')
             return pressure
         except Warning:
@@ -500,42 +816,108 @@ class pressure_trans:
             Returns:
                 status (bool)
         '''
-        command = '#' + self.address + 'ENQ\r\n'
         try:
-            self.__SendCommand(command)
+            self.__SendCommand(self.status_frame)
             status = True
         except Warning:
             status = False
         return status
 
-    def __SendCommand(self,command):
+    def __SendCommand(self,command,parse=None):
         '''
         Send a command to a pressure transducer object over serial connection.
 
             Parameters:
-                command (str): the complete command to send to the transducer
+                command (ascii bytes): the complete command to send to the
+                    transducer
+                parse (function): optional, turns the returned text into the
+                    result; a reply it raises ValueError for is retried
 
             Returns:
                 returned_text (str): the portion of the returned serial message 
-                    between the address and the final carriage return
+                    between the address and the final carriage return, or
+                    what parse returned for it
         '''
-        self.ser = serial.Serial(port='/dev/ttyUSB0',baudrate=115200,timeout=3)
-        command = bytes(command,'ascii')
+        device = 'pressure_trans ' + self.address
+        label = command[1+len(self.address):].decode('ascii').strip()
         send_status = False
         max_iter = 5
         comm_attempts = 0
+        start = time.monotonic()
         while not send_status:
             comm_attempts = comm_attempts + 1
             # print('Sending: ' + str(command))
-            self.ser.write(command)
-            reply = self.ser.read_until(expected=bytes('>','ascii'))
-            reply = reply.decode('ascii',errors = 'ignore')
-            # print('Received: ' + reply)
-            send_status = self.__ValidateResponse(reply)
-            if comm_attempts > max_iter:
+            try:
+                raw_reply,rtt = self.bus.transaction(self.baudrate,
+                    lambda ser: self.__Exchange(ser,command),
+                    timeout=self.rtt.timeout(comm_attempts))
+            except Warning:
+                # The port itself failed, which the bus has already retried.
+                recorder.attempt(self.bus.port,self.baudrate,device,label,
+                    'timeout',None,len(command),0)
+                recorder.transaction(device,label,comm_attempts,
+                    time.monotonic()-start,False)
                 raise Warning('Unsuccessful communication with pressure transducer ' + self.address)
+            reply = self._ParseReply(raw_reply)
+            send_status = reply is not None
+            if send_status and parse is not None:
+                try:
+                    reply = parse(reply)
+                except ValueError:
+                    # Mangled too badly to find a number in it.
+                    send_status = False
+            if send_status:
+                self.rtt.update(rtt)
+                outcome = 'ok'
+            elif b'>' not in raw_reply:
+                outcome = 'timeout'
+            else:
+                outcome = 'checksum'
+            recorder.attempt(self.bus.port,self.baudrate,device,label,outcome,
+                rtt,len(command),len(raw_reply))
+            if not send_status:
+                if comm_attempts > max_iter:
+                    recorder.transaction(device,label,comm_attempts,
+                        time.monotonic()-start,False)
+                    raise Warning('Unsuccessful communication with pressure transducer ' + self.address)
+                time.sleep(self.rtt.backoff(comm_attempts))
+        recorder.transaction(device,label,comm_attempts,time.monotonic()-start,
+            True)
         return reply
 
+    def _ParseReply(self,reply):
+        '''
+        Decodes and validates a raw reply.  Shared with the asyncio drivers.
+
+            Parameters:
+                reply (bytes): the raw reply up to the closing '>'
+            Returns:
+                reply (str): the decoded reply, or None if it is not valid
+        '''
+        reply = reply.decode('ascii',errors = 'ignore')
+        # print('Received: ' + reply)
+        if self.__ValidateResponse(reply):
+            return reply
+        return None
+
+    def __Exchange(self,ser,command):
+        '''
+        Writes a command to the serial port and reads back the reply.  Called by
+        the bus while it holds the port.
+
+            Parameters:
+                ser (serial.Serial object): the open serial port
+                command (ascii bytes): the complete command
+            Returns:
+                reply (bytes): the raw reply up to the closing '>'
+                rtt (float): time from the write to the end of the reply in
+                    seconds
+        '''
+        start = time.monotonic()
+        ser.write(command)
+        reply = ser.read_until(expected=bytes('>','ascii'))
+        return reply,time.monotonic() - start
+
     def __ValidateResponse(self,response):
         '''
         Checks as best we can that the reply message is valid.
@@ -554,9 +936,10 @@ class pressure_trans:
             pass
         return valid
 
-    def __ParsePressure(self,response):
+    def _ParsePressure(self,response):
         '''
-        Parses a pressure value from the transducer message.
+        Parses a pressure value from the transducer message.  Shared with the
+        asyncio drivers.
 
             Parameters:
                 response (str): the entire reply message from the tranducer
@@ -0,0 +1,139 @@
+'''
+Runs a recipe and its logging in background threads for the GUI, reporting
+progress through Qt signals so nothing blocks the Qt thread.  Every wait in the
+recipe is on an event rather than a sleep, so stopping takes effect as soon as
+any bus transaction in progress has finished, after which the devices are put
+in the recipe's safe state.
+
+Classes:
+
+    recipe_executor -> starts, reports on and stops a recipe run
+'''
+import threading
+from PyQt5 import QtCore
+
+class recipe_executor(QtCore.QObject):
+    '''
+    A class which runs a recipe off the Qt thread.
+
+    ...
+
+    Signals
+    -------
+    started(str)
+        the log filename, once the run has started
+    progress(int,int,str)
+        step (from 0), number of steps and phase: 'setting', 'settling' or
+        'holding'
+    finished(bool)
+        True if the recipe completed, False if it was stopped or failed; sent
+        after logging has ended and, if stopped, the safe state is applied
+    error(str)
+        a description of an error which ended the run
+
+    Attributes
+    ----------
+    recipe: recipe object
+        the recipe being run, None before the first run
+
+    Public Methods
+    --------------
+    start(recipe,log_freq,log_filename,rates)
+    stop()
+    running()
+    wait(timeout)
+    '''
+
+    started = QtCore.pyqtSignal(str)
+    progress = QtCore.pyqtSignal(int,int,str)
+    finished = QtCore.pyqtSignal(bool)
+    error = QtCore.pyqtSignal(str)
+
+    def __init__(self,parent=None) -> None:
+        super().__init__(parent)
+        self.recipe = None
+        self._thread = None
+
+    def start(self,recipe,log_freq,log_filename,rates=None):
+        '''
+        Starts running a recipe and logging it.  Returns straight away.
+
+            Parameters:
+                recipe (recipe object): a recipe which has not been run
+                log_freq (float): logging frequency in Hz for devices without
+                    a rate in rates
+                log_filename (str): filename of the log
+                rates (dict): logging rates, see recipe.logging()
+            Returns:
+                started (bool): False if a recipe is already running
+        '''
+        if self.running():
+            return False
+        self.recipe = recipe
+        # Set before either thread starts so logging cannot see the flag
+        # before run() does and stop straight away.
+        recipe.logging_state = True
+        self._thread = threading.Thread(target=self.__Run,
+            args=(recipe,log_freq,log_filename,rates),daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        '''
+        Asks the running recipe to stop.  Returns straight away; finished is
+        sent once the devices are in their safe state.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        if self.recipe:
+            self.recipe.stop()
+
+    def running(self):
+        '''
+        Returns whether a recipe is running, including its shutdown.
+
+            Parameters:
+                None
+            Returns:
+                running (bool)
+        '''
+        return self._thread is not None and self._thread.is_alive()
+
+    def wait(self,timeout=None):
+        '''
+        Waits for the run, including its shutdown, to finish.
+
+            Parameters:
+                timeout (float): longest wait in seconds, None for no limit
+            Returns:
+                finished (bool): False if the timeout ran out first
+        '''
+        if self._thread:
+            self._thread.join(timeout)
+        return not self.running()
+
+    def __Run(self,recipe,log_freq,log_filename,rates):
+        '''
+        Body of the run thread: starts the logging thread, runs the recipe,
+        then shuts everything down.
+        '''
+        log_task = threading.Thread(target=recipe.logging,
+            args=(log_freq,log_filename),kwargs={'rates':rates},daemon=True)
+        log_task.start()
+        self.started.emit(log_filename)
+        completed = False
+        try:
+            completed = recipe.run(progress=self.progress.emit)
+        except Exception as error:
+            self.error.emit(str(error))
+        finally:
+            recipe.stop()
+            log_task.join()
+            if not completed:
+                if not recipe.safe_state():
+                    self.error.emit('Not every device could be put in its '
+                        'safe state.')
+            self.finished.emit(completed)
@@ -0,0 +1,266 @@
+'''
+Whole-run history of the logged channels for plotting.  Every sample is kept,
+along with a pyramid of min/max summaries: each level groups `factor` bins of
+the level below, so a view of any part of the run can be drawn from the
+coarsest level which still has about one bin per pixel.  The pyramid is
+extended as samples arrive, at constant cost per sample, so a six hour run can
+be zoomed from end to end while it is still running.
+
+A min/max bin is drawn as a vertical line from its minimum to its maximum at
+the time of its first sample, so spikes survive however far the plot is zoomed
+out.
+
+Classes:
+
+    channel_history -> samples and min/max pyramid of one channel
+    run_history -> thread-safe set of channel histories
+'''
+import threading
+import numpy
+
+class _column:
+    '''
+    Growable float64 array, doubling its capacity when full.
+    '''
+
+    def __init__(self,capacity=1024) -> None:
+        self.data = numpy.empty(capacity)
+        self.length = 0
+
+    def append(self,value):
+        if self.length == len(self.data):
+            data = numpy.empty(2*len(self.data))
+            data[:self.length] = self.data
+            self.data = data
+        self.data[self.length] = value
+        self.length = self.length + 1
+
+    def view(self):
+        return self.data[:self.length]
+
+class channel_history:
+    '''
+    A class which keeps every sample of a channel and a min/max pyramid of
+    them.
+
+    ...
+
+    Attributes
+    ----------
+    factor: int
+        number of bins of one level summarized by each bin of the next
+
+    Public Methods
+    --------------
+    append(t,value)
+    view(start,end,pixels)
+    span()
+    '''
+
+    def __init__(self,factor=4) -> None:
+        self.factor = factor
+        self._time = _column()
+        self._value = _column()
+        # Level k, from 1, is a (time, min, max) triple of columns whose bins
+        # each cover factor**k samples.
+        self._levels = []
+
+    def __len__(self):
+        return self._time.length
+
+    def append(self,t,value):
+        '''
+        Adds a sample.  Samples must arrive in time order.
+
+            Parameters:
+                t (float): time of the sample
+                value (float)
+            Returns:
+                None
+        '''
+        self._time.append(t)
+        self._value.append(value)
+        # Close the bins this sample completes, from the finest level up.
+        count = self._time.length
+        size = self.factor
+        level = 0
+        while count % size == 0:
+            if level == len(self._levels):
+                self._levels.append((_column(),_column(),_column()))
+            if level == 0:
+                values = self._value.view()[-self.factor:]
+                low = values.min()
+                high = values.max()
+                first = self._time.data[count - self.factor]
+            else:
+                times,lows,highs = self._levels[level - 1]
+                low = lows.view()[-self.factor:].min()
+                high = highs.view()[-self.factor:].max()
+                first = times.data[times.length - self.factor]
+            times,lows,highs = self._levels[level]
+            times.append(first)
+            lows.append(low)
+            highs.append(high)
+            size = size*self.factor
+            level = level + 1
+
+    def view(self,start=None,end=None,pixels=1000):
+        '''
+        Returns the points to draw for a range of time.
+
+            Parameters:
+                start (float): start of the range, None for the first sample
+                end (float): end of the range, None for the last sample
+                pixels (int): width of the plot; at most about this many
+                    samples or bins are returned
+            Returns:
+                x (numpy.ndarray): times
+                y (numpy.ndarray): values, or alternating bin minima and maxima
+                    with each time repeated
+        '''
+        times = self._time.view()
+        values = self._value.view()
+        first = 0 if start is None else \
+            max(numpy.searchsorted(times,start) - 1,0)
+        last = len(times) if end is None else \
+            min(numpy.searchsorted(times,end,side='right') + 1,len(times))
+        if last - first <= pixels or not self._levels:
+            # Few enough to draw every sample, and without copying.
+            return times[first:last],values[first:last]
+
+        # Pick the finest level with no more bins than pixels.
+        level = 0
+        size = 1
+        while (last - first)//size > pixels and level < len(self._levels):
+            level = level + 1
+            size = size*self.factor
+        bin_times,lows,highs = (column.view() for column in
+            self._levels[level - 1])
+        first_bin = first//size
+        last_bin = min(last//size,len(bin_times))
+        x = bin_times[first_bin:last_bin]
+        low = lows[first_bin:last_bin]
+        high = highs[first_bin:last_bin]
+        # The samples after the last complete bin are summarized here.
+        tail = slice(last_bin*size,last)
+        if tail.stop > tail.start:
+            x = numpy.append(x,times[tail.start])
+            low = numpy.append(low,values[tail].min())
+            high = numpy.append(high,values[tail].max())
+        return numpy.repeat(x,2),numpy.column_stack((low,high)).ravel()
+
+    def span(self):
+        '''
+        Returns the times of the first and last samples.
+
+            Parameters:
+                None
+            Returns:
+                start (float): None if there are no samples
+                end (float): None if there are no samples
+        '''
+        if not self._time.length:
+            return None,None
+        return self._time.data[0],self._time.data[self._time.length - 1]
+
+class run_history:
+    '''
+    A class which keeps the history of every channel of a run.  Samples can
+    be added from the logging thread while the GUI reads views.
+
+    ...
+
+    Attributes
+    ----------
+    factor: int
+        pyramid factor of the channel histories
+
+    Public Methods
+    --------------
+    append(name,t,value)
+    view(name,start,end,pixels)
+    span()
+    channels()
+    clear()
+    '''
+
+    def __init__(self,factor=4) -> None:
+        self.factor = factor
+        self._lock = threading.Lock()
+        self._channels = {}
+
+    def append(self,name,t,value):
+        '''
+        Adds a sample to a channel, creating the channel the first time.
+
+            Parameters:
+                name (str): channel name, e.g. 'Temp'
+                t (float): time of the sample
+                value (float)
+            Returns:
+                None
+        '''
+        with self._lock:
+            if name not in self._channels:
+                self._channels[name] = channel_history(self.factor)
+            self._channels[name].append(t,value)
+
+    def view(self,name,start=None,end=None,pixels=1000):
+        '''
+        Returns the points to draw for a channel over a range of time, see
+        channel_history.view().
+
+            Parameters:
+                name (str): channel name
+                start (float): start of the range, None for the first sample
+                end (float): end of the range, None for the last sample
+                pixels (int): width of the plot
+            Returns:
+                x (numpy.ndarray)
+                y (numpy.ndarray)
+        '''
+        with self._lock:
+            if name not in self._channels:
+                return numpy.empty(0),numpy.empty(0)
+            return self._channels[name].view(start,end,pixels)
+
+    def span(self):
+        '''
+        Returns the times of the first and last samples of any channel.
+
+            Parameters:
+                None
+            Returns:
+                start (float): None if there are no samples
+                end (float): None if there are no samples
+        '''
+        with self._lock:
+            spans = [history.span() for history in self._channels.values()
+                if len(history)]
+        if not spans:
+            return None,None
+        return min(span[0] for span in spans),max(span[1] for span in spans)
+
+    def channels(self):
+        '''
+        Returns the names of the channels with samples.
+
+            Parameters:
+                None
+            Returns:
+                names (list)
+        '''
+        with self._lock:
+            return list(self._channels)
+
+    def clear(self):
+        '''
+        Removes every channel, for the start of a new run.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        with self._lock:
+            self._channels = {}
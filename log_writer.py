@@ -0,0 +1,192 @@
+'''
+Background writer for the recipe logs, in the CSV layout or the binary format
+from binary_log.py.  Samples are handed over through a
+bounded queue and written in batches by a separate thread, so the acquisition
+loop never waits on the disk.  If the disk falls so far behind that the queue
+fills up, new samples are dropped and counted rather than blocking acquisition.
+If the thread fails, e.g. with the disk full, the error is raised by the next
+write() or by close().
+
+Classes:
+
+    log_writer -> thread which writes samples to a CSV or binary log
+'''
+import threading, queue, csv, os, time
+import binary_log
+
+class log_writer:
+    '''
+    A class which writes samples to a log file from a background thread.
+
+    ...
+
+    Attributes
+    ----------
+    filename: str
+        filename including the file extension, overwritten when started
+    flush_interval: float
+        the file is flushed and fsynced at most this often, in seconds
+    batch_size: int
+        the largest number of rows written in one go
+    binary: bool
+        whether the log is written in the binary format instead of CSV
+    metadata: dict
+        stored in the header of a binary log
+    fieldnames: list
+        the columns of the log, None to take them from the first sample
+    written: int
+        number of samples written to the file
+    dropped: int
+        number of samples dropped because the queue was full
+
+    Public Methods
+    --------------
+    start()
+    write(sample)
+    queue_depth()
+    close()
+    '''
+
+    def __init__(self,filename,max_queue=10000,batch_size=256,
+        flush_interval=1.0,binary=False,metadata=None,fieldnames=None) -> None:
+        self.filename = filename
+        self.fieldnames = fieldnames
+        self.binary = binary
+        self.metadata = metadata
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.written = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._error = None
+
+    def start(self):
+        '''
+        Truncates the log file and starts the writer thread.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        self._thread = threading.Thread(target=self.__Run,daemon=True)
+        self._thread.start()
+
+    def write(self,sample):
+        '''
+        Queues a sample to be written.  Never blocks.  Raises the error the
+        writer thread failed with, if it has.
+
+            Parameters:
+                sample (dict): column name -> value.  Unless the columns were
+                    given up front, those of the first sample become the
+                    header of the file.  Missing values are left empty.
+            Returns:
+                queued (bool): False if the sample was dropped
+        '''
+        if self._error is not None:
+            raise self._error
+        try:
+            self._queue.put_nowait(sample)
+            return True
+        except queue.Full:
+            self.dropped = self.dropped + 1
+            return False
+
+    def queue_depth(self):
+        '''
+        Returns the number of samples waiting to be written.
+
+            Parameters:
+                None
+            Returns:
+                depth (int)
+        '''
+        return self._queue.qsize()
+
+    def close(self):
+        '''
+        Writes out everything still queued, then stops the thread and closes
+        the file.  Raises the error the writer thread failed with, if it has.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        if self._thread:
+            # The stop marker must get in even if the queue is full, but a
+            # thread which has died will never make room for it.
+            while self._thread.is_alive():
+                try:
+                    self._queue.put(None,timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            self._thread.join()
+            self._thread = None
+        if self._error is not None:
+            raise self._error
+
+    def __Run(self):
+        '''
+        Body of the writer thread.  Keeps the error it fails with for write()
+        and close() to raise.
+        '''
+        try:
+            self.__Write()
+        except Exception as error:
+            self._error = error
+
+    def __Write(self):
+        '''
+        Writes batches from the queue until the stop marker.
+        '''
+        if self.binary:
+            file = open(self.filename,'wb')
+        else:
+            file = open(self.filename,'w',newline='')
+        with file:
+            write_rows = None
+            last_flush = time.monotonic()
+            running = True
+            while running:
+                try:
+                    batch = [self._queue.get(timeout=self.flush_interval)]
+                except queue.Empty:
+                    batch = []
+                while batch and len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if None in batch:
+                    batch = batch[:batch.index(None)]
+                    running = False
+                if batch:
+                    if write_rows is None:
+                        write_rows = self.__Header(file,batch[0])
+                    write_rows(batch)
+                    self.written = self.written + len(batch)
+                now = time.monotonic()
+                if not running or now - last_flush >= self.flush_interval:
+                    file.flush()
+                    os.fsync(file.fileno())
+                    last_flush = now
+
+    def __Header(self,file,sample):
+        '''
+        Writes the header, with the columns taken from the first sample unless
+        they were given, and returns the function which writes a batch of
+        samples.
+        '''
+        fieldnames = self.fieldnames or [name for name in sample]
+        if self.binary:
+            dtype = binary_log.log_dtype(fieldnames)
+            file.write(binary_log.header(dtype,self.metadata))
+            return lambda batch: file.write(binary_log.pack(batch,dtype))
+        log_writer = csv.DictWriter(file,fieldnames=fieldnames,
+            extrasaction='ignore')
+        log_writer.writeheader()
+        return log_writer.writerows
@@ -5,12 +5,24 @@ from PyQt5 import QtCore
 from PyQt5 import QtWidgets
 from PyQt5 import QtGui
 import pyqtgraph
-import threading, time, serial, math
+import threading, time, serial, math, subprocess, sys, os
+from history import run_history
+from ring_buffer import live_channels
+from recipe import recipe
+from executor import recipe_executor
+from shared_telemetry import telemetry_reader
 
 # ser = serial.Serial(port='/dev/ttyUSB0',baudrate=115200,timeout=3)
 
 # define a new class which inherits from the QMainWindow object - not a default python object like our Ui_MainWindow class
 class cvd_control(QtWidgets.QMainWindow): 
+
+    # number of samples of each channel the live plots show
+    live_capacity = 3000
+    # logging frequency in Hz for devices without a rate in recipe.log_rates
+    log_freq = 1
+    # run recipes in a separate acquisition process which publishes to shared memory, so the GUI can be closed and reopened during a run
+    use_acquisition_process = False
     
     # override the init method
     def __init__(self, *args, **kwargs):
@@ -39,30 +51,44 @@ class cvd_control(QtWidgets.QMainWindow):
         # self.ui.gas_graph.addLegend(offset = (1,-150))
         self.ui.gas_graph.setLabel("bottom", "Time (s)", **styles)
 
-        # define variables for dynamic data
-        # self.time = list(range(100))
-        # self.temp = [math.sin(time/12) for time in self.time]
-        self.time = []
-        self.temp = []
-        # self.gas_1_flow = [math.sin(time/24) for time in self.time]
-        # self.gas_2_flow = [math.sin(time/12) for time in self.time]
-        # self.gas_3_flow = [math.sin(time/6) for time in self.time]
+        # the whole run is kept here as it is logged; the plots ask it for just the points which fit on screen
+        self.history = run_history()
+        # the newest samples of each channel are also kept in fixed size buffers for the plots while they follow the data
+        self.live = live_channels(self.live_capacity)
 
         # these pen objects are used when graphing in order to affect how the lines look
         pen_1 = pyqtgraph.mkPen(color='#7a0177',width=2)
         pen_2 = pyqtgraph.mkPen(color='#c51b8a',width=2)
         pen_3 = pyqtgraph.mkPen(color='#f768a1',width=2)
+        self.pens = [pen_1,pen_2,pen_3]
+
+        # plot the initial points onto the graphs; a line is added to the gas graph for each gas as it shows up in the history
+        self.temp_line = self.ui.temp_graph.plot([],[],pen=pen_1)
+        self.gas_lines = {}
 
-        # plot the initial points onto the graphs
-        self.temp_line = self.ui.temp_graph.plot(self.time,self.temp,pen=pen_1)
-        # self.gas_1_line = self.ui.gas_graph.plot(self.time,self.gas_1_flow,name='Gas 1',pen=pen_1)
-        # self.gas_2_line = self.ui.gas_graph.plot(self.time,self.gas_2_flow,name='Gas 2',pen=pen_2)
-        # self.gas_3_line = self.ui.gas_graph.plot(self.time,self.gas_3_flow,name='Gas 3',pen=pen_3)
+        # redraw straight away at the new resolution when the user zooms or pans
+        self.ui.temp_graph.getViewBox().sigRangeChangedManually.connect(self.update_plot)
+        self.ui.gas_graph.getViewBox().sigRangeChangedManually.connect(self.update_plot)
 
         self.timer = QtCore.QTimer()
         self.timer.setInterval(250)
         self.timer.timeout.connect(self.update_plot)
-        # self.timer.start()
+        self.timer.start()
+
+        # the recipe runs in background threads; its progress comes back through these signals so the GUI never waits on the devices
+        self.recipe_filename = None
+        self.executor = recipe_executor(self)
+        self.executor.progress.connect(self.show_progress)
+        self.executor.finished.connect(self.recipe_finished)
+        self.executor.error.connect(self.recipe_error)
+
+        # pick up a run which an acquisition process is already doing, e.g. after the GUI was restarted
+        self.telemetry = None
+        self.waiting_for_telemetry = False
+        self.acquisition = None
+        self.attach_telemetry()
+        if self.telemetry:
+            self.set_status('RUNNING')
 
 
     def return_ui_fields(self):
@@ -142,6 +168,7 @@ class cvd_control(QtWidgets.QMainWindow):
         # overwrite file
         with open(fileName,'w') as recipe:
             recipe.writelines(text_to_save)
+        self.recipe_filename = fileName
 
     def open_recipe(self):
         
@@ -181,6 +208,8 @@ class cvd_control(QtWidgets.QMainWindow):
                         j += 1
                     i += 1
         
+        self.recipe_filename = fileName
+
         # set the meta data display in the ui to show the metadata in the text file
         self.ui.label_author.setText(author)
         self.ui.label_creation_date.setText(creation_date)
@@ -193,40 +222,129 @@ class cvd_control(QtWidgets.QMainWindow):
             column.setText(column_names[i])
             i += 1
     
-    def update_plot(self):
-        # update the variables by chopping off the first value and adding one on the end
+    def plot_data(self,graph,name):
+        # a plot which is following the data shows the newest samples straight from the live buffers, one the user has zoomed or panned shows the visible range of the whole run
+        view_box = graph.getViewBox()
+        if view_box.autoRangeEnabled()[0]:
+            return self.live.view(name)
+        start, end = view_box.viewRange()[0]
+        # ask for about one point per pixel
+        pixels = max(graph.width(),100)
+        return self.history.view(name,start,end,pixels)
+
+    def attach_telemetry(self):
         try:
-            self.time.append(self.time[-1] + 1)
-        except IndexError:
-            self.time.append(1)
-        self.time = self.time[-10:]
+            self.telemetry = telemetry_reader()
+        except (FileNotFoundError, ValueError):
+            self.telemetry = None
 
-        self.temp.append(poll_pressure())
-        self.temp = self.temp[-10:]
+    def read_telemetry(self):
+        # the acquisition process takes a moment to set up its shared memory after it is started
+        if self.telemetry is None and self.waiting_for_telemetry:
+            self.attach_telemetry()
+            # the process exited before it got as far as setting up its shared memory
+            if self.telemetry is None and self.acquisition.poll() is not None:
+                self.waiting_for_telemetry = False
+                self.recipe_finished(False)
+                self.recipe_error('The acquisition process exited before the run started.')
+                return
+        if self.telemetry is None:
+            return
+        self.waiting_for_telemetry = False
+        # copy the new readings out of shared memory into the plot buffers
+        for name, t, value in self.telemetry.read():
+            self.history.append(name,t,value)
+            self.live.append(name,t,value)
+        status = self.telemetry.status()
+        if status['state'] == 'running' and status['step'] >= 0:
+            self.show_progress(status['step'],status['steps'],status['phase'])
+        elif status['state'] in ('completed','stopped','failed'):
+            self.telemetry.close()
+            self.telemetry = None
+            self.recipe_finished(status['state'] == 'completed')
+            if status['stale']:
+                # the acquisition process died without applying the safe state
+                self.recipe_error('The acquisition process stopped unexpectedly; the devices may not be in their safe state.')
 
-        # self.gas_1_flow = self.gas_1_flow[1:]
-        # self.gas_1_flow += [math.sin(self.time[-1]/24)]
+    def update_plot(self):
+        self.read_telemetry()
 
-        # self.gas_2_flow = self.gas_2_flow[1:]
-        # self.gas_2_flow += [math.sin(self.time[-1]/12)]
+        # update the temperature plot
+        self.temp_line.setData(*self.plot_data(self.ui.temp_graph,'Temp'))
 
-        # self.gas_3_flow = self.gas_3_flow[1:]
-        # self.gas_3_flow += [math.sin(self.time[-1]/6)]
+        # update the flow rate plots, adding a line the first time a gas is logged
+        for name in self.live.channels():
+            if name in ('Temp','Setpoint','Output','Press'):
+                continue
+            if name not in self.gas_lines:
+                pen = self.pens[len(self.gas_lines) % len(self.pens)]
+                self.gas_lines[name] = self.ui.gas_graph.plot([],[],name=name,pen=pen)
+            self.gas_lines[name].setData(*self.plot_data(self.ui.gas_graph,name))
 
-        # update the plots
-        self.temp_line.setData(self.time,self.temp)
-        # self.gas_1_line.setData(self.time,self.gas_1_flow)
-        # self.gas_2_line.setData(self.time,self.gas_2_flow)
-        # self.gas_3_line.setData(self.time,self.gas_3_flow)
+    def set_status(self,status):
+        self.ui.label_recipe_status.setText("<html><head/><body><p>Recipe Status: <span style=\" font-weight:600;\">" + status + "</span></p></body></html>")
 
     def start_recipe(self):
-        # self.ui.label_recipe_status.setText("<html><head/><body><p>Recipe Status: <span style=\" font-weight:600;\">RUNNING</span></p></body></html>")
-        # run_task = threading.Thread(target=run_recipe)
-        # run_task.start()
-        pass
+        if self.executor.running() or self.telemetry or self.waiting_for_telemetry:
+            return
+        # run the recipe which was last opened or saved
+        if not self.recipe_filename:
+            self.open_recipe()
+        if not self.recipe_filename:
+            return
+        try:
+            new_recipe = recipe(self.recipe_filename)
+        except (OSError, ValueError, KeyError) as error:
+            QtWidgets.QMessageBox.warning(self,'Recipe','Unable to read the recipe: ' + str(error))
+            return
+        self.history.clear()
+        self.live.clear()
+        log_filename = 'log_' + time.strftime('%Y%m%d_%H%M%S')
+        if self.use_acquisition_process:
+            # the process outlives the GUI, so it gets a session of its own; update_plot picks up its readings from shared memory
+            self.acquisition = subprocess.Popen([sys.executable,os.path.join(os.path.dirname(os.path.abspath(__file__)),'acquisition_process.py'),self.recipe_filename,log_filename,'--freq',str(self.log_freq)],start_new_session=True)
+            self.waiting_for_telemetry = True
+            self.set_status('RUNNING')
+            return
+        # the recipe logs straight into the plot buffers
+        new_recipe.history = self.history
+        new_recipe.live = self.live
+        self.executor.start(new_recipe,self.log_freq,log_filename,rates=recipe.log_rates)
+        self.set_status('RUNNING')
 
     def stop_recipe(self):
-        self.ui.label_recipe_status.setText("<html><head/><body><p>Recipe Status: <span style=\" font-weight:600;\">STOPPED</span></p></body></html>")
+        # the executor puts the devices in their safe state once the recipe has stopped, and recipe_finished updates the status
+        if self.executor.running():
+            self.set_status('STOPPING')
+            self.executor.stop()
+        elif self.telemetry:
+            # the acquisition process stops the run and applies the safe state itself
+            self.set_status('STOPPING')
+            self.telemetry.request_stop()
+        else:
+            self.set_status('STOPPED')
+
+    def show_progress(self,step,steps,phase):
+        self.set_status('RUNNING step ' + str(step + 1) + ' of ' + str(steps) + ' (' + phase + ')')
+
+    def recipe_finished(self,completed):
+        if completed:
+            self.set_status('COMPLETE')
+        else:
+            self.set_status('STOPPED')
+
+    def recipe_error(self,message):
+        QtWidgets.QMessageBox.warning(self,'Recipe',message)
+
+    def closeEvent(self,event):
+        # never leave the devices running a recipe nobody can stop
+        if self.executor.running():
+            self.executor.stop()
+            self.executor.wait(10)
+        # a run in an acquisition process carries on; the GUI can be reopened to watch it
+        if self.telemetry:
+            self.telemetry.close()
+        super().closeEvent(event)
 
     def apply_setpoints(self):
         # self.ui.label_temp_setpoint.setText('<html><head/><body><p>Temp.: </p></body></html>' + self.ui.lineEdit_2.text() + '<html><head/><body><p><span style=\" vertical-align:super;\">o</span>C</p></body></html>' )
@@ -0,0 +1,215 @@
+'''
+Communication metrics for the devices on the RS-485 network.  The drivers in
+equipment.py report every attempt and every completed command here, so it is
+possible to see how often a device needs retries, how long its commands really
+take and how busy each bus is, rather than only seeing print() output.
+
+Metrics are kept per device and per command:
+
+    transaction latency histogram (first write to final reply, with retries)
+    histogram of the number of attempts needed
+    count of attempts by outcome: ok, timeout, checksum (checksum, CRC or NAK
+        failures) and error (MODBUS exception replies)
+    bytes written and read
+
+and per port:
+
+    wire utilization -> time the bytes sent and received would take at the line
+        baud rate, as a fraction of the elapsed time
+    occupancy -> time the port was held by an exchange, as a fraction of the
+        elapsed time
+
+Classes:
+
+    comm_metrics -> thread-safe store of the metrics
+
+Objects:
+
+    recorder -> the comm_metrics object the drivers report to
+'''
+import threading, time, json, bisect, copy
+
+# Upper edges of the latency histogram buckets in seconds.  The last bucket
+# catches everything slower.
+latency_buckets = (0.001,0.002,0.005,0.01,0.02,0.05,0.1,0.2,0.5,1,2,5,10)
+outcomes = ('ok','timeout','checksum','error')
+
+class comm_metrics:
+    '''
+    A class which accumulates communication metrics reported by the drivers.
+
+    ...
+
+    Attributes
+    ----------
+    start: float
+        monotonic time the metrics were started or last reset
+
+    Public Methods
+    --------------
+    attempt(port,baudrate,device,command,outcome,rtt,bytes_out,bytes_in)
+    transaction(device,command,attempts,latency,success)
+    snapshot()
+    dump(filename)
+    reset()
+    '''
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''
+        Clears all of the metrics.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        with self._lock:
+            self.start = time.monotonic()
+            self._commands = {}
+            self._ports = {}
+
+    def attempt(self,port,baudrate,device,command,outcome,rtt,bytes_out,
+        bytes_in):
+        '''
+        Records a single write/read exchange.
+
+            Parameters:
+                port (str): the serial port the device is on
+                baudrate (int): the line speed of the exchange
+                device (str): name of the device, e.g. 'MFC 103'
+                command (str): the command sent, e.g. 'FX?'
+                outcome (str): one of 'ok', 'timeout', 'checksum' or 'error'
+                rtt (float): time the exchange held the port in seconds, None
+                    if unknown
+                bytes_out (int): bytes written
+                bytes_in (int): bytes read
+            Returns:
+                None
+        '''
+        with self._lock:
+            stats = self.__Command(device,command)
+            stats['outcomes'][outcome] = stats['outcomes'][outcome] + 1
+            stats['bytes_out'] = stats['bytes_out'] + bytes_out
+            stats['bytes_in'] = stats['bytes_in'] + bytes_in
+            bus = self._ports.setdefault(port,{'wire_time':0,'busy_time':0,
+                'bytes':0})
+            bus['wire_time'] = bus['wire_time'] + \
+                (bytes_out + bytes_in)*10/baudrate
+            bus['bytes'] = bus['bytes'] + bytes_out + bytes_in
+            if rtt is not None:
+                bus['busy_time'] = bus['busy_time'] + rtt
+
+    def transaction(self,device,command,attempts,latency,success):
+        '''
+        Records a completed command, successful or not.
+
+            Parameters:
+                device (str): name of the device, e.g. 'MFC 103'
+                command (str): the command sent, e.g. 'FX?'
+                attempts (int): number of attempts made
+                latency (float): time from the first write to the end of the
+                    last attempt in seconds
+                success (bool): whether a valid reply was received
+            Returns:
+                None
+        '''
+        with self._lock:
+            stats = self.__Command(device,command)
+            if success:
+                stats['successes'] = stats['successes'] + 1
+            else:
+                stats['failures'] = stats['failures'] + 1
+            stats['latency_hist'][bisect.bisect_left(latency_buckets,latency)] \
+                += 1
+            stats['latency_sum'] = stats['latency_sum'] + latency
+            stats['latency_max'] = max(stats['latency_max'],latency)
+            stats['attempts_hist'][attempts] = \
+                stats['attempts_hist'].get(attempts,0) + 1
+
+    def snapshot(self):
+        '''
+        Returns a copy of the metrics with the derived values filled in.
+
+            Parameters:
+                None
+            Returns:
+                metrics (dict): with 'elapsed', 'devices' (device -> command ->
+                    stats) and 'ports' (port -> utilization) entries; a
+                    latency percentile slower than the last bucket is None
+        '''
+        with self._lock:
+            elapsed = time.monotonic() - self.start
+            devices = {}
+            for (device,command),stats in self._commands.items():
+                stats = copy.deepcopy(stats)
+                count = stats['successes'] + stats['failures']
+                stats['latency_mean'] = stats['latency_sum']/count if count \
+                    else 0
+                stats['latency_p50'] = self.__Percentile(stats['latency_hist'],
+                    0.5)
+                stats['latency_p99'] = self.__Percentile(stats['latency_hist'],
+                    0.99)
+                stats['latency_buckets'] = list(latency_buckets)
+                devices.setdefault(device,{})[command] = stats
+            ports = {}
+            for port,bus in self._ports.items():
+                ports[port] = {
+                    'bytes':bus['bytes'],
+                    'wire_utilization':bus['wire_time']/elapsed if elapsed else 0,
+                    'occupancy':bus['busy_time']/elapsed if elapsed else 0,
+                }
+        return {'elapsed':elapsed,'devices':devices,'ports':ports}
+
+    def dump(self,filename):
+        '''
+        Writes a snapshot of the metrics to a JSON file.
+
+            Parameters:
+                filename (str): filename including the file extension
+            Returns:
+                None
+        '''
+        with open(filename,'w') as file:
+            json.dump(self.snapshot(),file,indent=2,allow_nan=False)
+
+    def __Command(self,device,command):
+        '''
+        Returns the stats for a device and command, creating them if needed.
+        Must be called with the lock held.
+        '''
+        key = (device,command)
+        if key not in self._commands:
+            self._commands[key] = {
+                'successes':0,
+                'failures':0,
+                'outcomes':{outcome:0 for outcome in outcomes},
+                'attempts_hist':{},
+                'latency_hist':[0]*(len(latency_buckets) + 1),
+                'latency_sum':0,
+                'latency_max':0,
+                'bytes_out':0,
+                'bytes_in':0,
+            }
+        return self._commands[key]
+
+    def __Percentile(self,histogram,fraction):
+        '''
+        Estimates a percentile as the upper edge of the bucket it falls in,
+        None if it falls in the last bucket, which has no upper edge.
+        '''
+        total = sum(histogram)
+        if not total:
+            return 0
+        running = 0
+        for i,count in enumerate(histogram):
+            running = running + count
+            if running >= fraction*total:
+                if i < len(latency_buckets):
+                    return latency_buckets[i]
+                return None
+
+recorder = comm_metrics()
@@ -0,0 +1,106 @@
+'''
+MODBUS RTU helpers used by the tube furnace driver.
+
+Functions:
+
+    crc16(msg) -> the two CRC bytes for a MODBUS RTU frame
+    register_span(names) -> the contiguous block of registers covering a set of
+        named fields
+    decode_registers(values,start,names) -> named fields from a block read
+'''
+
+# Register map for the furnace temperature controller.  Each entry gives the
+# holding register address and the divisor which converts the raw register
+# value into engineering units.  The fields are laid out next to each
+# other so the values polled during a recipe come back in a single read.
+furnace_registers = {
+    'Temp':(0x0001,1),          # measured temperature, C
+    'Setpoint':(0x0002,1),      # active setpoint, C
+    'Output':(0x0003,10),       # heater output, 0.1 %
+    'Alarm':(0x0004,1),         # alarm status bits
+}
+
+# The MODBUS specification limits a single function 03 read to 125 registers.
+max_block_length = 125
+
+def _BuildCRCTable():
+    '''
+    Precomputes the CRC-16/MODBUS remainder for every possible byte value so
+    the CRC can be calculated a byte at a time rather than a bit at a time.
+
+        Parameters:
+            None
+        Returns:
+            table (tuple): 256 remainders
+    '''
+    table = []
+    for num in range(256):
+        CRC = num
+        for i in range(8):
+            if CRC & 1:
+                CRC = (CRC >> 1) ^ 0xA001
+            else:
+                CRC = CRC >> 1
+        table.append(CRC)
+    return tuple(table)
+
+_CRC_TABLE = _BuildCRCTable()
+
+def crc16(msg):
+    '''
+    Performs a cyclic redundancy check in the format specified by the furnace
+    documentation (CRC-16/MODBUS).
+
+        Parameters:
+            msg (bytes, bytearray or memoryview): the MODBUS message without
+                the 2 final CRC bytes
+        Returns:
+            error_check_code (bytes): the two CRC bytes, low byte first as they
+                are sent on the wire
+    '''
+    table = _CRC_TABLE
+    CRC = 0xFFFF
+    for num in msg:
+        CRC = (CRC >> 8) ^ table[(CRC ^ num) & 0xFF]
+    return bytes((CRC & 0xFF,CRC >> 8))
+
+def register_span(names,register_map=furnace_registers):
+    '''
+    Finds the contiguous block of registers which covers a set of named fields.
+
+        Parameters:
+            names (iterable): field names from the register map
+            register_map (dict): maps field names to (address, divisor)
+        Returns:
+            start (int): address of the first register in the block
+            count (int): number of registers in the block
+    '''
+    addresses = [register_map[name][0] for name in names]
+    start = min(addresses)
+    count = max(addresses) - start + 1
+    if count > max_block_length:
+        raise ValueError('Registers span ' + str(count) + ' words, more than ' +
+            'can be read in one transaction.')
+    return start, count
+
+def decode_registers(values,start,names,register_map=furnace_registers):
+    '''
+    Picks named fields out of the values returned by a block read and scales
+    them into engineering units.
+
+        Parameters:
+            values (tuple): raw register values, starting at address start
+            start (int): address of the first register in values
+            names (iterable): field names from the register map
+            register_map (dict): maps field names to (address, divisor)
+        Returns:
+            fields (dict): the scaled value of each named field
+    '''
+    fields = {}
+    for name in names:
+        address,divisor = register_map[name]
+        value = values[address-start]
+        if divisor != 1:
+            value = value/divisor
+        fields[name] = value
+    return fields
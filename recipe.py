@@ -1,4 +1,18 @@
 # from function_files.equipment import pressure_trans
+from equipment import *
+from rs485 import transaction_priority, current_priority, SETPOINT, \
+    SETTLE, TELEMETRY
+from log_writer import log_writer
+import binary_log
+from run_clock import run_clock
+from acquisition import acquisition_scheduler
+from history import run_history
+from ring_buffer import live_channels
+from telemetry_cache import telemetry_cache
+from settle import settle_detector
+from devices import device_config, default_file
+from schedule import compile_schedule, parse_setpoint
+import threading, time, csv, serial
 
 
 class recipe():
@@ -9,8 +23,10 @@ class recipe():
 
     Attributes
     ----------
+    devices: device_config object
+        the ports, addresses and line settings of the devices
     steps: list
-        nested list of all the recipe steps
+        nested list of all the recipe steps, with the end value of any ramp
     furnace: furnace object
         instance of the furnace class
     MFCs: dict
@@ -24,49 +40,88 @@ class recipe():
         sequential list of recipe furnace temperatures
     flow: dict
         dictionary of lists
-    log_initialize: bool
-        tracks whether the log file has been written to yet
-    _lock: threading.Lock() object
-        used for threading the logging and recipe execution
+    ramp_starts: dict
+        'Temp' or gas -> list of the start of the ramp in each step, None for
+        a step change
+    schedule: recipe_schedule
+        the steps compiled into the setpoint writes they make, checked
+        against the device limits
+    log_writer: log_writer object
+        writes the logged samples from a background thread, None until
+        logging starts
+    clock: run_clock object
+        time base of the run, started when logging starts
+    scheduler: acquisition_scheduler object
+        reads the devices while logging, None until logging starts; its
+        stats() report the overruns and jitter of each device
+    telemetry: telemetry_cache object
+        the readings taken by logging(), published once for everything which
+        uses them; its latest() gives the latest reading of each channel as a
+        (value, acquisition time) tuple, with the time in seconds since the
+        start of the run
+    history: run_history object
+        every reading of the run, for plotting, fed from telemetry
+    live: live_channels object
+        the newest readings of each channel, for the live plots, fed from
+        telemetry
     logging_state: bool
         used to start and stop logging when a recipe is run
+    stop_event: threading.Event
+        set by stop(); every wait in run() and logging() wakes on it
 
     Public Methods
     --------------
-    run(log_freq)
+    run(progress)
+    stop()
+    safe_state()
     initialize()
+    logging(freq,filename)
+    poll()
     '''
 
-    MFC_address_lookup = {
-        'Ethylene':101,
-        'C2H4':101,
-        'C2h4':101,
-        'c2h4':101,
-        'ethylene':101,
-        'ETHYLENE':101,
-        'Argon':102,
-        'Ar':102,
-        'AR':102,
-        'argon':102,
-        'ARGON':102,
-        'ar':102,
-        'Helium':103,
-        'He':103,
-        'HE':103,
-        'helium':103,
-        'HELIUM':103,
-        'he':103,
-        'Hydrogen':104,
-        'H2':104,
-        'h2':104,
-        'hydrogen':104,
-        'HYDROGEN':104
-    }
-
-    def __init__(self,filename) -> None:
-        self.log_initialize = False
+    # Ports, addresses and line settings of the devices, see devices.py.
+    device_file = default_file
+
+    # Default logging rates in Hz for each kind of device.
+    log_rates = {'Temp':1,'Flow':2,'Press':10}
+    # State the devices are put in by safe_state(): the furnace setpoint, and
+    # the flow of any gas to keep running, e.g. {'Argon':100} to keep purging.
+    # Every other gas is turned off.
+    safe_temp = 25
+    safe_flows = {}
+    # Setpoint updates per second while a step ramps, e.g. a 25>775 cell.
+    # Each ramping device costs at most one bus write per update.
+    ramp_update_rate = 1
+    # When the temperature counts as settled at the start of a step: within
+    # settle_tolerance degrees of the setpoint for settle_dwell seconds, with
+    # a slope of at most settle_slope degrees per second if it is set.  A run
+    # which has not settled settle_timeout seconds after its setpoints were
+    # written fails, if it is set.  See settle.py.
+    settle_tolerance = 2
+    settle_dwell = 0
+    settle_slope = None
+    settle_timeout = None
+    # Seconds to wait for a published temperature before reading the furnace
+    # directly, e.g. when run() is used without logging().
+    settle_poll = 3
+
+    def __init__(self,filename,devices=None) -> None:
+        '''
+        Reads a recipe and creates its devices from devices, by default read
+        from device_file.  Raises KeyError for a column with no device, and
+        ValueError for a gas column naming a device which is not an MFC.
+        '''
+        self.devices = devices if devices is not None else \
+            device_config(self.device_file)
+        self.log_writer = None
+        self.clock = None
+        self.scheduler = None
+        self.telemetry = telemetry_cache()
+        self.history = run_history()
+        self.live = live_channels()
+        self.telemetry.subscribe(self.__Plot)
         self.logging_state = False
-        self._lock = threading.Lock()
+        self.stop_event = threading.Event()
         self.steps = []
         with open(filename,'r') as file:
             for line in file:
@@ -74,82 +129,234 @@ class recipe():
                     self.steps.append(line[:-1].split(','))
                 if line[:8] == '#Columns':
                     columns = line[10:-1].split(',')
-        # Convert strings to numbers.
-        self.steps = [[float(j) for j in i] for i in self.steps]
+        # Convert strings to numbers, splitting ramps (start>end) into their
+        # starts and ends.
+        cells = [[parse_setpoint(j) for j in i] for i in self.steps]
+        self.steps = [[end for start,end in i] for i in cells]
         
         # Initialize the equipment objects
         self.furnace = None
         self.MFCs = {}
-        self.press_trans = pressure_trans(123)
+        self.press_trans = self.devices.create('Press','pressure_trans')
         # Initialize the recipe sequence lists
         self.times = []
         self.temps = []
         self.flow = {}
+        self.ramp_starts = {}
 
         # Define the equipment based on the column labels and define the recipe
         # sequence lists
         i = 0
         for column in columns:
+            starts = [j[i][0] for j in cells]
             if column == 'Time':
+                if any(start is not None for start in starts):
+                    raise ValueError('The Time column cannot ramp.')
                 self.times = [j[i] for j in self.steps]
             elif column == 'Temp':
-                self.furnace = furnace(5)
+                self.furnace = self.devices.create('Furnace','furnace')
                 self.temps = [int(j[i]) for j in self.steps]
+                self.ramp_starts['Temp'] = starts
             else:
-                self.MFCs[column] = MFC(recipe.MFC_address_lookup[column])
+                self.MFCs[column] = self.devices.create(column,'MFC')
                 self.flow[column] = [j[i] for j in self.steps]
+                self.ramp_starts[column] = starts
             i = i + 1
+
+        # Compile the steps into the writes the run will make.  Raises
+        # ValueError if a setpoint is outside the device limits.
+        self.schedule = compile_schedule(self.times,self.temps,self.flow,
+            temp_limits=furnace.setpoint_limits if self.furnace else None,
+            flow_limits=MFC.flow_limits,ramp_starts=self.ramp_starts,
+            ramp_rate=self.ramp_update_rate)
     
-    def run(self):
+    def run(self,progress=None):
         '''
-        Runs the recipe from start to finish
+        Runs the recipe from start to finish, or until stop() is called.  Once
+        stopped, a recipe stays stopped.
 
             Parameters:
-                None
+                progress (function): optional, called as progress(step,steps,
+                    phase) when each step starts ('setting'), starts waiting
+                    for the temperature ('settling') and starts its hold
+                    ('holding'), with step counting from 0
             Returns:
-                None
+                completed (bool): False if the recipe was stopped
         '''
+        if progress is None:
+            progress = lambda step,steps,phase: None
         self.logging_state = True
         start_time = time.time()
-        i = 0
-        for time_step in self.times:
-            # Set the temperature and flow rates.
-            with self._lock:
-                print('Time: ' + str(round(time.time()-start_time,3)) + ' s.')
-                # Check to see if we have a furnace.
-                if self.furnace:
-                    print('Setting temperature to ' + str(self.temps[i]))
-                    self.furnace.SetTemp(self.temps[i])
-                # Check to see if we have MFCs.
-                if self.MFCs:
-                    for gas in self.MFCs:
-                        if i > 0:
-                            if self.flow[gas][i] == self.flow[gas][i-1]:
-                                pass
-                            else:
-                                print('Setting ' + gas + ' to ' + str(self.flow[gas][i]))
-                                self.MFCs[gas].SetFlow(self.flow[gas][i])
-                        else:
-                            print('Setting ' + gas + ' to ' + str(self.flow[gas][i]))
-                            self.MFCs[gas].SetFlow(self.flow[gas][i])
-            
-            # Wait for the temperature to rise/fall to a value
-            # close to the setpoint.
-            temp_diff = 100
-            while temp_diff > 2:
-                with self._lock:
+        steps = len(self.schedule.steps)
+        # Logging stops however the run ends, including a write or settle
+        # which raises.
+        try:
+            for step in self.schedule.steps:
+                if self.stop_event.is_set():
+                    break
+                progress(step.index,steps,'setting')
+                # Write the setpoints which change at this step.  Setpoint
+                # writes jump ahead of any logging polls waiting for the bus.
+                with transaction_priority(SETPOINT):
+                    print('Time: ' + str(round(time.time()-start_time,3)) +
+                        ' s.')
+                    for device,setpoint in step.writes:
+                        self.__Write(device,setpoint)
+
+                # Wait for the temperature to settle on the setpoint.
+                progress(step.index,steps,'settling')
+                if step.settle is not None:
+                    self.__Settle(step.settle)
+
+                # Wait the recipe step time, writing any ramps at their times.
+                # The times are from the start of the hold, not the last write,
+                # so a slow write does not stretch the ramp.
+                if self.stop_event.is_set():
+                    break
+                progress(step.index,steps,'holding')
+                hold_start = time.monotonic()
+                for offset,device,setpoint in step.ramp_writes:
+                    if self.stop_event.wait(hold_start + offset -
+                        time.monotonic()):
+                        break
+                    with transaction_priority(SETPOINT):
+                        self.__Write(device,setpoint,verbose=False)
+                self.stop_event.wait(hold_start + step.hold - time.monotonic())
+            completed = not self.stop_event.is_set()
+        finally:
+            self.__StopLogging()
+        return completed
+
+    def stop(self):
+        '''
+        Stops the recipe and the logging.  Returns straight away; run() and
+        logging() return once any bus transaction they are in has finished.
+        The devices are left as they are, see safe_state().
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        self.stop_event.set()
+        self.__StopLogging()
+        # Wakes run() if it is waiting on a reading.
+        self.telemetry.close()
+
+    def safe_state(self):
+        '''
+        Puts the devices in a safe state: the furnace setpoint to safe_temp,
+        the gases in safe_flows to their flow and every other gas off.  Keeps
+        going if a device does not answer.
+
+            Parameters:
+                None
+            Returns:
+                success (bool): whether every device accepted its setpoint
+        '''
+        success = True
+        with transaction_priority(SETPOINT):
+            for gas in self.MFCs:
+                flow = self.safe_flows.get(gas,0)
+                print('Setting ' + gas + ' to ' + str(flow))
+                try:
+                    self.MFCs[gas].SetFlow(flow)
+                except Warning:
+                    success = False
+            if self.furnace:
+                print('Setting temperature to ' + str(self.safe_temp))
+                try:
+                    self.furnace.SetTemp(self.safe_temp)
+                except Warning:
+                    success = False
+        return success
+
+    def __Write(self,device,setpoint,verbose=True):
+        '''
+        Writes the setpoint of the furnace ('Temp') or of a gas.
+        '''
+        if device == 'Temp':
+            if verbose:
+                print('Setting temperature to ' + str(setpoint))
+            self.furnace.SetTemp(setpoint)
+        else:
+            if verbose:
+                print('Setting ' + device + ' to ' + str(setpoint))
+            self.MFCs[device].SetFlow(setpoint)
+
+    def __Settle(self,target):
+        '''
+        Waits for the temperature to settle on a target.  The temperature
+        comes from the readings logging() publishes; the thread wakes as each
+        one arrives and hands the detector every reading since it last
+        looked, so the hold starts with the reading which settles it.  If
+        nothing is published for settle_poll seconds, e.g. logging() is not
+        running or has ended, it reads the furnace itself, every settle_poll
+        seconds.  Only readings taken after the call count.
+        Returns early if the recipe is stopped; raises Warning if the
+        temperature does not settle in time.
+        '''
+        # The detector runs on time.monotonic(), since logging() may start a
+        # new run clock while it waits.
+        latest = time.monotonic()
+        detector = settle_detector(target,self.settle_tolerance,
+            self.settle_dwell,self.settle_slope,self.settle_timeout,
+            start=latest)
+        queried = None
+        while detector.state is None and not self.stop_event.is_set():
+            wait = self.settle_poll
+            remaining = detector.remaining(time.monotonic())
+            if remaining is not None:
+                wait = min(wait,remaining)
+            clock = self.clock
+            readings = []
+            if clock is not None and not self.telemetry.closed:
+                readings = [(clock.monotonic_start + t,value) for value,t in
+                    self.telemetry.since('Temp',
+                    after=latest - clock.monotonic_start,timeout=wait)]
+            elif queried is not None:
+                # Nothing is publishing, so pace the reads below.
+                self.stop_event.wait(min(queried + self.settle_poll -
+                    time.monotonic(),wait))
+            if self.stop_event.is_set():
+                return
+            if not readings:
+                with transaction_priority(SETTLE):
+                    queried = time.monotonic()
                     try:
-                        curr_temp = self.furnace.QueryTemp()
-                    except Warning:
-                        pass
-                temp_diff = abs(curr_temp-self.temps[i])
-                # print('Temperature difference: ' + str(temp_diff))
-                time.sleep(3)
-
-            # Wait the recipe step time.
-            time.sleep(time_step)
-            i = i + 1
+                        readings = [(time.monotonic(),
+                            self.furnace.QueryTemp())]
+                    except Warning as e:
+                        print(e)
+            for t,curr_temp in readings:
+                latest = t
+                if detector.update(t,curr_temp):
+                    break
+            if detector.state is None and remaining == 0:
+                break
+        if detector.state != 'settled' and not self.stop_event.is_set():
+            message = 'The temperature did not settle on ' + str(target) + ' C'
+            if self.settle_timeout is not None:
+                message = message + ' within ' + str(self.settle_timeout) + ' s'
+            raise Warning(message + '.')
+
+    def __Plot(self,tick_time,readings):
+        '''
+        Subscriber which adds each reading to the plot buffers.  Looks the
+        buffers up on every call, since the GUI swaps in its own.
+        '''
+        for channel,(reading,acquired_time) in readings.items():
+            if reading is not None:
+                self.history.append(channel,acquired_time,reading)
+                self.live.append(channel,acquired_time,reading)
+
+    def __StopLogging(self):
+        '''
+        Ends logging() without waiting for the next read to fall due.
+        '''
         self.logging_state = False
+        if self.scheduler:
+            self.scheduler.stop()
 
     def initialize(self):
         '''
@@ -182,94 +389,206 @@ class recipe():
 
         return success
 
-    def logging(self,freq,filename):
+    def logging(self,freq,filename,flush_interval=1.0,binary=None,rates=None):
         '''
-        Logs the operating parameters at a given frequency.
+        Logs the operating parameters.  Each device is read at its own rate on
+        a fixed grid of deadlines, so the time the reads take does not stretch
+        the interval, and the samples are written to file by a background
+        thread so polling never waits on the disk.
+
+        Each row of the log holds the channels read at one deadline: Time, the
+        deadline, and a <channel>_time column with when each reading was
+        taken, all in seconds since logging started.  Channels which were not
+        due are left empty.
 
             Parameters:
-                freq (float): logging frequency in Hz
+                freq (float): logging frequency in Hz for devices without a
+                    rate in rates
                 filename (str): filename including the file extension
+                flush_interval (float): how often the log is flushed to disk
+                    in seconds
+                binary (bool): write the binary format from binary_log.py
+                    instead of CSV, by default if the filename ends in .cvdlog
+                rates (dict): rates in Hz by device ('Furnace', a gas or
+                    'Press') or by kind ('Temp', 'Flow' or 'Press'), e.g.
+                    recipe.log_rates
             Returns:
                 None
         '''
-        log_start = time.time()
-        delay = 1/freq
-        while self.logging_state:
-        # for i in range(50):
-            try:
-                with self._lock:
-                    params = self.poll()
-                log_time = time.time()-log_start
-                params['Time'] = log_time
-                self.__write_to_file(filename,params)
-            except Warning:
-                pass
-            time.sleep(delay)
+        if binary is None:
+            binary = filename.endswith(binary_log.extension)
+        if rates is None:
+            rates = {}
+        self.clock = run_clock()
+        self.telemetry.clear()
+        self.history.clear()
+        self.live.clear()
+        queries = self.__Queries()
+        channels = []
+        for name in queries:
+            channels.extend(self.__Readings(name,None))
+        fieldnames = channels + ['Time'] + \
+            [channel + binary_log.time_suffix for channel in channels]
+        self.log_writer = log_writer(filename,flush_interval=flush_interval,
+            binary=binary,metadata=self.clock.metadata(),fieldnames=fieldnames)
+        # Devices on different ports are read in parallel, a worker per bus.
+        self.scheduler = acquisition_scheduler(self.press_trans.bus,self.clock)
+        for name,(bus,baudrate,query) in queries.items():
+            rate = rates.get(name,rates.get(recipe.__Kind(name),freq))
+            self.scheduler.add_channel(name,rate,baudrate,query,bus)
+
+        def on_sample(tick_time,results):
+            # Every reading is published once, split into channels; the log,
+            # the plots and run() all take it from there.
+            readings = {}
+            for name,(value,acquired_time) in results.items():
+                for channel,reading in self.__Readings(name,value).items():
+                    readings[channel] = (reading,acquired_time)
+            self.telemetry.publish(tick_time,readings)
+
+        def log_sample(tick_time,readings):
+            sample = {'Time':tick_time}
+            for channel,(reading,acquired_time) in readings.items():
+                sample[channel] = reading
+                sample[channel + binary_log.time_suffix] = acquired_time
+            self.log_writer.write(sample)
+
+        self.log_writer.start()
+        self.telemetry.subscribe(log_sample)
+        try:
+            # Each read takes the bus on its own, at the lowest priority, so
+            # the run loop can get in between them.
+            with transaction_priority(TELEMETRY):
+                self.scheduler.run(on_sample,
+                    running=lambda: self.logging_state)
+        finally:
+            self.telemetry.unsubscribe(log_sample)
+            # No more readings are coming; wakes anything waiting on one.
+            self.telemetry.close()
+            self.log_writer.close()
+            if self.log_writer.dropped:
+                print('Dropped ' + str(self.log_writer.dropped) +
+                    ' samples because the log writer fell behind.')
+            for name,stats in self.scheduler.stats().items():
+                if stats['overruns']:
+                    print(name + ' overran ' + str(stats['overruns']) +
+                        ' times and skipped ' + str(stats['skipped']) +
+                        ' reads.')
 
     def poll(self):
         '''
-        Polls all devices to query current operating parameters.
+        Polls all devices to query current operating parameters, and
+        publishes the readings to telemetry.  While logging() is running the
+        devices are already being read, and telemetry.latest() gives the same
+        values without adding to the bus traffic.
 
             Parameters:
                 None
             Returns:
                 current_params (dict): a dictionary of all the current operating
                     parameters
+                acquired (dict): when each parameter was read, in seconds
+                    since the start of the run; the midpoint of the exchange
+                    with its device
         '''
+        if self.clock is None:
+            self.clock = run_clock()
+        clock = self.clock
+
+        def stamped(query):
+            # Time each query on its own, the devices are read one after the
+            # other and a slow reply or a retry would otherwise skew them all.
+            def stamped_query():
+                start = clock.now()
+                value = query()
+                return value,(start + clock.now())/2
+            return stamped_query
+
+        # Build the list of queries first so each bus can group the ones that
+        # share a baud rate instead of switching the port back and forth.
+        # The buses are read in parallel.
+        queries = self.__Queries()
+        buses = {}
+        for name,(bus,baudrate,query) in queries.items():
+            buses.setdefault(bus,[]).append(name)
+        values = {}
+        errors = []
+        level = current_priority()
+        def read_bus(bus,names):
+            try:
+                with transaction_priority(level):
+                    results = bus.batch([(queries[name][1],
+                        stamped(queries[name][2])) for name in names])
+                values.update(zip(names,results))
+            except Exception as error:
+                # Raised again below, once every bus has finished.
+                errors.append(error)
+        workers = [threading.Thread(target=read_bus,args=(bus,names))
+            for bus,names in buses.items()]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if errors:
+            # The device's own error, e.g. a Warning which names it.
+            raise errors[0]
         current_params = {}
-        # Check to see if we have a furnace.
+        acquired = {}
+        readings = {}
+        for name in queries:
+            value,acquired_time = values[name]
+            for channel,reading in self.__Readings(name,value).items():
+                current_params[channel] = reading
+                acquired[channel] = acquired_time
+                readings[channel] = (reading,acquired_time)
+        self.telemetry.publish(clock.now(),readings)
+
+        return current_params,acquired
+
+    def __Queries(self):
+        '''
+        Returns the query for each device as a dict of name -> (bus,
+        baudrate, function).
+        '''
+        queries = {}
+        # Check to see if we have a furnace.  The temperature, setpoint and
+        # output all come back from the one block read.
         if self.furnace:
-            try:
-                current_params['Temp'] = self.furnace.QueryTemp()
-            except Warning:
-                raise Warning('Unsuccessful communication with tube furnace.')
+            queries['Furnace'] = (self.furnace.bus,self.furnace.baudrate,
+                self.furnace.QueryProcess)
         # Check to see if we have MFCs.
         if self.MFCs:
             for gas in self.MFCs:
-                try:
-                    current_params[gas] = self.MFCs[gas].QueryFlow()
-                except Warning:
-                    raise Warning('Unsuccessful communication with MFC.')
+                queries[gas] = (self.MFCs[gas].bus,self.MFCs[gas].baudrate,
+                    self.MFCs[gas].QueryFlow)
         # Assume we always have the pressure transducer.
-        try:
-            current_params['Press'] = self.press_trans.QueryPressure()
-        except Warning:
-            raise Warning('Unsuccessful communication with pressure transducer.')
+        queries['Press'] = (self.press_trans.bus,self.press_trans.baudrate,
+            self.press_trans.QueryPressure)
+        return queries
 
-        return current_params
-
-    def __write_to_file(self,filename,params):
+    def __Readings(self,name,value):
+        '''
+        Splits the value returned by a device's query into channels.  A value
+        of None gives every channel of the device as None.
         '''
-        Write the current process parameters to a file.
+        if name == 'Furnace':
+            if value is None:
+                return {field:None for field in furnace.process_fields}
+            return value
+        return {name:value}
 
-            Parameters:
-                filename (str): filename including the file extension
-                params (dict): the current process parameters as read from the
-                    networked devices
-            Returns:
-                None
+    @staticmethod
+    def __Kind(name):
         '''
-        # If this is the first time writing to the log, delete the file contents
-        # if that file already exists.
-        if self.log_initialize == False:
-            with open(filename,'w') as file:
-                # By taking no action, we will in fact delete the file's
-                # contents
-                pass
-
-        fieldnames = [name for name in params]
-        
-        with open(filename,'a') as file:
-            log_writer = csv.DictWriter(file, fieldnames=fieldnames)
-            if self.log_initialize == False:
-                # Add code to write the date and time here
-                log_writer.writeheader()
-                self.log_initialize = True
-            log_writer.writerow(params)
+        Returns the kind of device a query reads, for looking up its rate.
+        '''
+        if name == 'Furnace':
+            return 'Temp'
+        if name == 'Press':
+            return 'Press'
+        return 'Flow'
     
 if __name__ == '__main__':
-    from equipment import *
-    import threading, time, csv, serial
     test_recipe = recipe('recipe_2')
     # print(test_recipe.steps)
     # print(test_recipe.flow)
@@ -279,7 +598,8 @@ if __name__ == '__main__':
     # test_recipe.poll()
 
     run_task = threading.Thread(target=test_recipe.run)
-    log_task = threading.Thread(target=test_recipe.logging,args=(1,'log_2'))
+    log_task = threading.Thread(target=test_recipe.logging,args=(1,'log_2'),
+        kwargs={'rates':recipe.log_rates})
     run_task.start()
     log_task.start()
 
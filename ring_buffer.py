@@ -0,0 +1,180 @@
+'''
+Fixed size buffers of the most recent samples of each channel, for the live
+plots.  Everything is allocated up front and an append is two array writes, so
+keeping several minutes of every channel costs nothing per sample beyond that.
+
+Each buffer stores every sample twice, at i and i + size, so the newest
+samples are always one contiguous slice of the array and can be handed to the
+plot without copying or reordering.  The buffer holds a margin of samples
+beyond its capacity which views never include, so a view stays untouched for
+the next `margin` appends while the plot draws it.
+
+Classes:
+
+    ring_buffer -> times and values of the newest samples of one channel
+    live_channels -> thread-safe set of ring buffers
+'''
+import threading
+import numpy
+
+class ring_buffer:
+    '''
+    A class which keeps the newest samples of a channel in preallocated
+    arrays.
+
+    ...
+
+    Attributes
+    ----------
+    capacity: int
+        number of samples a view returns once the buffer is full
+    margin: int
+        appends after a view is taken before it can be overwritten
+
+    Public Methods
+    --------------
+    append(t,value)
+    view()
+    clear()
+    '''
+
+    def __init__(self,capacity=3000,margin=256) -> None:
+        self.capacity = capacity
+        self.margin = margin
+        self._size = capacity + margin
+        self._time = numpy.zeros(2*self._size)
+        self._value = numpy.zeros(2*self._size)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return min(self._count,self.capacity)
+
+    def append(self,t,value):
+        '''
+        Adds a sample, replacing the oldest once the buffer is full.
+
+            Parameters:
+                t (float): time of the sample
+                value (float)
+            Returns:
+                None
+        '''
+        i = self._next
+        self._time[i] = t
+        self._time[i + self._size] = t
+        self._value[i] = value
+        self._value[i + self._size] = value
+        self._next = (i + 1) % self._size
+        self._count = self._count + 1
+
+    def view(self):
+        '''
+        Returns the newest samples, oldest first, as views of the buffer.
+
+            Parameters:
+                None
+            Returns:
+                times (numpy.ndarray): contiguous view, do not modify
+                values (numpy.ndarray): contiguous view, do not modify
+        '''
+        count = len(self)
+        # The newest sample is at _next - 1 and again at _next - 1 + _size, so
+        # the slice ending at _next + _size never wraps.
+        end = self._next + self._size
+        return self._time[end - count:end],self._value[end - count:end]
+
+    def clear(self):
+        '''
+        Empties the buffer.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        self._next = 0
+        self._count = 0
+
+class live_channels:
+    '''
+    A class which keeps a ring buffer for each channel.  Samples can be added
+    from the logging thread while the GUI takes views.
+
+    ...
+
+    Attributes
+    ----------
+    capacity: int
+        samples kept for each channel
+    margin: int
+        appends after a view is taken before it can be overwritten
+
+    Public Methods
+    --------------
+    append(name,t,value)
+    view(name)
+    channels()
+    clear()
+    '''
+
+    def __init__(self,capacity=3000,margin=256) -> None:
+        self.capacity = capacity
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._buffers = {}
+
+    def append(self,name,t,value):
+        '''
+        Adds a sample to a channel, creating its buffer the first time.
+
+            Parameters:
+                name (str): channel name, e.g. 'Temp'
+                t (float): time of the sample
+                value (float)
+            Returns:
+                None
+        '''
+        with self._lock:
+            if name not in self._buffers:
+                self._buffers[name] = ring_buffer(self.capacity,self.margin)
+            self._buffers[name].append(t,value)
+
+    def view(self,name):
+        '''
+        Returns the newest samples of a channel, see ring_buffer.view().
+
+            Parameters:
+                name (str): channel name
+            Returns:
+                times (numpy.ndarray)
+                values (numpy.ndarray)
+        '''
+        with self._lock:
+            if name not in self._buffers:
+                return numpy.empty(0),numpy.empty(0)
+            return self._buffers[name].view()
+
+    def channels(self):
+        '''
+        Returns the names of the channels with samples.
+
+            Parameters:
+                None
+            Returns:
+                names (list)
+        '''
+        with self._lock:
+            return list(self._buffers)
+
+    def clear(self):
+        '''
+        Removes every channel, for the start of a new run.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        with self._lock:
+            self._buffers = {}
@@ -0,0 +1,480 @@
+'''
+Shared access to the RS-485 network for the tube furnace CVD system.
+
+The networked devices hang off one or more USB to RS-485 adapters (see
+devices.json).  A single bus object owns each serial port and all the
+transactions on it are funnelled through it; separate ports work in parallel.
+The devices do not all talk at the same baud rate (the MFCs and the furnace use
+9600 while the pressure transducer uses 115200), so the bus only reconfigures
+the port when a transaction needs different line settings than the last one.
+
+The port is kept open between transactions.  If the adapter is unplugged or
+reset the handle is dropped and reopened on a later transaction, backing off
+between attempts so that a missing adapter fails fast instead of stalling every
+poll.
+
+Transactions wait for the port in priority order rather than first come first
+served, so a setpoint write at a step boundary only ever waits for the
+transaction already on the wire, not for a whole logging poll.  The priority
+of the transactions made by a thread is set with the transaction_priority
+context manager; anything not marked is treated as a setpoint write.
+
+Each device keeps an rtt_estimator which tracks how long its replies take, so
+read timeouts follow the device's real response time instead of a fixed three
+seconds, and retries back off exponentially with jitter.
+
+Classes:
+
+    bus -> owner of one serial port shared by several devices
+    rtt_estimator -> running estimate of a device's round trip time
+
+Functions:
+
+    get_bus(port,**line_settings) -> the shared bus object for a given port
+    transaction_priority(level) -> context manager setting the priority of the
+        calling thread's transactions
+    current_priority() -> the priority of the calling thread's transactions
+'''
+import threading, time, heapq, itertools, contextlib, random, math
+import serial
+
+# Priority classes, most urgent first.
+SETPOINT = 0        # safety actions and setpoint writes
+SETTLE = 1          # checks made while waiting for a step to settle
+TELEMETRY = 2       # routine logging polls
+priority_names = {SETPOINT:'setpoint',SETTLE:'settle',TELEMETRY:'telemetry'}
+
+_priority = threading.local()
+
+@contextlib.contextmanager
+def transaction_priority(level):
+    '''
+    Sets the priority of every bus transaction made by the calling thread
+    inside the with block.
+
+        Parameters:
+            level (int): one of SETPOINT, SETTLE or TELEMETRY
+        Returns:
+            None
+    '''
+    previous = getattr(_priority,'level',SETPOINT)
+    _priority.level = level
+    try:
+        yield
+    finally:
+        _priority.level = previous
+
+def current_priority():
+    '''
+    Returns the priority of the calling thread's transactions, so a thread
+    working on its behalf can take the same priority.
+
+        Parameters:
+            None
+        Returns:
+            level (int): one of SETPOINT, SETTLE or TELEMETRY
+    '''
+    return getattr(_priority,'level',SETPOINT)
+
+class _priority_lock:
+    '''
+    A reentrant lock which hands itself to waiting threads in order of
+    priority, then in order of arrival within a priority.
+    '''
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition(threading.Lock())
+        self._owner = None
+        self._depth = 0
+        self._waiting = []
+        self._tickets = itertools.count()
+
+    def acquire(self,level):
+        '''
+        Blocks until the lock is free and no more urgent thread is waiting.
+
+            Parameters:
+                level (int): the priority of the calling thread
+            Returns:
+                wait (float): time spent waiting in seconds
+        '''
+        me = threading.get_ident()
+        with self._cond:
+            if self._owner == me:
+                self._depth = self._depth + 1
+                return 0
+            ticket = (level,next(self._tickets))
+            heapq.heappush(self._waiting,ticket)
+            start = time.monotonic()
+            while self._owner is not None or self._waiting[0] != ticket:
+                self._cond.wait()
+            heapq.heappop(self._waiting)
+            self._owner = me
+            self._depth = 1
+            return time.monotonic() - start
+
+    def release(self):
+        '''
+        Releases the lock and wakes the waiting threads so the most urgent one
+        can take it.
+        '''
+        with self._cond:
+            self._depth = self._depth - 1
+            if self._depth == 0:
+                self._owner = None
+                self._cond.notify_all()
+
+class rtt_estimator:
+    '''
+    Keeps a smoothed estimate of a device's round trip time and its variation
+    (the same estimator TCP uses for its retransmission timer) and derives read
+    timeouts and retry delays from it.
+
+    ...
+
+    Attributes
+    ----------
+    srtt: float
+        smoothed round trip time in seconds, None until the first sample
+    rttvar: float
+        smoothed mean deviation of the round trip time in seconds
+    min_timeout: float
+        lower bound on the read timeout in seconds
+    max_timeout: float
+        upper bound on the read timeout in seconds, also used before any round
+        trip has been measured
+    base_backoff: float
+        delay before the first retry in seconds
+    max_backoff: float
+        upper bound on the delay between retries in seconds
+
+    Public Methods
+    --------------
+    update(rtt)
+    timeout(attempt,reply_length,baudrate)
+    backoff(attempt)
+    '''
+
+    def __init__(self,min_timeout=0.05,max_timeout=3,base_backoff=0.02,
+        max_backoff=0.5) -> None:
+        self.srtt = None
+        self.rttvar = 0
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+    def update(self,rtt):
+        '''
+        Adds a measured round trip time to the estimate.
+
+            Parameters:
+                rtt (float): time from writing the command to receiving the
+                    complete reply, in seconds
+            Returns:
+                None
+        '''
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt/2
+        else:
+            self.rttvar = 0.75*self.rttvar + 0.25*abs(self.srtt - rtt)
+            self.srtt = 0.875*self.srtt + 0.125*rtt
+
+    def timeout(self,attempt=1,reply_length=0,baudrate=None):
+        '''
+        Calculates the read timeout for an attempt.  The timeout doubles with
+        each failed attempt, and when the length of the reply is known the time
+        to clock it onto the wire is added so long replies are not cut short.
+
+            Parameters:
+                attempt (int): 1 for the first attempt, 2 for the first retry
+                reply_length (int): expected reply length in bytes, 0 if unknown
+                baudrate (int): the line speed, needed with reply_length
+            Returns:
+                timeout (float): in seconds
+        '''
+        if self.srtt is None:
+            return self.max_timeout
+        timeout = self.srtt + 4*self.rttvar
+        if reply_length and baudrate:
+            # 10 bits per byte with one start and one stop bit
+            timeout = timeout + reply_length*10/baudrate
+        timeout = timeout*2**(attempt-1)
+        # Round up to 10 ms so the port is not reconfigured for every change in
+        # the estimate.  Float error such as 0.30000000000000004 is not a
+        # reason to round up.
+        timeout = math.ceil(round(timeout*100,6))/100
+        return min(max(timeout,self.min_timeout),self.max_timeout)
+
+    def backoff(self,attempt):
+        '''
+        Calculates how long to wait before retrying.  The delay doubles with
+        each attempt and half of it is randomized so devices which failed
+        together do not retry in lockstep.
+
+            Parameters:
+                attempt (int): the number of the attempt which just failed
+            Returns:
+                delay (float): in seconds
+        '''
+        delay = min(self.base_backoff*2**(attempt-1),self.max_backoff)
+        return delay/2 + random.uniform(0,delay/2)
+
+class bus:
+    '''
+    A class which owns a serial port and serializes every transaction made on
+    it.
+
+    ...
+
+    Attributes
+    ----------
+    port: str
+        the path of the serial port, e.g. '/dev/ttyUSB0'
+    timeout: float
+        the read timeout in seconds
+    bytesize: int
+        data bits of every device on the port
+    parity: str
+        parity of every device on the port, one of serial.PARITY_NAMES
+    stopbits: float
+        stop bits of every device on the port
+    ser: serial.Serial object
+        the open serial port, or None until the first transaction
+    baudrate: int
+        the baud rate the port is currently configured for
+    baud_switches: int
+        number of times the port has been reconfigured, useful to check that
+        polls are being grouped properly
+    reconnects: int
+        number of times the port has been reopened after being lost
+    min_backoff: float
+        delay in seconds before the first attempt to reopen a lost port
+    max_backoff: float
+        upper bound in seconds on the delay between attempts to reopen the port
+
+    Public Methods
+    --------------
+    transaction(baudrate,exchange,timeout)
+    batch(jobs)
+    queue_wait()
+    close()
+    '''
+
+    def __init__(self,port='/dev/ttyUSB0',timeout=3,min_backoff=0.1,
+        max_backoff=5,bytesize=8,parity='N',stopbits=1) -> None:
+        self.port = port
+        self.timeout = timeout
+        self.bytesize = bytesize
+        self.parity = parity
+        self.stopbits = stopbits
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.ser = None
+        self.baudrate = None
+        self.baud_switches = 0
+        self.reconnects = 0
+        self._lock = _priority_lock()
+        self._wait_stats = {level:[0,0,0] for level in priority_names}
+        self._open_failures = 0
+        self._next_open = 0
+        self._lost = False
+
+    def transaction(self,baudrate,exchange,timeout=None):
+        '''
+        Runs a single write/read exchange with exclusive access to the port.
+        If the port turns out to have been lost, it is reopened and the exchange
+        is tried once more before giving up.
+
+            Parameters:
+                baudrate (int): the baud rate the device expects
+                exchange (function): called with the serial.Serial object as
+                    its only argument, should write the command and read the
+                    reply
+                timeout (float): read timeout for this exchange in seconds,
+                    defaults to the bus timeout
+            Returns:
+                whatever exchange returns
+        '''
+        level = current_priority()
+        wait = self._lock.acquire(level)
+        try:
+            stats = self._wait_stats[level]
+            stats[0] = stats[0] + 1
+            stats[1] = stats[1] + wait
+            stats[2] = max(stats[2],wait)
+            if timeout is None:
+                timeout = self.timeout
+            for attempt in range(2):
+                try:
+                    # Changing the settings of a port which has gone away
+                    # fails the same way as the exchange.
+                    self.__Configure(baudrate)
+                    if self.ser.timeout != timeout:
+                        self.ser.timeout = timeout
+                    return exchange(self.ser)
+                except (serial.SerialException,OSError):
+                    # The adapter was unplugged or reset underneath us.
+                    self.__Drop()
+            raise Warning('Lost connection to serial port ' + self.port)
+        finally:
+            self._lock.release()
+
+    def batch(self,jobs):
+        '''
+        Runs a group of jobs, ordering them so that jobs sharing line settings
+        run one after the other.  Jobs at the baud rate the port is already
+        set to go first so a poll cycle switches the port at most once per
+        baud rate.  Each job takes the port for its own transactions only, so
+        a more urgent transaction from another thread, such as a setpoint
+        write, can still run between two jobs and switch the baud rate; the
+        grouping saves switches but does not guarantee them.
+
+            Parameters:
+                jobs (list): list of (baudrate, function) tuples where the
+                    function takes no arguments
+            Returns:
+                results (list): the return value of each job, in the order the
+                    jobs were given
+        '''
+        current = self.baudrate
+        order = sorted(range(len(jobs)),
+            key=lambda i: (jobs[i][0] != current, jobs[i][0]))
+        results = [None]*len(jobs)
+        for i in order:
+            results[i] = jobs[i][1]()
+        return results
+
+    def queue_wait(self):
+        '''
+        Reports how long transactions of each priority class have waited for
+        the port.
+
+            Parameters:
+                None
+            Returns:
+                stats (dict): for each priority class name, a dict with the
+                    number of transactions and the mean and max wait in seconds
+        '''
+        stats = {}
+        for level in priority_names:
+            count,total,longest = self._wait_stats[level]
+            stats[priority_names[level]] = {
+                'count':count,
+                'mean':total/count if count else 0,
+                'max':longest,
+            }
+        return stats
+
+    def close(self):
+        '''
+        Closes the serial port.  It will be reopened by the next transaction.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        self._lock.acquire(SETPOINT)
+        try:
+            if self.ser:
+                self.ser.close()
+            self.ser = None
+            self.baudrate = None
+        finally:
+            self._lock.release()
+
+    def __Drop(self):
+        '''
+        Discards a handle to a port which has stopped working so that the next
+        transaction reopens it.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        try:
+            self.ser.close()
+        except (serial.SerialException,OSError):
+            pass
+        self.ser = None
+        self.baudrate = None
+        self._lost = True
+
+    def __Open(self,baudrate):
+        '''
+        Opens the port.  After a failed attempt, further attempts are refused
+        until a backoff delay has passed, doubling each time up to max_backoff.
+
+            Parameters:
+                baudrate (int): the required baud rate
+            Returns:
+                None
+        '''
+        now = time.monotonic()
+        if now < self._next_open:
+            raise Warning('Serial port ' + self.port + ' is unavailable.')
+        try:
+            self.ser = serial.Serial(port=self.port,baudrate=baudrate,
+                timeout=self.timeout,bytesize=self.bytesize,parity=self.parity,
+                stopbits=self.stopbits)
+        except (serial.SerialException,OSError):
+            delay = min(self.min_backoff*2**self._open_failures,self.max_backoff)
+            self._open_failures = self._open_failures + 1
+            self._next_open = now + delay
+            raise Warning('Unable to open serial port ' + self.port)
+        self._open_failures = 0
+        self._next_open = 0
+        if self._lost:
+            self.reconnects = self.reconnects + 1
+            self._lost = False
+        self.baudrate = baudrate
+
+    def __Configure(self,baudrate):
+        '''
+        Opens the port if required and switches the baud rate only if it
+        differs from the current setting.
+
+            Parameters:
+                baudrate (int): the required baud rate
+            Returns:
+                None
+        '''
+        if self.ser is None:
+            self.__Open(baudrate)
+        elif baudrate != self.baudrate:
+            self.ser.baudrate = baudrate
+            self.baudrate = baudrate
+            self.baud_switches = self.baud_switches + 1
+            # Anything sitting in the buffer was received at the old baud rate
+            # and is garbage at the new one.
+            self.ser.reset_input_buffer()
+
+_buses = {}
+_buses_lock = threading.Lock()
+
+def get_bus(port='/dev/ttyUSB0',**line_settings):
+    '''
+    Returns the bus object for a port, creating it the first time the port is
+    requested so that every device on the port shares it.
+
+        Parameters:
+            port (str): the path of the serial port
+            line_settings: bytesize, parity and stopbits of the port, used
+                when the bus is created; 8N1 by default
+        Returns:
+            bus object
+
+    Raises ValueError if the bus already exists with other line settings.
+    '''
+    with _buses_lock:
+        if port not in _buses:
+            _buses[port] = bus(port,**line_settings)
+        existing = _buses[port]
+        for name,value in line_settings.items():
+            if getattr(existing,name) != value:
+                raise ValueError('Serial port ' + port + ' is already set to '
+                    + name + ' ' + str(getattr(existing,name)) + '.')
+        return existing
@@ -0,0 +1,75 @@
+'''
+Time base for a recipe run.  Readings are stamped with a monotonic clock so the
+timestamps never jump when the wall clock is adjusted, and the clock is tied to
+wall time once, when the run starts, so the timestamps can still be turned
+into dates.
+
+Classes:
+
+    run_clock -> monotonic seconds since the start of a run
+'''
+import time
+
+class run_clock:
+    '''
+    A class which measures time since the start of a run.
+
+    ...
+
+    Attributes
+    ----------
+    wall_start: float
+        wall time at the start of the run, in seconds since the epoch
+    monotonic_start: float
+        time.monotonic() at the start of the run
+
+    Public Methods
+    --------------
+    now()
+    wall(run_time)
+    metadata()
+    '''
+
+    def __init__(self) -> None:
+        # Read the two clocks back to back so the anchor is as tight as
+        # possible.
+        self.monotonic_start = time.monotonic()
+        self.wall_start = time.time()
+
+    def now(self):
+        '''
+        Returns the time since the start of the run.
+
+            Parameters:
+                None
+            Returns:
+                run_time (float): seconds since the start of the run
+        '''
+        return time.monotonic() - self.monotonic_start
+
+    def wall(self,run_time):
+        '''
+        Converts a time since the start of the run to wall time.
+
+            Parameters:
+                run_time (float): seconds since the start of the run
+            Returns:
+                wall_time (float): seconds since the epoch
+        '''
+        return self.wall_start + run_time
+
+    def metadata(self):
+        '''
+        Returns the anchor of the clock, for storing with a log.
+
+            Parameters:
+                None
+            Returns:
+                metadata (dict): 'start_time' in seconds since the epoch and
+                    'start' as local ISO 8601 text
+        '''
+        return {
+            'start_time':self.wall_start,
+            'start':time.strftime('%Y-%m-%dT%H:%M:%S',
+                time.localtime(self.wall_start)),
+        }
@@ -0,0 +1,183 @@
+'''
+Compiles the step table of a recipe into the fixed sequence of writes that
+running it takes.  Each step keeps only the setpoints which differ from the
+step before, so a run writes to a device only when its state actually changes,
+and every step boundary always makes the same bus transactions.  The schedule
+is checked against the device limits when it is compiled, so a bad recipe is
+rejected before anything is written.
+
+A recipe cell can also ramp a setpoint linearly over the step, written as
+start>end, e.g. 25>775 for the temperature.  The start is written when the
+step begins and the intermediate setpoints are worked out here, at the ramp
+update rate, keeping only those which change at the device's resolution.
+The run then writes them at their times during the hold, so a ramp costs at
+most one write per device per update.
+
+Classes:
+
+    schedule_step -> the writes, settle target and hold time of one step
+    recipe_schedule -> the compiled steps and their total hold time
+
+Functions:
+
+    parse_setpoint(text) -> (start, end) of a recipe cell
+    compile_schedule(times,temps,flow,...) -> schedule
+'''
+import collections
+
+schedule_step = collections.namedtuple('schedule_step',
+    ['index','writes','settle','hold','ramp_writes'])
+schedule_step.__doc__ = '''
+    One step of a compiled recipe.
+
+        index (int): step number, from 0
+        writes (tuple): (device, setpoint) pairs to write at the start of the
+            step, where the device is 'Temp' for the furnace or a gas name
+        settle (int): temperature to wait for before holding, the start of
+            the ramp for a ramped temperature, None if the recipe has no
+            furnace
+        hold (float): hold time in seconds once settled
+        ramp_writes (tuple): (offset, device, setpoint) writes to make during
+            the hold, in order, with the offset in seconds from its start
+'''
+
+recipe_schedule = collections.namedtuple('recipe_schedule',
+    ['steps','duration','write_count'])
+recipe_schedule.__doc__ = '''
+    A compiled recipe.
+
+        steps (tuple): schedule_step for each step
+        duration (float): total hold time in seconds; the run takes this long
+            plus the time spent waiting for the temperature to settle
+        write_count (int): number of setpoint writes in the whole run,
+            including the ramps
+'''
+
+def parse_setpoint(text):
+    '''
+    Reads a setpoint cell of a recipe.
+
+        Parameters:
+            text (str): a number, or start>end for a ramp
+        Returns:
+            start (float): start of the ramp, None for a step change
+            end (float): setpoint at the end of the step
+    '''
+    if '>' in text:
+        start,end = text.split('>')
+        return float(start),float(end)
+    return None,float(text)
+
+def compile_schedule(times,temps,flow,temp_limits=None,flow_limits=None,
+    ramp_starts=None,ramp_rate=1,temp_resolution=1,flow_resolution=0.1):
+    '''
+    Compiles and checks the step table of a recipe.
+
+        Parameters:
+            times (list): hold time of each step in seconds
+            temps (list): furnace setpoint of each step, empty without a
+                furnace
+            flow (dict): gas -> list of the flow setpoint of each step
+            temp_limits (tuple): (lowest, highest) furnace setpoint allowed,
+                None for no check
+            flow_limits (tuple): (lowest, highest) flow allowed, None for no
+                check
+            ramp_starts (dict): 'Temp' or gas -> list of the start of the ramp
+                in each step, None for a step change; temps and flow hold the
+                ends of the ramps
+            ramp_rate (float): ramp updates per second
+            temp_resolution (float): smallest furnace setpoint change
+            flow_resolution (float): smallest flow setpoint change
+        Returns:
+            schedule (recipe_schedule)
+
+    Raises ValueError listing every problem found.
+    '''
+    if ramp_starts is None:
+        ramp_starts = {}
+    # Every setpoint of a device, the ends of the steps and the starts of
+    # the ramps, with its limits, units and resolution.
+    devices = {}
+    if temps:
+        devices['Temp'] = (temps,temp_limits,'temperature','C',
+            temp_resolution)
+    for gas in flow:
+        devices[gas] = (flow[gas],flow_limits,gas + ' flow','sccm',
+            flow_resolution)
+
+    problems = []
+    for i,hold in enumerate(times):
+        if hold < 0:
+            problems.append('Step ' + str(i + 1) + ': negative time ' +
+                str(hold) + ' s.')
+    for device,(ends,limits,label,units,resolution) in devices.items():
+        starts = ramp_starts.get(device,[None]*len(ends))
+        for i,(start,end) in enumerate(zip(starts,ends)):
+            for value in (start,end):
+                if value is None or not limits:
+                    continue
+                if not limits[0] <= value <= limits[1]:
+                    problems.append('Step ' + str(i + 1) + ': ' + label + ' ' +
+                        str(value) + ' ' + units + ' is outside ' +
+                        str(limits[0]) + '-' + str(limits[1]) + ' ' + units +
+                        '.')
+            if start is not None and times[i] <= 0:
+                problems.append('Step ' + str(i + 1) + ': the ' + label +
+                    ' ramp needs a step time.')
+    if problems:
+        raise ValueError('Invalid recipe:\n' + '\n'.join(problems))
+
+    steps = []
+    previous = {}
+    for i,hold in enumerate(times):
+        setpoints = []
+        ramp_writes = []
+        for device,(ends,limits,label,units,resolution) in devices.items():
+            start = ramp_starts.get(device,[None]*len(ends))[i]
+            if start is None:
+                setpoints.append((device,ends[i]))
+                continue
+            setpoints.append((device,_Quantize(start,resolution)))
+            ramp_writes.extend(_Ramp(device,start,ends[i],hold,ramp_rate,
+                resolution))
+        # The state of the devices before the first step is unknown, so it
+        # writes everything.
+        writes = tuple((device,value) for device,value in setpoints
+            if previous.get(device) != value)
+        previous.update(setpoints)
+        for offset,device,value in ramp_writes:
+            previous[device] = value
+        settle = dict(setpoints).get('Temp')
+        steps.append(schedule_step(i,writes,settle,hold,
+            tuple(sorted(ramp_writes))))
+    return recipe_schedule(tuple(steps),sum(times),
+        sum(len(step.writes) + len(step.ramp_writes) for step in steps))
+
+def _Quantize(value,resolution):
+    '''
+    Rounds a setpoint to the resolution of its device.
+    '''
+    value = round(value/resolution)*resolution
+    if resolution >= 1:
+        return int(value)
+    # Strip the binary fraction left by the multiplication, e.g. 100.30000001.
+    return round(value,len(repr(resolution).split('.')[-1]))
+
+def _Ramp(device,start,end,hold,rate,resolution):
+    '''
+    Works out the writes which ramp a device from start to end over the hold,
+    at most one per update and only when the setpoint changes.
+    '''
+    writes = []
+    last = _Quantize(start,resolution)
+    updates = int(hold*rate)
+    for k in range(1,updates + 1):
+        offset = k/rate
+        value = _Quantize(start + (end - start)*offset/hold,resolution)
+        if value != last:
+            writes.append((offset,device,value))
+            last = value
+    end = _Quantize(end,resolution)
+    if end != last:
+        writes.append((hold,device,end))
+    return writes
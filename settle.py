@@ -0,0 +1,124 @@
+'''
+Decides when the furnace temperature has settled on its setpoint, from the
+temperature readings as they arrive.  The detector does no reading or waiting
+of its own: it is handed each reading, so it decides the moment the reading
+which completes the condition comes in.
+
+A temperature has settled once every reading for the last `dwell` seconds has
+been within `tolerance` of the target and, if `max_slope` is set, the least
+squares slope of those readings is no steeper than it.  A dwell of 0 settles on
+the first reading inside the band.  If `timeout` is set and the temperature
+has not settled that long after the detector started, it times out.
+
+Classes:
+
+    settle_detector -> settle state of one target, updated reading by reading
+'''
+import collections
+
+class settle_detector:
+    '''
+    A class which works out whether a temperature has settled, one reading at
+    a time.
+
+    ...
+
+    Attributes
+    ----------
+    target: float
+        temperature to settle on
+    tolerance: float
+        largest difference from the target which counts as settled
+    dwell: float
+        seconds the readings must stay within the tolerance
+    max_slope: float
+        steepest slope in degrees per second which counts as settled, None for
+        no limit
+    timeout: float
+        seconds from start to give up after, None for no limit
+    start: float
+        time the detector started, on the same clock as the readings
+    state: str
+        None while settling, then 'settled' or 'timeout'
+    settled_time: float
+        time of the reading which settled it, None until then
+
+    Public Methods
+    --------------
+    update(t,value)
+    remaining(t)
+    '''
+
+    def __init__(self,target,tolerance=2,dwell=0,max_slope=None,timeout=None,
+        start=0) -> None:
+        self.target = target
+        self.tolerance = tolerance
+        self.dwell = dwell
+        self.max_slope = max_slope
+        self.timeout = timeout
+        self.start = start
+        self.state = None
+        self.settled_time = None
+        # The readings since the temperature last came inside the band.
+        self._inside = collections.deque()
+
+    def update(self,t,value):
+        '''
+        Takes the next reading.  Readings must arrive in time order; once
+        the detector has settled or timed out it ignores them.
+
+            Parameters:
+                t (float): time the reading was taken
+                value (float): temperature
+            Returns:
+                state (str): None while settling, 'settled' or 'timeout'
+        '''
+        if self.state is not None:
+            return self.state
+        if abs(value - self.target) > self.tolerance:
+            self._inside.clear()
+        else:
+            self._inside.append((t,value))
+            # Keep only the readings the dwell needs, and at least two for the
+            # slope.
+            while len(self._inside) > 2 and \
+                t - self._inside[1][0] >= self.dwell:
+                self._inside.popleft()
+            if t - self._inside[0][0] >= self.dwell and self.__Flat():
+                self.state = 'settled'
+                self.settled_time = t
+                return self.state
+        if self.timeout is not None and t - self.start >= self.timeout:
+            self.state = 'timeout'
+        return self.state
+
+    def remaining(self,t):
+        '''
+        Returns how long is left before the detector times out.
+
+            Parameters:
+                t (float): current time, on the same clock as the readings
+            Returns:
+                remaining (float): seconds, at least 0; None for no timeout
+        '''
+        if self.timeout is None:
+            return None
+        return max(self.start + self.timeout - t,0)
+
+    def __Flat(self):
+        '''
+        Checks the slope of the readings in the band against max_slope.
+        '''
+        if self.max_slope is None:
+            return True
+        if len(self._inside) < 2:
+            return False
+        count = len(self._inside)
+        mean_t = sum(t for t,value in self._inside)/count
+        mean_value = sum(value for t,value in self._inside)/count
+        spread = sum((t - mean_t)**2 for t,value in self._inside)
+        if spread == 0:
+            return False
+        slope = sum((t - mean_t)*(value - mean_value)
+            for t,value in self._inside)/spread
+        return abs(slope) <= self.max_slope
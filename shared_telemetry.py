@@ -0,0 +1,405 @@
+'''
+Telemetry ring in shared memory, so a recipe can run and log in its own process
+while the GUI process only draws.  The acquisition process writes every reading
+into the ring; the GUI maps the same memory and copies out what is new.  The
+GUI can be closed and reopened during a run and pick the ring up again, and
+its redraws never hold up a bus transaction.
+
+Writes are guarded by a sequence counter (a seqlock): the writer makes it odd
+before changing the ring and even again afterwards, and a reader retries any
+copy during which the counter moved, so it never sees a half-written ring.
+The writer never waits on readers.  Writes from the logging and run threads of
+the acquisition process are serialized by a lock in the writer.
+
+The only thing a reader writes is the stop request word, which the
+acquisition process checks.
+
+The ring records the pid of its writer.  A reader reports a run whose writer
+has died, or which is stuck half way through a write, as failed, and a new
+writer only takes over a ring left behind by a writer which is no longer
+running.
+
+Layout: a 128 byte header, a table of up to 32 channel names of 32 bytes, then
+`capacity` records of (channel index, time, value).
+
+Classes:
+
+    telemetry_writer -> creates the ring and writes readings to it
+    telemetry_reader -> attaches to a ring and reads new readings from it
+'''
+import threading, time, os
+from multiprocessing import shared_memory, resource_tracker
+import numpy
+
+default_name = 'cvd_telemetry'
+magic = b'CVDTLM\x00\x00'
+version = 1
+max_channels = 32
+name_length = 32
+states = ('starting','running','completed','stopped','failed')
+phases = ('','setting','settling','holding')
+
+_header_dtype = numpy.dtype([
+    ('magic','S8'),
+    ('version','<u4'),
+    ('capacity','<u4'),
+    ('seq','<u8'),
+    ('count','<u8'),
+    ('channel_count','<u4'),
+    ('state','<u4'),
+    ('step','<i4'),
+    ('steps','<i4'),
+    ('phase','<u4'),
+    ('stop_request','<u4'),
+    ('writer_pid','<u4'),
+    ('run_start','<f8'),
+],align=True)
+_header_size = 128
+_names_dtype = numpy.dtype('S' + str(name_length))
+_record_dtype = numpy.dtype([('channel','<i4'),('pad','<i4'),('time','<f8'),
+    ('value','<f8')])
+_records_offset = _header_size + max_channels*name_length
+
+def _Alive(pid):
+    '''
+    Returns whether a process is running.
+    '''
+    try:
+        os.kill(pid,0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, as another user.
+        pass
+    return True
+
+def _Views(buffer,capacity):
+    '''
+    Maps the header, the name table and the records onto a shared buffer.
+    '''
+    header = numpy.ndarray((),dtype=_header_dtype,buffer=buffer)
+    names = numpy.ndarray((max_channels,),dtype=_names_dtype,buffer=buffer,
+        offset=_header_size)
+    records = numpy.ndarray((capacity,),dtype=_record_dtype,buffer=buffer,
+        offset=_records_offset)
+    return header,names,records
+
+class telemetry_writer:
+    '''
+    A class which creates a telemetry ring and writes readings into it.  It
+    has the same append() and clear() as live_channels, so a recipe can log
+    straight into it.
+
+    ...
+
+    Attributes
+    ----------
+    name: str
+        name of the shared memory block
+    capacity: int
+        number of readings the ring holds
+
+    Public Methods
+    --------------
+    append(channel,t,value)
+    clear()
+    set_state(state)
+    set_progress(step,steps,phase)
+    stop_requested()
+    close()
+    '''
+
+    def __init__(self,name=default_name,capacity=1 << 20,run_start=0) -> None:
+        '''
+        Raises FileExistsError if a running process is still writing a ring
+        with this name.
+        '''
+        self.name = name
+        self.capacity = capacity
+        size = _records_offset + capacity*_record_dtype.itemsize
+        try:
+            self._memory = shared_memory.SharedMemory(name=name,create=True,
+                size=size)
+        except FileExistsError:
+            # Left behind by a run which did not shut down cleanly, unless its
+            # writer is still going, in which case it has to be stopped first.
+            old = shared_memory.SharedMemory(name=name)
+            pid = 0
+            if old.size >= _header_size:
+                header = numpy.ndarray((),dtype=_header_dtype,buffer=old.buf)
+                if bytes(header['magic']) == magic:
+                    pid = int(header['writer_pid'])
+                del header
+            if pid and pid != os.getpid() and _Alive(pid):
+                old.close()
+                raise FileExistsError('Telemetry ring ' + name +
+                    ' is in use by process ' + str(pid) + '.')
+            old.close()
+            old.unlink()
+            self._memory = shared_memory.SharedMemory(name=name,create=True,
+                size=size)
+        self._header,self._names,self._records = _Views(self._memory.buf,
+            capacity)
+        self._channels = {}
+        self._lock = threading.Lock()
+        header = self._header
+        header['version'] = version
+        header['capacity'] = capacity
+        header['seq'] = 0
+        header['count'] = 0
+        header['channel_count'] = 0
+        header['state'] = 0
+        header['step'] = -1
+        header['steps'] = 0
+        header['phase'] = 0
+        header['stop_request'] = 0
+        header['writer_pid'] = os.getpid()
+        header['run_start'] = run_start
+        # Written last, so a reader never accepts a half set up header.
+        header['magic'] = magic
+
+    def append(self,channel,t,value):
+        '''
+        Writes a reading into the ring, replacing the oldest once it is full.
+
+            Parameters:
+                channel (str): channel name, at most 32 bytes
+                t (float): time of the reading
+                value (float)
+            Returns:
+                None
+        '''
+        if channel not in self._channels and \
+            len(self._channels) == max_channels:
+            raise ValueError('Telemetry ring is limited to ' +
+                str(max_channels) + ' channels.')
+        with self._lock:
+            header = self._header
+            seq = int(header['seq'])
+            header['seq'] = seq + 1
+            if channel not in self._channels:
+                index = len(self._channels)
+                self._names[index] = channel.encode('utf-8')[:name_length]
+                self._channels[channel] = index
+                header['channel_count'] = index + 1
+            count = int(header['count'])
+            record = self._records[count % self.capacity]
+            record['channel'] = self._channels[channel]
+            record['time'] = t
+            record['value'] = value
+            header['count'] = count + 1
+            header['seq'] = seq + 2
+
+    def clear(self):
+        '''
+        Does nothing; the ring is written once per run.  Present so the writer
+        can stand in for live_channels.
+        '''
+        pass
+
+    def set_state(self,state):
+        '''
+        Publishes the state of the run.
+
+            Parameters:
+                state (str): one of states
+            Returns:
+                None
+        '''
+        self._header['state'] = states.index(state)
+
+    def set_progress(self,step,steps,phase):
+        '''
+        Publishes the progress of the recipe, with the same arguments as the
+        progress callback of recipe.run().
+
+            Parameters:
+                step (int): step, from 0
+                steps (int): number of steps
+                phase (str): one of phases
+            Returns:
+                None
+        '''
+        with self._lock:
+            header = self._header
+            seq = int(header['seq'])
+            header['seq'] = seq + 1
+            header['step'] = step
+            header['steps'] = steps
+            header['phase'] = phases.index(phase)
+            header['seq'] = seq + 2
+
+    def stop_requested(self):
+        '''
+        Returns whether a reader has asked for the run to stop.
+
+            Parameters:
+                None
+            Returns:
+                requested (bool)
+        '''
+        return bool(self._header['stop_request'])
+
+    def close(self):
+        '''
+        Unmaps and removes the ring.  Readers which are attached keep their
+        mapping until they close it.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        self._header = self._names = self._records = None
+        self._memory.close()
+        self._memory.unlink()
+
+class telemetry_reader:
+    '''
+    A class which attaches to a telemetry ring and reads the readings written
+    since it last looked.
+
+    ...
+
+    Attributes
+    ----------
+    name: str
+        name of the shared memory block
+    capacity: int
+        number of readings the ring holds
+    lost: int
+        readings overwritten before this reader copied them
+
+    Public Methods
+    --------------
+    read()
+    status()
+    request_stop()
+    close()
+    '''
+
+    def __init__(self,name=default_name) -> None:
+        '''
+        Raises FileNotFoundError if there is no ring, and ValueError if the
+        memory is not a telemetry ring.
+        '''
+        self.name = name
+        self._memory = shared_memory.SharedMemory(name=name)
+        # Attaching registers the block with this process's resource tracker,
+        # which would remove it when the GUI exits and end the run's ring.
+        resource_tracker.unregister(self._memory._name,'shared_memory')
+        header = numpy.ndarray((),dtype=_header_dtype,buffer=self._memory.buf)
+        if bytes(header['magic']) != magic or int(header['version']) > version:
+            self._memory.close()
+            raise ValueError('Shared memory ' + name +
+                ' is not a telemetry ring.')
+        self.capacity = int(header['capacity'])
+        self._header,self._names,self._records = _Views(self._memory.buf,
+            self.capacity)
+        self._records.flags.writeable = False
+        self._names.flags.writeable = False
+        self._position = 0
+        self._channel_names = []
+        self.lost = 0
+
+    def read(self,retries=100):
+        '''
+        Copies out the readings written since the last call.  The first call
+        returns everything still in the ring.
+
+            Parameters:
+                retries (int): how many times to retry a copy the writer
+                    interfered with before giving up until the next call
+            Returns:
+                readings (list): (channel, time, value) tuples, oldest first
+        '''
+        header = self._header
+        for attempt in range(retries):
+            seq = int(header['seq'])
+            if seq & 1:
+                time.sleep(0)
+                continue
+            count = int(header['count'])
+            channel_count = int(header['channel_count'])
+            start = max(self._position,count - self.capacity)
+            first = start % self.capacity
+            length = count - start
+            if first + length <= self.capacity:
+                records = self._records[first:first + length].copy()
+            else:
+                records = numpy.concatenate((self._records[first:],
+                    self._records[:first + length - self.capacity]))
+            names = [bytes(name).decode('utf-8')
+                for name in self._names[:channel_count]]
+            if int(header['seq']) == seq:
+                break
+        else:
+            return []
+        self.lost = self.lost + start - self._position
+        self._position = count
+        self._channel_names = names
+        return [(names[channel],t,value) for channel,t,value in
+            zip(records['channel'].tolist(),records['time'].tolist(),
+            records['value'].tolist())]
+
+    def status(self,retries=100):
+        '''
+        Returns the state and progress of the run.  A run which has not
+        finished is reported as failed, and stale, if its writer is no longer
+        running or the header cannot be read consistently, e.g. because the
+        writer died half way through a write.
+
+            Parameters:
+                retries (int): how many times to retry a copy the writer
+                    interfered with
+            Returns:
+                status (dict): 'state' (one of states), 'step', 'steps',
+                    'phase' (one of phases), 'writer_pid', 'run_start' (wall
+                    time the run started) and 'stale'
+        '''
+        header = self._header
+        for attempt in range(retries):
+            seq = int(header['seq'])
+            status = {
+                'state':states[int(header['state'])],
+                'step':int(header['step']),
+                'steps':int(header['steps']),
+                'phase':phases[int(header['phase'])],
+                'writer_pid':int(header['writer_pid']),
+                'run_start':float(header['run_start']),
+                'stale':False,
+            }
+            if not seq & 1 and int(header['seq']) == seq:
+                break
+            time.sleep(0)
+        else:
+            status['stale'] = True
+        if status['state'] in ('starting','running') and \
+            not _Alive(status['writer_pid']):
+            status['stale'] = True
+        if status['stale'] and status['state'] in ('starting','running'):
+            status['state'] = 'failed'
+        return status
+
+    def request_stop(self):
+        '''
+        Asks the acquisition process to stop the run.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        self._header['stop_request'] = 1
+
+    def close(self):
+        '''
+        Unmaps the ring, leaving it in place for the run and other readers.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        self._header = self._names = self._records = None
+        self._memory.close()
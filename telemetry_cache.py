@@ -0,0 +1,200 @@
+'''
+Latest value of every channel of a run, fed by the one acquisition stream.
+The logging thread publishes each set of readings once; the log, the plots,
+the run loop and anything else which needs the devices' state subscribe to the
+stream or read the latest values here instead of querying the bus themselves,
+so the bus load depends on the channels read and not on how many things use
+them.
+
+Subscribers are called on the publishing thread, in the order they
+subscribed, and should return quickly since the next reads wait on them.
+Threads which need to block until a new reading arrives use wait(), which
+wakes as soon as the reading is published, or since(), which also returns
+the readings published in between.  The most recent readings of each channel
+are kept for since().
+
+Classes:
+
+    telemetry_cache -> latest readings, subscribers and waits on new readings
+'''
+import threading, collections
+
+class telemetry_cache:
+    '''
+    A class which keeps the latest reading of each channel and passes every
+    published set of readings on to its subscribers.
+
+    ...
+
+    Attributes
+    ----------
+    published: int
+        number of sets of readings published since the last clear()
+    closed: bool
+        whether the stream has ended, see close()
+    recent: int
+        readings of each channel kept for since()
+
+    Public Methods
+    --------------
+    publish(tick_time,readings)
+    latest(channel)
+    wait(channel,after,timeout)
+    since(channel,after,timeout)
+    subscribe(callback)
+    unsubscribe(callback)
+    close()
+    clear()
+    '''
+
+    def __init__(self,recent=1024) -> None:
+        self.published = 0
+        self.closed = False
+        self.recent = recent
+        self._latest = {}
+        self._recent = {}
+        self._subscribers = []
+        self._condition = threading.Condition()
+
+    def publish(self,tick_time,readings):
+        '''
+        Records a set of readings and passes them to every subscriber.
+
+            Parameters:
+                tick_time (float): time the readings were due
+                readings (dict): channel -> (value, acquisition time); a value
+                    of None is a failed read, passed on to the subscribers
+                    but not kept as the latest value
+            Returns:
+                None
+        '''
+        with self._condition:
+            for channel,(value,acquired) in readings.items():
+                if value is not None:
+                    self._latest[channel] = (value,acquired)
+                    if channel not in self._recent:
+                        self._recent[channel] = collections.deque(
+                            maxlen=self.recent)
+                    self._recent[channel].append((value,acquired))
+            self.published = self.published + 1
+            subscribers = list(self._subscribers)
+            self._condition.notify_all()
+        # Called without the lock so a subscriber can read the cache.
+        for callback in subscribers:
+            callback(tick_time,readings)
+
+    def latest(self,channel=None):
+        '''
+        Returns the latest reading of a channel, or of every channel.
+
+            Parameters:
+                channel (str): channel name, None for every channel
+            Returns:
+                reading (tuple): (value, acquisition time), None if the
+                    channel has not been read; or a dict of them by channel
+        '''
+        with self._condition:
+            if channel is None:
+                return dict(self._latest)
+            return self._latest.get(channel)
+
+    def wait(self,channel,after=None,timeout=None):
+        '''
+        Waits for a reading of a channel taken after a given time.
+
+            Parameters:
+                channel (str): channel name
+                after (float): acquisition time the reading must be later
+                    than, None for any reading
+                timeout (float): longest wait in seconds, None for no limit
+            Returns:
+                reading (tuple): (value, acquisition time), None if the
+                    timeout ran out or the stream was closed first
+        '''
+        def ready():
+            reading = self._latest.get(channel)
+            return self.closed or (reading is not None and
+                (after is None or reading[1] > after))
+
+        with self._condition:
+            if not self._condition.wait_for(ready,timeout) or self.closed:
+                return None
+            return self._latest[channel]
+
+    def since(self,channel,after=None,timeout=None):
+        '''
+        Waits for readings of a channel taken after a given time, and returns
+        every one of them still kept, so a reader which wakes late does not
+        miss any.
+
+            Parameters:
+                channel (str): channel name
+                after (float): acquisition time the readings must be later
+                    than, None for every reading kept
+                timeout (float): longest wait in seconds, None for no limit
+            Returns:
+                readings (list): (value, acquisition time) tuples, oldest
+                    first; empty if the timeout ran out or the stream was
+                    closed first
+        '''
+        if self.wait(channel,after,timeout) is None:
+            return []
+        with self._condition:
+            return [reading for reading in self._recent.get(channel,())
+                if after is None or reading[1] > after]
+
+    def subscribe(self,callback):
+        '''
+        Adds a subscriber, called as callback(tick_time,readings) for every
+        set of readings published from now on.
+
+            Parameters:
+                callback (function)
+            Returns:
+                None
+        '''
+        with self._condition:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self,callback):
+        '''
+        Removes a subscriber.  Does nothing if it is not subscribed.
+
+            Parameters:
+                callback (function)
+            Returns:
+                None
+        '''
+        with self._condition:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def close(self):
+        '''
+        Ends the stream: every wait() returns None straight away until
+        clear() is called.  The latest values can still be read.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+    def clear(self):
+        '''
+        Forgets the latest values and reopens the stream, for the start of a
+        new run.  The subscribers are kept.
+
+            Parameters:
+                None
+            Returns:
+                None
+        '''
+        with self._condition:
+            self._latest = {}
+            self._recent = {}
+            self.published = 0
+            self.closed = False
@@ -0,0 +1,7 @@
+'''
+The modules live at the top of the repository rather than in a package, so
+put it on the path for every test.
+'''
+import os, sys
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,130 @@
+'''
+Tests for the deadline based scheduler in acquisition.py.
+'''
+import threading
+from acquisition import acquisition_scheduler
+from rs485 import bus
+from run_clock import run_clock
+
+class sim_clock:
+    # A run clock which only moves when the test moves it.
+    def __init__(self):
+        self.time = 0.0
+
+    def now(self):
+        return self.time
+
+class sim_event(threading.Event):
+    # A stop event whose wait() moves the simulated clock on instead of
+    # sleeping.  With early set, every other wait wakes half way through.
+    def __init__(self,clock,early=False):
+        super().__init__()
+        self.clock = clock
+        self.early = early
+        self.waits = 0
+
+    def wait(self,timeout=None):
+        self.waits = self.waits + 1
+        if self.early and self.waits % 2:
+            timeout = timeout/2
+        self.clock.time = self.clock.time + timeout
+        return self.is_set()
+
+def scheduler(early=False):
+    clock = sim_clock()
+    acquisition = acquisition_scheduler(bus('unused'),clock)
+    acquisition._stop = sim_event(clock,early)
+    return acquisition,clock
+
+def reader(clock,duration,value=1.0):
+    # A query which takes duration seconds of simulated time.
+    def query():
+        clock.time = clock.time + duration
+        return value
+    return query
+
+def collect(acquisition,count):
+    # Runs the scheduler until it has published count batches.
+    samples = []
+    def on_sample(tick_time,readings):
+        samples.append((tick_time,readings))
+        if len(samples) == count:
+            acquisition.stop()
+    acquisition.run(on_sample)
+    return samples
+
+def test_deadlines_do_not_drift():
+    acquisition,clock = scheduler()
+    acquisition.add_channel('Temp',10,9600,reader(clock,0.03))
+    samples = collect(acquisition,100)
+    # Reads taking 30 ms of every 100 ms do not push the grid back.
+    assert [round(tick_time,9) for tick_time,_ in samples] == \
+        [round(i*0.1,9) for i in range(100)]
+    for tick_time,readings in samples:
+        value,acquired = readings['Temp']
+        assert value == 1.0
+        assert abs(acquired - (tick_time + 0.015)) < 1e-9
+    stats = acquisition.stats()['Temp']
+    assert stats['samples'] == 100 and stats['overruns'] == 0
+    assert stats['jitter_max'] < 1e-9
+
+def test_early_wake_publishes_nothing():
+    acquisition,clock = scheduler(early=True)
+    acquisition.add_channel('Temp',10,9600,reader(clock,0.01))
+    samples = collect(acquisition,20)
+    for tick_time,readings in samples:
+        assert list(readings) == ['Temp']
+    assert [round(tick_time,9) for tick_time,_ in samples] == \
+        [round(i*0.1,9) for i in range(20)]
+    assert acquisition._stop.waits == 2*19
+
+def test_overruns_skip_missed_deadlines():
+    acquisition,clock = scheduler()
+    # Reads taking 250 ms at 10 Hz miss two deadlines and make the third.
+    acquisition.add_channel('Press',10,115200,reader(clock,0.25))
+    samples = collect(acquisition,5)
+    assert [round(tick_time,9) for tick_time,_ in samples] == \
+        [0,0.3,0.6,0.9,1.2]
+    stats = acquisition.stats()['Press']
+    assert stats['samples'] == 5
+    assert stats['overruns'] == 5 and stats['skipped'] == 10
+    assert abs(stats['duration_mean'] - 0.25) < 1e-9
+
+def test_failed_reads_are_published():
+    acquisition,clock = scheduler()
+    def query():
+        raise Warning('no reply')
+    acquisition.add_channel('Argon',10,9600,query)
+    samples = collect(acquisition,3)
+    assert [readings['Argon'][0] for _,readings in samples] == [None]*3
+    assert acquisition.stats()['Argon']['failures'] == 3
+
+def test_worker_per_bus():
+    acquisition = acquisition_scheduler(bus('unused'),run_clock())
+    fast_reads = []
+    enough = threading.Event()
+    def slow():
+        # Holds its bus until the other bus has been read several times,
+        # which never happens if the buses share a worker.
+        assert enough.wait(5)
+        return 1.0
+    def fast():
+        fast_reads.append(threading.current_thread())
+        if len(fast_reads) == 5:
+            enough.set()
+        return 2.0
+    acquisition.add_channel('Temp',100,9600,slow,bus('slow'))
+    acquisition.add_channel('Press',100,115200,fast,bus('fast'))
+    samples = []
+    def on_sample(tick_time,readings):
+        samples.append(readings)
+        if 'Temp' in readings:
+            acquisition.stop()
+    acquisition.run(on_sample)
+    assert enough.is_set()
+    assert len(set(fast_reads)) == 1
+    assert fast_reads[0] is not threading.current_thread()
+    # Each batch holds the readings of one bus.
+    for readings in samples:
+        assert list(readings) in (['Temp'],['Press'])
+    assert acquisition.stats()['Press']['samples'] >= 5
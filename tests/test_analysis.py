@@ -0,0 +1,59 @@
+'''
+Tests for loading run logs in analysis.py.
+'''
+import numpy
+import binary_log
+from analysis import load_log
+
+def test_load_csv(tmp_path):
+    filename = tmp_path/'log.csv'
+    filename.write_text('Time,Temp,Press\r\n0,25,745\r\n1,,746\r\n2,26,\r\n')
+    log = load_log(filename)
+    assert list(log) == ['Time','Temp','Press']
+    assert list(log['Time']) == [0,1,2]
+    assert log['Temp'][0] == 25 and numpy.isnan(log['Temp'][1])
+    assert numpy.isnan(log['Press'][2])
+
+def test_bad_rows_do_not_shift_later_rows(tmp_path):
+    filename = tmp_path/'log.csv'
+    filename.write_text('Time,Temp,Press\n0,25,745\n1,26\n2,27,746,9\n'
+        '3,x,747\n4,28,748\n5,29')
+    log = load_log(filename)
+    assert list(log['Time']) == [0,4]
+    assert list(log['Temp']) == [25,28]
+    assert list(log['Press']) == [745,748]
+
+def test_header_only(tmp_path):
+    filename = tmp_path/'log.csv'
+    filename.write_text('Time,Temp\n')
+    log = load_log(filename)
+    assert len(log['Time']) == 0 and len(log['Temp']) == 0
+
+def test_binary_matches_csv(tmp_path):
+    filename = tmp_path/'log.csv'
+    filename.write_text('Time,Temp,Temp_time\n0,25,0.5\n1,,\n2,26.5,2.5\n')
+    binary_log.from_csv(filename,tmp_path/'log.cvdlog')
+    text = load_log(filename)
+    binary = load_log(tmp_path/'log.cvdlog')
+    for name in text:
+        assert numpy.array_equal(text[name],binary[name],equal_nan=True)
+
+def test_truncated_row_in_a_long_log(tmp_path):
+    # A crash mid-write leaves a row cut short in the middle of a value, with
+    # the next run appending after it.
+    rows = ['%d,%d.5,%d' % (i,i,700 + i) for i in range(1000)]
+    rows[400] = rows[400][:4]
+    filename = tmp_path/'log.csv'
+    filename.write_text('Time,Temp,Press\n' + '\n'.join(rows) + '\n')
+    log = load_log(filename)
+    expected = [i for i in range(1000) if i != 400]
+    assert list(log['Time']) == expected
+    assert list(log['Temp']) == [i + 0.5 for i in expected]
+    assert list(log['Press']) == [700 + i for i in expected]
+
+def test_malformed_number_is_dropped(tmp_path):
+    filename = tmp_path/'log.csv'
+    filename.write_text('Time,Temp\n0,25\n1,2.6.1\n2,,\n3,\n4,27\n')
+    log = load_log(filename)
+    assert list(log['Time']) == [0,3,4]
+    assert log['Temp'][0] == 25 and numpy.isnan(log['Temp'][1])
@@ -0,0 +1,79 @@
+'''
+Tests for the binary log format in binary_log.py.
+'''
+import math
+import numpy
+import pytest
+import binary_log
+
+names = ['Time','Temp','Temp_time','Press','Press_time']
+samples = [
+    {'Time':0.0,'Temp':25,'Temp_time':0.0123456789,'Press':745.686,
+        'Press_time':0.01},
+    {'Time':1.0,'Temp':None,'Press':745.5,'Press_time':1.02},
+    {'Time':2.0,'Temp':26,'Temp_time':2.03,'Press':746.0,'Press_time':2.01,
+        'Unknown':1},
+]
+
+def write(filename,metadata=None):
+    dtype = binary_log.log_dtype(names)
+    with open(filename,'wb') as file:
+        file.write(binary_log.header(dtype,metadata))
+        file.write(binary_log.pack(samples,dtype))
+
+def test_dtype():
+    dtype = binary_log.log_dtype(names)
+    assert dtype['Time'] == numpy.dtype('<f8')
+    assert dtype['Temp_time'] == numpy.dtype('<f8')
+    assert dtype['Temp'] == numpy.dtype('<f4')
+
+def test_header_alignment(tmp_path):
+    filename = tmp_path/'run.cvdlog'
+    write(filename,{'recipe':'example'})
+    with open(filename,'rb') as file:
+        dtype,length,metadata = binary_log.read_header(file)
+    assert length % binary_log.alignment == 0
+    assert dtype.names == tuple(names)
+    assert metadata['recipe'] == 'example' and 'created' in metadata
+
+def test_round_trip(tmp_path):
+    filename = tmp_path/'run.cvdlog'
+    write(filename)
+    columns = binary_log.columns(filename)
+    assert list(columns) == names
+    assert list(columns['Time']) == [0,1,2]
+    # Times keep full precision, readings are float32.
+    assert columns['Temp_time'][0] == 0.0123456789
+    assert columns['Press'][0] == numpy.float32(745.686)
+    assert math.isnan(columns['Temp'][1]) and math.isnan(columns['Temp_time'][1])
+
+def test_truncated_record_is_ignored(tmp_path):
+    filename = tmp_path/'run.cvdlog'
+    write(filename)
+    with open(filename,'ab') as file:
+        file.write(b'\x00'*5)
+    assert len(binary_log.load(filename)) == 3
+
+def test_empty_log(tmp_path):
+    filename = tmp_path/'run.cvdlog'
+    with open(filename,'wb') as file:
+        file.write(binary_log.header(binary_log.log_dtype(names)))
+    assert len(binary_log.load(filename)) == 0
+
+def test_not_a_log(tmp_path):
+    filename = tmp_path/'run.csv'
+    filename.write_text('Time,Temp\n0,25\n' + ' '*32)
+    with pytest.raises(ValueError):
+        binary_log.load(filename)
+
+def test_csv_round_trip(tmp_path):
+    original = tmp_path/'run.cvdlog'
+    write(original)
+    binary_log.to_csv(original,tmp_path/'run.csv')
+    lines = (tmp_path/'run.csv').read_text().splitlines()
+    assert lines[0] == ','.join(names)
+    assert lines[1] == '0,25,0.0123456789,745.686,0.01'
+    assert lines[2] == '1,,,745.5,1.02'
+    binary_log.from_csv(tmp_path/'run.csv',tmp_path/'copy.cvdlog')
+    copy = binary_log.load(tmp_path/'copy.cvdlog')
+    assert copy.tobytes() == binary_log.load(original).tobytes()
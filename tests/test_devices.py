@@ -0,0 +1,105 @@
+'''
+Tests for reading and checking the device map in devices.py.
+'''
+import json
+import pytest
+from devices import device_config, default_file
+
+def write(tmp_path,devices,buses=None):
+    filename = tmp_path/'devices.json'
+    with open(filename,'w') as file:
+        json.dump({'buses':buses or {},'devices':devices},file)
+    return str(filename)
+
+def base():
+    return [
+        {'name':'Furnace','protocol':'furnace','port':'/dev/ttyUSB0',
+            'address':5},
+        {'name':'Press','protocol':'pressure_trans','port':'/dev/ttyUSB1',
+            'address':123},
+        {'name':'Argon','protocol':'MFC','port':'/dev/ttyUSB0',
+            'address':102,'aliases':['Ar']},
+    ]
+
+def problems(tmp_path,devices,buses=None):
+    with pytest.raises(ValueError) as error:
+        device_config(write(tmp_path,devices,buses))
+    return str(error.value)
+
+def test_default_file():
+    config = device_config(default_file)
+    assert config.name('He') == 'Helium'
+    assert config.ports() == ['/dev/ttyUSB0']
+
+def test_names_and_ports(tmp_path):
+    config = device_config(write(tmp_path,base()))
+    assert config.name('Ar') == 'Argon'
+    assert config.name('Argon') == 'Argon'
+    assert config.ports() == ['/dev/ttyUSB0','/dev/ttyUSB1']
+    with pytest.raises(KeyError):
+        config.name('Neon')
+
+def test_create_checks_protocol(tmp_path):
+    config = device_config(write(tmp_path,base()))
+    with pytest.raises(ValueError):
+        config.create('Furnace','MFC')
+
+def test_missing_keys(tmp_path):
+    devices = base()
+    del devices[2]['address']
+    assert 'Argon: missing address.' in problems(tmp_path,devices)
+
+def test_bad_types(tmp_path):
+    devices = base()
+    devices[2]['address'] = '102'
+    devices[2]['baudrate'] = True
+    devices[0]['port'] = 0
+    message = problems(tmp_path,devices)
+    assert 'Argon: the address must be a whole number, not "102".' in message
+    assert 'Argon: the baudrate must be a whole number, not true.' in message
+    assert 'Furnace: the port must be a string.' in message
+    # The rejected furnace is not also reported as missing.
+    assert 'There is no device named Furnace.' not in message
+
+def test_unknown_protocol(tmp_path):
+    devices = base()
+    devices[2]['protocol'] = 'valve'
+    assert 'Argon: unknown protocol valve.' in problems(tmp_path,devices)
+
+def test_bad_aliases(tmp_path):
+    devices = base()
+    devices[2]['aliases'] = 'Ar'
+    assert 'Argon: the aliases must be a list of strings.' in \
+        problems(tmp_path,devices)
+
+def test_required_devices(tmp_path):
+    devices = base()
+    del devices[1]
+    devices[0]['protocol'] = 'MFC'
+    message = problems(tmp_path,devices)
+    assert 'There is no device named Press.' in message
+    assert 'Furnace: the protocol must be furnace.' in message
+
+def test_duplicates(tmp_path):
+    devices = base()
+    devices.append({'name':'Helium','protocol':'MFC','port':'/dev/ttyUSB0',
+        'address':102,'aliases':['Ar']})
+    message = problems(tmp_path,devices)
+    assert 'Helium: address 102 on /dev/ttyUSB0 is already used by Argon.' \
+        in message
+    assert 'Helium: the name Ar is already used by Argon.' in message
+
+def test_unknown_line_settings(tmp_path):
+    message = problems(tmp_path,base(),
+        {'/dev/ttyUSB0':{'bytesize':8,'flow':'rts'}})
+    assert '/dev/ttyUSB0: unknown line settings flow.' in message
+
+def test_recipe_gas_must_be_an_MFC(tmp_path):
+    from recipe import recipe
+    config = device_config(write(tmp_path,base()))
+    filename = tmp_path/'recipe'
+    filename.write_text('#Columns: Time,Temp,Ar\n10,25,100\n')
+    assert recipe(str(filename),config).MFCs['Ar'].address == 102
+    filename.write_text('#Columns: Time,Temp,Press\n10,25,100\n')
+    with pytest.raises(ValueError):
+        recipe(str(filename),config)
@@ -0,0 +1,183 @@
+'''
+Tests for the blocking and asyncio drivers against the device emulator.  They
+need a Linux pseudo-terminal.
+'''
+import asyncio, os, time
+import pytest
+import rs485
+from emulator import emulator
+from equipment import MFC, furnace, pressure_trans, modbus_exception
+from modbus import crc16
+from aio_equipment import aio_MFC, aio_furnace, aio_pressure_trans, \
+    get_aio_bus
+
+pytestmark = pytest.mark.skipif(not hasattr(os,'openpty'),
+    reason='needs a pseudo-terminal')
+
+def start(**options):
+    sim = emulator(latency=0.001,seed=1,**options)
+    sim.add_mfc(103,flow=10,time_constant=0.01)
+    sim.add_furnace(5,temp=25,ramp_rate=1000)
+    sim.add_pressure_trans(123,pressure=745.5)
+    sim.start()
+    return sim
+
+@pytest.fixture
+def sim():
+    sim = start()
+    yield sim
+    rs485.get_bus(sim.port).close()
+    sim.stop()
+
+def test_mfc(sim):
+    mfc = MFC(103,port=sim.port)
+    assert mfc.QueryOpMode()
+    assert mfc.QueryFlow() == 10
+    mfc.SetFlow(50)
+    time.sleep(0.1)
+    assert mfc.QueryFlow() == pytest.approx(50,abs=0.01)
+
+def test_furnace(sim):
+    oven = furnace(5,port=sim.port)
+    assert oven.ReportStatus()
+    assert oven.QueryTemp() == 25
+    oven.SetTemp(30)
+    process = oven.QueryProcess()
+    assert process['Setpoint'] == 30
+
+def test_pressure_trans(sim):
+    press = pressure_trans(123,port=sim.port)
+    assert press.ReportStatus()
+    assert press.QueryPressure() == 745.5
+
+def test_furnace_without_process_registers():
+    sim = emulator(latency=0.001)
+    sim.add_furnace(5,temp=25,fields=('Temp',))
+    sim.start()
+    try:
+        oven = furnace(5,port=sim.port)
+        assert oven.QueryProcess() == {'Temp':25,'Setpoint':None,
+            'Output':None}
+        # The block read is not tried again.
+        assert not oven.block_read
+    finally:
+        rs485.get_bus(sim.port).close()
+        sim.stop()
+
+def test_retries_through_corrupt_replies():
+    sim = start(checksum_error_rate=0.3)
+    try:
+        mfc = MFC(103,port=sim.port)
+        oven = furnace(5,port=sim.port)
+        press = pressure_trans(123,port=sim.port)
+        for i in range(5):
+            assert mfc.QueryFlow() == 10
+            assert oven.QueryTemp() == 25
+            assert press.QueryPressure() == 745.5
+    finally:
+        rs485.get_bus(sim.port).close()
+        sim.stop()
+
+def test_seeded_noise_repeats():
+    readings = []
+    for run in range(2):
+        sim = emulator(latency=0.001,seed=7)
+        sim.add_pressure_trans(123,noise=2)
+        sim.start()
+        try:
+            press = pressure_trans(123,port=sim.port)
+            readings.append([press.QueryPressure() for i in range(3)])
+        finally:
+            rs485.get_bus(sim.port).close()
+            sim.stop()
+    assert readings[0] == readings[1]
+    assert len(set(readings[0])) > 1
+
+def test_aio_drivers(sim):
+    async def run():
+        mfc = aio_MFC(103,port=sim.port)
+        oven = aio_furnace(5,port=sim.port)
+        press = aio_pressure_trans(123,port=sim.port)
+        try:
+            return await asyncio.gather(mfc.query_flow(),oven.query_temp(),
+                press.query_pressure())
+        finally:
+            get_aio_bus(sim.port).close()
+    assert asyncio.run(run()) == [10,25,745.5]
+
+def test_aio_furnace_without_process_registers():
+    sim = emulator(latency=0.001)
+    sim.add_furnace(5,temp=25,fields=('Temp',))
+    sim.start()
+    async def run():
+        oven = aio_furnace(5,port=sim.port)
+        try:
+            with pytest.raises(modbus_exception):
+                await oven.query_registers(('Temp','Setpoint'))
+            return await oven.query_process(),oven.device.block_read
+        finally:
+            get_aio_bus(sim.port).close()
+    try:
+        assert asyncio.run(run()) == ({'Temp':25,'Setpoint':None,
+            'Output':None},False)
+    finally:
+        sim.stop()
+
+class silent_stream:
+    # Answers the first few commands with nothing, as a timed out read does.
+    def __init__(self,replies):
+        self.replies = list(replies)
+        self.reply = b''
+
+    def write(self,data):
+        self.reply = self.replies.pop(0)
+
+    async def read(self,size):
+        data,self.reply = self.reply[:size],self.reply[size:]
+        return data
+
+def test_aio_furnace_retries_timeouts():
+    oven = aio_furnace(5,port='unused')
+    reply = bytes.fromhex('05030200') + bytes((25,))
+    reply = reply + crc16(reply)
+    stream = silent_stream([b'',b'\x05',reply])
+    async def transaction(baudrate,exchange):
+        return await exchange(stream)
+    oven.bus.transaction = transaction
+    assert asyncio.run(oven.query_temp()) == 25
+
+def mfc_reply(text):
+    reply = '@@@103ACK' + text + ';'
+    return (reply + '%02X' % (sum(reply.encode('ascii')) & 0xFF)).encode('ascii')
+
+class replay_bus:
+    # Stands in for a bus, answering each transaction with the next reply.
+    port = 'unused'
+
+    def __init__(self,replies):
+        self.replies = list(replies)
+
+    def transaction(self,baudrate,exchange,timeout=None):
+        return self.replies.pop(0),0.001
+
+class aio_replay_bus(replay_bus):
+    async def transaction(self,baudrate,exchange):
+        return self.replies.pop(0)
+
+def test_garbled_values_are_retried():
+    mfc = MFC(103,port='unused')
+    mfc.rtt.base_backoff = 0
+    mfc.bus = replay_bus([mfc_reply('1O.5'),mfc_reply('10.5')])
+    assert mfc.QueryFlow() == 10.5
+    press = pressure_trans(123,port='unused')
+    press.rtt.base_backoff = 0
+    press.bus = replay_bus([b'@123 abc\r\n>',b'@123 745.500\r\n>'])
+    assert press.QueryPressure() == 745.5
+
+def test_aio_garbled_values_are_retried():
+    mfc = aio_MFC(103,port='unused')
+    mfc.bus = aio_replay_bus([mfc_reply('1O.5'),mfc_reply('10.5')])
+    assert asyncio.run(mfc.query_flow()) == 10.5
+    press = aio_pressure_trans(123,port='unused')
+    press.bus = aio_replay_bus([b'@123 abc\r\n>',b'@123 745.500\r\n>'])
+    assert asyncio.run(press.query_pressure()) == 745.5
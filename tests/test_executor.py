@@ -0,0 +1,75 @@
+'''
+Tests for running recipes through the GUI's executor against the device
+emulator, without a display.
+'''
+import threading
+import pytest
+import test_recipe as recipes
+
+QtCore = pytest.importorskip('PyQt5.QtCore')
+from executor import recipe_executor
+
+pytestmark = recipes.pytestmark
+
+class signals:
+    # Records what the executor sends.  The signals are emitted from the run
+    # thread, so they are connected directly rather than through an event
+    # loop.
+    def __init__(self,executor,on_progress=None):
+        self.started = []
+        self.progress = []
+        self.finished = []
+        self.errors = []
+        self.done = threading.Event()
+        self.on_progress = on_progress
+        direct = QtCore.Qt.DirectConnection
+        executor.started.connect(self.started.append,direct)
+        executor.progress.connect(self.__Progress,direct)
+        executor.finished.connect(self.__Finished,direct)
+        executor.error.connect(self.errors.append,direct)
+
+    def __Progress(self,step,steps,phase):
+        self.progress.append((step,steps,phase))
+        if self.on_progress:
+            self.on_progress(step,steps,phase)
+
+    def __Finished(self,completed):
+        self.finished.append(completed)
+        self.done.set()
+
+def test_completed_run(tmp_path):
+    sim = recipes.start()
+    try:
+        run = recipes.load(tmp_path,sim,'Time,Temp,Argon','0.2,30,100')
+        executor = recipe_executor()
+        sent = signals(executor)
+        log = str(tmp_path/'log.csv')
+        assert executor.start(run,10,log)
+        assert sent.done.wait(30) and executor.wait(5)
+        assert sent.finished == [True] and sent.errors == []
+        assert sent.started == [log]
+        assert sent.progress[-1] == (0,1,'holding')
+        assert sim._mfcs['102'].setpoint == 100
+        assert not executor.running()
+    finally:
+        recipes.finish(sim)
+
+def test_stopped_run_is_made_safe(tmp_path):
+    # The furnace never heats, so the run waits to settle until stopped.
+    sim = recipes.start(ramp_rate=0)
+    try:
+        run = recipes.load(tmp_path,sim,'Time,Temp,Argon','10,775,100')
+        executor = recipe_executor()
+        def stop_when_settling(step,steps,phase):
+            if phase == 'settling':
+                executor.stop()
+        sent = signals(executor,stop_when_settling)
+        assert executor.start(run,10,str(tmp_path/'log.csv'))
+        assert sent.done.wait(30) and executor.wait(5)
+        assert sent.finished == [False] and sent.errors == []
+        assert 'settling' in [phase for _,_,phase in sent.progress]
+        # The safe state turns the gas off and the furnace down.
+        assert sim._mfcs['102'].setpoint == 0
+        assert sim._furnaces[5].setpoint == run.safe_temp
+    finally:
+        recipes.finish(sim)
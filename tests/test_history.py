@@ -0,0 +1,73 @@
+'''
+Tests for the min/max pyramid in history.py.
+'''
+import numpy
+from history import channel_history, run_history
+
+def filled(count,factor=4):
+    history = channel_history(factor)
+    values = numpy.sin(numpy.arange(count)*0.37)*100
+    for t,value in enumerate(values):
+        history.append(float(t),value)
+    return history,values
+
+def test_small_view_is_every_sample():
+    history,values = filled(50)
+    x,y = history.view(pixels=100)
+    assert numpy.array_equal(x,numpy.arange(50))
+    assert numpy.array_equal(y,values)
+
+def test_pyramid_levels_summarize_bins():
+    history,values = filled(4**4 + 3)
+    # The first level summarizes 4 samples, the next 16 and so on.
+    for level,(times,lows,highs) in enumerate(history._levels):
+        size = 4**(level + 1)
+        bins = len(values)//size
+        assert times.length == bins
+        expected = values[:bins*size].reshape(bins,size)
+        assert numpy.array_equal(lows.view(),expected.min(axis=1))
+        assert numpy.array_equal(highs.view(),expected.max(axis=1))
+        assert numpy.array_equal(times.view(),numpy.arange(bins)*size)
+
+def test_view_keeps_extremes():
+    history,values = filled(10000)
+    x,y = history.view(pixels=100)
+    # Two points, the bin minimum and maximum, per bin.
+    assert len(x) == len(y)
+    assert len(x)//2 <= 100
+    assert y.min() == values.min()
+    assert y.max() == values.max()
+    assert (y[0::2] <= y[1::2]).all()
+
+def test_view_includes_partial_bin():
+    history,values = filled(1000 + 5)
+    x,y = history.view(pixels=10)
+    assert x[-1] <= 1004
+    assert y.max() == values.max()
+
+def test_view_range():
+    history,values = filled(10000)
+    x,y = history.view(2000,3000,pixels=2000)
+    # Few enough to draw every sample, with one either side of the range.
+    assert x[0] == 1999 and x[-1] == 3001
+    assert numpy.array_equal(y,values[1999:3002])
+
+def test_span():
+    history = channel_history()
+    assert history.span() == (None,None)
+    history,values = filled(10)
+    assert history.span() == (0,9)
+
+def test_run_history():
+    history = run_history()
+    history.append('Temp',1,25)
+    history.append('Temp',2,26)
+    history.append('Press',0.5,745)
+    assert sorted(history.channels()) == ['Press','Temp']
+    assert history.span() == (0.5,2)
+    x,y = history.view('Temp')
+    assert list(y) == [25,26]
+    x,y = history.view('Argon')
+    assert len(x) == 0
+    history.clear()
+    assert history.channels() == []
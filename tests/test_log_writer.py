@@ -0,0 +1,65 @@
+'''
+Tests for the background log writer in log_writer.py.
+'''
+import threading, time
+import numpy
+import pytest
+from log_writer import log_writer
+from analysis import load_log
+
+def test_close_writes_everything(tmp_path):
+    writer = log_writer(tmp_path/'log.csv',batch_size=16,
+        fieldnames=['Time','Temp'])
+    writer.start()
+    for i in range(1000):
+        assert writer.write({'Time':i,'Temp':25 + i})
+    writer.close()
+    log = load_log(tmp_path/'log.csv')
+    assert writer.written == 1000 and writer.dropped == 0
+    assert numpy.array_equal(log['Time'],numpy.arange(1000))
+    assert numpy.array_equal(log['Temp'],numpy.arange(1000) + 25)
+
+def test_full_queue_drops(tmp_path):
+    writer = log_writer(tmp_path/'log.csv',max_queue=2)
+    # Not started yet, so nothing takes samples off the queue.
+    assert writer.write({'Time':0})
+    assert writer.write({'Time':1})
+    assert not writer.write({'Time':2})
+    assert writer.dropped == 1 and writer.queue_depth() == 2
+    writer.start()
+    writer.close()
+    assert writer.written == 2
+    assert list(load_log(tmp_path/'log.csv')['Time']) == [0,1]
+
+def test_flushed_before_close(tmp_path):
+    writer = log_writer(tmp_path/'log.csv',flush_interval=0.05)
+    writer.start()
+    writer.write({'Time':0,'Temp':25})
+    filename = tmp_path/'log.csv'
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if filename.exists() and filename.read_text() == 'Time,Temp\n0,25\n':
+            break
+        time.sleep(0.01)
+    assert filename.read_text() == 'Time,Temp\n0,25\n'
+    writer.close()
+
+def test_failed_thread_is_raised(tmp_path):
+    # The directory does not exist, so the thread fails as it starts, with
+    # the queue full.
+    writer = log_writer(tmp_path/'missing'/'log.csv',max_queue=1)
+    writer.write({'Time':0})
+    writer.start()
+    errors = []
+    def close():
+        try:
+            writer.close()
+        except FileNotFoundError as error:
+            errors.append(error)
+    closer = threading.Thread(target=close,daemon=True)
+    closer.start()
+    closer.join(5)
+    assert not closer.is_alive()
+    assert len(errors) == 1
+    with pytest.raises(FileNotFoundError):
+        writer.write({'Time':1})
@@ -0,0 +1,92 @@
+'''
+Tests for the communication metrics in metrics.py.
+'''
+import json
+import pytest
+import metrics
+from metrics import comm_metrics, recorder, latency_buckets
+from equipment import MFC, pressure_trans
+
+class clock:
+    # Stands in for time.monotonic, moved on by hand.
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class dead_bus:
+    # Stands in for a bus whose port has failed for good.
+    port = 'dead'
+
+    def transaction(self,baudrate,exchange,timeout=None):
+        raise Warning('port lost')
+
+def test_percentiles():
+    stats = comm_metrics()
+    for i in range(98):
+        stats.transaction('MFC 103','FX?',1,0.0015,True)
+    stats.transaction('MFC 103','FX?',3,0.3,True)
+    stats.transaction('MFC 103','FX?',6,60,False)
+    fx = stats.snapshot()['devices']['MFC 103']['FX?']
+    assert fx['latency_p50'] == 0.002
+    assert fx['latency_p99'] == 0.5
+    assert fx['latency_max'] == 60
+    assert fx['latency_hist'][-1] == 1
+    assert fx['successes'] == 99 and fx['failures'] == 1
+    assert fx['attempts_hist'] == {1:98,3:1,6:1}
+    assert fx['latency_buckets'] == list(latency_buckets)
+
+def test_slowest_bucket_has_no_percentile():
+    stats = comm_metrics()
+    stats.transaction('furnace 5','read 0001+1',6,30,False)
+    furnace = stats.snapshot()['devices']['furnace 5']['read 0001+1']
+    assert furnace['latency_p50'] is None
+    assert furnace['latency_p99'] is None
+    assert furnace['latency_mean'] == 30
+
+def test_utilization(monkeypatch):
+    now = clock()
+    monkeypatch.setattr(metrics.time,'monotonic',now)
+    stats = comm_metrics()
+    # 96 bytes at 9600 baud, 10 bits a byte, is 0.1 s on the wire.
+    stats.attempt('/dev/ttyUSB0',9600,'MFC 103','FX?','ok',0.25,48,48)
+    stats.attempt('/dev/ttyUSB0',9600,'MFC 103','FX?','timeout',None,48,0)
+    now.now = now.now + 2
+    snapshot = stats.snapshot()
+    port = snapshot['ports']['/dev/ttyUSB0']
+    assert snapshot['elapsed'] == 2
+    assert port['bytes'] == 144
+    assert port['wire_utilization'] == pytest.approx(0.15/2)
+    assert port['occupancy'] == pytest.approx(0.25/2)
+    fx = snapshot['devices']['MFC 103']['FX?']
+    assert fx['outcomes'] == {'ok':1,'timeout':1,'checksum':0,'error':0}
+    assert fx['bytes_out'] == 96 and fx['bytes_in'] == 48
+
+def test_snapshot_is_a_copy(tmp_path):
+    stats = comm_metrics()
+    stats.transaction('MFC 103','FX?',1,0.01,True)
+    snapshot = stats.snapshot()
+    snapshot['devices']['MFC 103']['FX?']['attempts_hist'][1] = 0
+    assert stats.snapshot()['devices']['MFC 103']['FX?']['attempts_hist'] \
+        == {1:1}
+    stats.dump(tmp_path/'metrics.json')
+    with open(tmp_path/'metrics.json') as file:
+        dumped = json.load(file)
+    assert dumped['devices']['MFC 103']['FX?']['attempts_hist'] == {'1':1}
+
+def test_lost_port_is_recorded():
+    recorder.reset()
+    mfc = MFC(103,port='unused')
+    mfc.bus = dead_bus()
+    press = pressure_trans(123,port='unused')
+    press.bus = dead_bus()
+    assert mfc.QueryFlow() is None
+    assert press.QueryPressure() is None
+    devices = recorder.snapshot()['devices']
+    recorder.reset()
+    fx = devices['MFC 103']['FX?']
+    assert fx['failures'] == 1 and fx['outcomes']['timeout'] == 1
+    assert fx['attempts_hist'] == {1:1}
+    pressure = devices['pressure_trans 123']['P']
+    assert pressure['failures'] == 1 and pressure['outcomes']['timeout'] == 1
@@ -0,0 +1,63 @@
+'''
+Tests for the MODBUS RTU helpers in modbus.py.
+'''
+import pytest
+from modbus import crc16, register_span, decode_registers, max_block_length
+
+def bitwise_crc16(msg):
+    # The bit by bit CRC the table driven one replaced.
+    CRC = 0xFFFF
+    for num in msg:
+        CRC = CRC ^ num
+        for i in range(8):
+            if CRC & 1:
+                CRC = (CRC >> 1) ^ 0xA001
+            else:
+                CRC = CRC >> 1
+    return bytes((CRC & 0xFF,CRC >> 8))
+
+def test_crc16_check_value():
+    # The CRC-16/MODBUS check value of '123456789' is 0x4B37.
+    assert crc16(b'123456789') == bytes((0x37,0x4B))
+
+def test_crc16_read_frame():
+    # Read one holding register at 0x0000 of slave 1, a common example frame.
+    assert crc16(bytes.fromhex('010300000001')) == bytes.fromhex('840a')
+
+def test_crc16_empty():
+    assert crc16(b'') == bytes((0xFF,0xFF))
+
+def test_crc16_accepts_buffers():
+    frame = bytes.fromhex('05030600150016001e')
+    assert crc16(bytearray(frame)) == crc16(frame)
+    assert crc16(memoryview(frame + b'\x00\x00')[:-2]) == crc16(frame)
+
+def test_crc16_matches_bitwise():
+    for length in range(0,64,7):
+        msg = bytes((i*37 + length) & 0xFF for i in range(length))
+        assert crc16(msg) == bitwise_crc16(msg)
+
+def test_crc16_frame_checks_to_zero():
+    # A frame followed by its own CRC has a remainder of zero.
+    frame = bytes.fromhex('0510007700010201f4')
+    assert crc16(frame + crc16(frame)) == b'\x00\x00'
+
+def test_register_span_covers_fields():
+    assert register_span(('Temp',)) == (0x0001,1)
+    assert register_span(('Temp','Setpoint','Output')) == (0x0001,3)
+    assert register_span(('Output','Temp')) == (0x0001,3)
+
+def test_register_span_too_long():
+    register_map = {'first':(0x0000,1),'last':(max_block_length,1)}
+    with pytest.raises(ValueError):
+        register_span(('first','last'),register_map)
+
+def test_decode_registers_scales():
+    fields = decode_registers((21,22,305,0),0x0001,
+        ('Temp','Setpoint','Output','Alarm'))
+    assert fields == {'Temp':21,'Setpoint':22,'Output':30.5,'Alarm':0}
+
+def test_decode_registers_picks_by_address():
+    # Only the named fields are returned, wherever they are in the block.
+    fields = decode_registers((0,0,0,150,7),0x0000,('Output','Alarm'))
+    assert fields == {'Output':15.0,'Alarm':7}
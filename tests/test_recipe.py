@@ -0,0 +1,76 @@
+'''
+Tests for running recipes against the device emulator.  They need a Linux
+pseudo-terminal.
+'''
+import json, os, threading
+import pytest
+import rs485
+from emulator import emulator
+from devices import device_config
+from recipe import recipe
+
+pytestmark = pytest.mark.skipif(not hasattr(os,'openpty'),
+    reason='needs a pseudo-terminal')
+
+def start(ramp_rate=1000):
+    sim = emulator(latency=0.001)
+    sim.add_furnace(5,temp=25,ramp_rate=ramp_rate)
+    sim.add_pressure_trans(123)
+    sim.add_mfc(102)
+    # Helium, at 104, is in the device map but not on the bus.
+    sim.start()
+    return sim
+
+def finish(sim):
+    rs485.get_bus(sim.port).close()
+    sim.stop()
+
+@pytest.fixture
+def sim():
+    sim = start()
+    yield sim
+    finish(sim)
+
+def load(tmp_path,sim,columns,row):
+    devices = [
+        {'name':'Furnace','protocol':'furnace','port':sim.port,'address':5},
+        {'name':'Press','protocol':'pressure_trans','port':sim.port,
+            'address':123},
+        {'name':'Argon','protocol':'MFC','port':sim.port,'address':102},
+        {'name':'Helium','protocol':'MFC','port':sim.port,'address':104},
+    ]
+    with open(tmp_path/'devices.json','w') as file:
+        json.dump({'devices':devices},file)
+    filename = tmp_path/'recipe'
+    filename.write_text('#Columns: ' + columns + '\n' + row + '\n')
+    test_recipe = recipe(str(filename),
+        device_config(str(tmp_path/'devices.json')))
+    for device in test_recipe.MFCs.values():
+        # Give up on a missing device quickly.
+        device.rtt.max_timeout = 0.05
+    return test_recipe
+
+def test_safe_state(tmp_path,sim):
+    test_recipe = load(tmp_path,sim,'Time,Temp,Argon','0,30,100')
+    assert test_recipe.safe_state()
+
+def test_safe_state_reports_missing_mfc(tmp_path,sim):
+    test_recipe = load(tmp_path,sim,'Time,Temp,Argon,Helium','0,30,100,100')
+    assert not test_recipe.safe_state()
+
+def test_failed_run_stops_logging(tmp_path):
+    # The furnace never heats, so the temperature cannot settle.
+    sim = start(ramp_rate=0)
+    try:
+        test_recipe = load(tmp_path,sim,'Time,Temp,Argon','10,775,100')
+        test_recipe.settle_timeout = 0.5
+        test_recipe.logging_state = True
+        logging = threading.Thread(target=test_recipe.logging,
+            args=(10,str(tmp_path/'log.csv')))
+        logging.start()
+        with pytest.raises(Warning):
+            test_recipe.run()
+        logging.join(5)
+        assert not logging.is_alive()
+    finally:
+        finish(sim)
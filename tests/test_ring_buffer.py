@@ -0,0 +1,65 @@
+'''
+Tests for the live plot buffers in ring_buffer.py.
+'''
+import numpy
+from ring_buffer import ring_buffer, live_channels
+
+def test_empty():
+    buffer = ring_buffer(10,margin=2)
+    times,values = buffer.view()
+    assert len(buffer) == 0 and len(times) == 0 and len(values) == 0
+
+def test_partly_full():
+    buffer = ring_buffer(10,margin=2)
+    for i in range(4):
+        buffer.append(i,i*10)
+    times,values = buffer.view()
+    assert list(times) == [0,1,2,3]
+    assert list(values) == [0,10,20,30]
+
+def test_wraps_to_newest():
+    buffer = ring_buffer(10,margin=2)
+    for count in range(1,40):
+        buffer.append(count - 1,-(count - 1))
+        times,values = buffer.view()
+        expected = numpy.arange(max(count - 10,0),count)
+        assert numpy.array_equal(times,expected)
+        assert numpy.array_equal(values,-expected)
+
+def test_view_is_contiguous_without_copy():
+    buffer = ring_buffer(10,margin=2)
+    for i in range(25):
+        buffer.append(i,i)
+    times,values = buffer.view()
+    assert times.base is buffer._time and values.base is buffer._value
+    assert times.flags['C_CONTIGUOUS']
+
+def test_view_survives_margin_appends():
+    buffer = ring_buffer(10,margin=3)
+    for i in range(17):
+        buffer.append(i,i)
+    times,values = buffer.view()
+    before = values.copy()
+    for i in range(17,20):
+        buffer.append(i,i)
+    assert numpy.array_equal(values,before)
+
+def test_clear():
+    buffer = ring_buffer(10,margin=2)
+    for i in range(15):
+        buffer.append(i,i)
+    buffer.clear()
+    assert len(buffer) == 0
+    buffer.append(100,1)
+    assert list(buffer.view()[0]) == [100]
+
+def test_live_channels():
+    live = live_channels(capacity=5,margin=1)
+    for i in range(8):
+        live.append('Temp',i,25 + i)
+    live.append('Press',0,745)
+    assert sorted(live.channels()) == ['Press','Temp']
+    assert list(live.view('Temp')[1]) == [28,29,30,31,32]
+    assert len(live.view('Argon')[0]) == 0
+    live.clear()
+    assert live.channels() == []
@@ -0,0 +1,238 @@
+'''
+Tests for the shared RS-485 bus in rs485.py, without a serial port.
+'''
+import threading, time
+import pytest
+import rs485
+from rs485 import bus, rtt_estimator, transaction_priority, \
+    current_priority, SETPOINT, SETTLE, TELEMETRY
+
+class clock:
+    # Stands in for time.monotonic, moved on by hand.
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class open_port:
+    # Stands in for a serial.Serial object which is already open.
+    timeout = 3
+
+    def close(self):
+        pass
+
+def queued(lock,count):
+    # Waits until count threads are waiting for the lock.
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        with lock._cond:
+            if len(lock._waiting) == count:
+                return
+        time.sleep(0.001)
+    raise AssertionError('threads did not queue for the lock')
+
+def waiter(lock,level,name,order):
+    # Takes the lock at a priority, notes when it got it and lets it go.
+    def run():
+        lock.acquire(level)
+        order.append(name)
+        lock.release()
+    thread = threading.Thread(target=run,daemon=True)
+    thread.start()
+    return thread
+
+def test_priority_order():
+    lock = rs485._priority_lock()
+    lock.acquire(SETPOINT)
+    order = []
+    threads = []
+    # Queued least urgent first, each in line before the next arrives.
+    for count,(level,name) in enumerate([(TELEMETRY,'telemetry 1'),
+        (SETTLE,'settle 1'),(TELEMETRY,'telemetry 2'),(SETPOINT,'setpoint'),
+        (SETTLE,'settle 2')]):
+        threads.append(waiter(lock,level,name,order))
+        queued(lock,count + 1)
+    lock.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == ['setpoint','settle 1','settle 2','telemetry 1',
+        'telemetry 2']
+
+def test_first_come_first_served_within_a_priority():
+    lock = rs485._priority_lock()
+    lock.acquire(SETPOINT)
+    order = []
+    threads = []
+    for i in range(5):
+        threads.append(waiter(lock,TELEMETRY,i,order))
+        queued(lock,i + 1)
+    lock.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == [0,1,2,3,4]
+
+def test_reentrant():
+    lock = rs485._priority_lock()
+    assert lock.acquire(TELEMETRY) >= 0
+    assert lock.acquire(SETPOINT) == 0
+    order = []
+    thread = waiter(lock,SETPOINT,'other',order)
+    queued(lock,1)
+    lock.release()
+    # Still held once by this thread.
+    time.sleep(0.05)
+    assert order == []
+    lock.release()
+    thread.join(5)
+    assert order == ['other']
+
+def test_transaction_priority():
+    assert current_priority() == SETPOINT
+    with transaction_priority(TELEMETRY):
+        assert current_priority() == TELEMETRY
+        with transaction_priority(SETTLE):
+            assert current_priority() == SETTLE
+        assert current_priority() == TELEMETRY
+        seen = []
+        thread = threading.Thread(target=lambda:
+            seen.append(current_priority()))
+        thread.start()
+        thread.join()
+        # Other threads keep their own priority.
+        assert seen == [SETPOINT]
+    assert current_priority() == SETPOINT
+
+def test_queue_wait(monkeypatch):
+    now = clock()
+    monkeypatch.setattr(rs485.time,'monotonic',now)
+    port = bus('unused')
+    port.ser = open_port()
+    port.baudrate = 9600
+    assert port.transaction(9600,lambda ser: 'reply') == 'reply'
+    port._lock.acquire(SETPOINT)
+    def poll():
+        with transaction_priority(TELEMETRY):
+            port.transaction(9600,lambda ser: None)
+    thread = threading.Thread(target=poll,daemon=True)
+    thread.start()
+    queued(port._lock,1)
+    now.now = now.now + 2
+    port._lock.release()
+    thread.join(5)
+    stats = port.queue_wait()
+    assert stats['setpoint'] == {'count':1,'mean':0,'max':0}
+    assert stats['settle'] == {'count':0,'mean':0,'max':0}
+    assert stats['telemetry'] == {'count':1,'mean':2,'max':2}
+
+class fake_serial:
+    # Stands in for serial.Serial.  Opening fails while available is False.
+    available = True
+    opened = 0
+
+    def __init__(self,port,baudrate,timeout,bytesize,parity,stopbits):
+        fake_serial.opened = fake_serial.opened + 1
+        if not fake_serial.available:
+            raise rs485.serial.SerialException('could not open port')
+        self.baudrate = baudrate
+        self.timeout = timeout
+
+    def close(self):
+        pass
+
+    def reset_input_buffer(self):
+        pass
+
+def serial_port(monkeypatch):
+    # A bus on a fake port with a hand moved clock.
+    now = clock()
+    monkeypatch.setattr(rs485.time,'monotonic',now)
+    monkeypatch.setattr(rs485.serial,'Serial',fake_serial)
+    monkeypatch.setattr(fake_serial,'available',True)
+    monkeypatch.setattr(fake_serial,'opened',0)
+    return bus('unused',min_backoff=1,max_backoff=4),now
+
+def test_reopen_backs_off(monkeypatch):
+    port,now = serial_port(monkeypatch)
+    fake_serial.available = False
+    for delay in (1,2,4,4):
+        opened = fake_serial.opened
+        with pytest.raises(Warning,match='Unable to open'):
+            port.transaction(9600,lambda ser: None)
+        assert fake_serial.opened == opened + 1
+        # Refused without trying the port until the delay has passed.
+        now.now = now.now + delay - 0.01
+        with pytest.raises(Warning,match='unavailable'):
+            port.transaction(9600,lambda ser: None)
+        assert fake_serial.opened == opened + 1
+        now.now = now.now + 0.01
+    fake_serial.available = True
+    assert port.transaction(9600,lambda ser: 'reply') == 'reply'
+    assert port.reconnects == 0
+    # The backoff starts again from the shortest delay after a success.
+    port.close()
+    fake_serial.available = False
+    with pytest.raises(Warning):
+        port.transaction(9600,lambda ser: None)
+    assert port._next_open == now.now + 1
+
+def test_lost_port_is_reopened(monkeypatch):
+    port,now = serial_port(monkeypatch)
+    port.transaction(9600,lambda ser: None)
+    handles = []
+    def exchange(ser):
+        handles.append(ser)
+        if len(handles) == 1:
+            raise rs485.serial.SerialException('device disconnected')
+        return 'reply'
+    assert port.transaction(9600,exchange) == 'reply'
+    assert handles[0] is not handles[1]
+    assert port.reconnects == 1 and fake_serial.opened == 2
+
+def test_lost_port_gives_up(monkeypatch):
+    port,now = serial_port(monkeypatch)
+    def exchange(ser):
+        raise OSError('device disconnected')
+    with pytest.raises(Warning,match='Lost connection'):
+        port.transaction(9600,exchange)
+    # Reopened once within the transaction, then dropped again.
+    assert port.ser is None and fake_serial.opened == 2
+    assert port.reconnects == 1
+    assert port.transaction(9600,lambda ser: 'reply') == 'reply'
+    assert port.reconnects == 2
+
+def test_rtt_estimate():
+    rtt = rtt_estimator()
+    rtt.update(0.1)
+    assert rtt.srtt == 0.1 and rtt.rttvar == 0.05
+    rtt.update(0.02)
+    assert rtt.rttvar == pytest.approx(0.75*0.05 + 0.25*0.08)
+    assert rtt.srtt == pytest.approx(0.875*0.1 + 0.125*0.02)
+
+def test_timeout():
+    rtt = rtt_estimator(min_timeout=0.05,max_timeout=3)
+    # Nothing measured yet.
+    assert rtt.timeout() == 3
+    rtt.update(0.1)
+    # srtt + 4*rttvar
+    assert rtt.timeout() == pytest.approx(0.3)
+    # 96 bytes at 9600 baud take 0.1 s to arrive.
+    assert rtt.timeout(1,96,9600) == pytest.approx(0.4)
+    assert rtt.timeout(2,96,9600) == pytest.approx(0.8)
+    assert rtt.timeout(3,96,9600) == pytest.approx(1.6)
+    assert rtt.timeout(4,96,9600) == 3
+    # Rounded up to 10 ms, and never below min_timeout.
+    rtt = rtt_estimator(min_timeout=0.05)
+    rtt.update(0.002)
+    assert rtt.timeout() == 0.05
+    rtt.update(0.002)
+    assert rtt.timeout(1,100,9600) == pytest.approx(0.11)
+
+def test_backoff(monkeypatch):
+    rtt = rtt_estimator(base_backoff=0.02,max_backoff=0.5)
+    monkeypatch.setattr(rs485.random,'uniform',lambda low,high: low)
+    assert [rtt.backoff(attempt) for attempt in range(1,7)] == \
+        pytest.approx([0.01,0.02,0.04,0.08,0.16,0.25])
+    monkeypatch.setattr(rs485.random,'uniform',lambda low,high: high)
+    assert [rtt.backoff(attempt) for attempt in range(1,7)] == \
+        pytest.approx([0.02,0.04,0.08,0.16,0.32,0.5])
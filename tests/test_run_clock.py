@@ -0,0 +1,50 @@
+'''
+Tests for the run time base in run_clock.py.
+'''
+import time
+import run_clock as clocks
+from run_clock import run_clock
+
+class clock:
+    # Stands in for time.monotonic or time.time, moved on by hand.
+    def __init__(self,now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+def test_wall_clock_jumps_do_not_move_run_time(monkeypatch):
+    monotonic = clock(500.0)
+    wall = clock(1700000000.0)
+    monkeypatch.setattr(clocks.time,'monotonic',monotonic)
+    monkeypatch.setattr(clocks.time,'time',wall)
+    run = run_clock()
+    times = []
+    for wall_jump in (0,-3600,7200,-86400,0.5):
+        monotonic.now = monotonic.now + 1
+        wall.now = wall.now + 1 + wall_jump
+        times.append(run.now())
+    assert times == [1,2,3,4,5]
+    # Converted with the anchor taken at the start, not the clock now.
+    assert run.wall(times[-1]) == 1700000005.0
+
+def test_wall_and_metadata(monkeypatch):
+    monkeypatch.setattr(clocks.time,'monotonic',clock(500.0))
+    monkeypatch.setattr(clocks.time,'time',clock(1700000000.25))
+    run = run_clock()
+    assert run.monotonic_start == 500 and run.wall_start == 1700000000.25
+    assert run.now() == 0
+    assert run.wall(0) == 1700000000.25
+    assert run.wall(90.5) == 1700000090.75
+    metadata = run.metadata()
+    assert metadata['start_time'] == 1700000000.25
+    assert metadata['start'] == time.strftime('%Y-%m-%dT%H:%M:%S',
+        time.localtime(1700000000.25))
+
+def test_real_clock_increases():
+    run = run_clock()
+    first = run.now()
+    time.sleep(0.01)
+    second = run.now()
+    assert 0 <= first < second
+    assert abs(run.wall(second) - time.time()) < 1
@@ -0,0 +1,87 @@
+'''
+Tests for compiling a recipe into its writes in schedule.py.
+'''
+import pytest
+from schedule import parse_setpoint, compile_schedule
+
+def test_parse_setpoint_step():
+    assert parse_setpoint('775') == (None,775.0)
+    assert parse_setpoint('12.5') == (None,12.5)
+
+def test_parse_setpoint_bad_cell():
+    with pytest.raises(ValueError):
+        parse_setpoint('hot')
+
+def test_first_step_writes_everything():
+    schedule = compile_schedule([10],[25],{'Argon':[0],'Helium':[100]})
+    assert schedule.steps[0].writes == (('Temp',25),('Argon',0),
+        ('Helium',100))
+    assert schedule.steps[0].settle == 25
+    assert schedule.steps[0].hold == 10
+
+def test_only_changes_are_written():
+    schedule = compile_schedule([10,20,30],[25,775,775],
+        {'Argon':[100,100,0]})
+    assert schedule.steps[1].writes == (('Temp',775),)
+    assert schedule.steps[2].writes == (('Argon',0),)
+    assert schedule.steps[2].settle == 775
+    assert schedule.duration == 60
+    assert schedule.write_count == 4
+
+def test_no_furnace():
+    schedule = compile_schedule([5],[],{'Argon':[50]})
+    assert schedule.steps[0].writes == (('Argon',50),)
+    assert schedule.steps[0].settle is None
+
+def test_every_problem_is_reported():
+    with pytest.raises(ValueError) as error:
+        compile_schedule([10,-1],[25,2000],{'Argon':[100,500]},
+            temp_limits=(0,1100),flow_limits=(0,200))
+    message = str(error.value)
+    assert 'Step 2: negative time' in message
+    assert 'temperature 2000' in message
+    assert 'Argon flow 500' in message
+
+def test_limits_are_inclusive():
+    schedule = compile_schedule([1],[1100],{'Argon':[200]},
+        temp_limits=(0,1100),flow_limits=(0,200))
+    assert len(schedule.steps) == 1
+
+def test_parse_setpoint_ramp():
+    assert parse_setpoint('25>775') == (25.0,775.0)
+
+def test_ramp_writes():
+    schedule = compile_schedule([10],[35],{},ramp_starts={'Temp':[25]},
+        ramp_rate=1)
+    step = schedule.steps[0]
+    # The start is written at once and settled on; the rest follow in the hold.
+    assert step.writes == (('Temp',25),)
+    assert step.settle == 25
+    assert [value for offset,device,value in step.ramp_writes] == \
+        list(range(26,36))
+    assert [offset for offset,device,value in step.ramp_writes] == \
+        [float(k) for k in range(1,11)]
+    assert schedule.write_count == 11
+
+def test_ramp_skips_unchanged_setpoints():
+    # Ten updates of a 2 degree ramp only change the setpoint twice.
+    schedule = compile_schedule([10],[27],{},ramp_starts={'Temp':[25]},
+        ramp_rate=1)
+    assert schedule.steps[0].ramp_writes == ((3.0,'Temp',26),
+        (8.0,'Temp',27))
+
+def test_flow_ramp_resolution():
+    schedule = compile_schedule([2],[],{'Argon':[10.3]},
+        ramp_starts={'Argon':[10]},ramp_rate=2)
+    assert schedule.steps[0].ramp_writes == ((0.5,'Argon',10.1),
+        (1.0,'Argon',10.2),(2.0,'Argon',10.3))
+
+def test_step_after_ramp_writes_from_the_ramp_end():
+    schedule = compile_schedule([10,10],[775,775],{},
+        ramp_starts={'Temp':[25,None]},ramp_rate=0.5)
+    assert schedule.steps[1].writes == ()
+
+def test_ramp_needs_time():
+    with pytest.raises(ValueError) as error:
+        compile_schedule([0],[775],{},ramp_starts={'Temp':[25]})
+    assert 'ramp needs a step time' in str(error.value)
@@ -0,0 +1,55 @@
+'''
+Tests for settle_detector in settle.py.
+'''
+from settle import settle_detector
+
+def test_settles_on_first_reading_inside():
+    detector = settle_detector(775,tolerance=2)
+    assert detector.update(0,700) is None
+    assert detector.update(1,774) == 'settled'
+    assert detector.settled_time == 1
+
+def test_band_edge_counts():
+    detector = settle_detector(775,tolerance=2)
+    assert detector.update(0,777) == 'settled'
+
+def test_dwell():
+    detector = settle_detector(775,tolerance=2,dwell=3)
+    assert detector.update(0,775) is None
+    assert detector.update(2,776) is None
+    assert detector.update(3,774) == 'settled'
+    assert detector.settled_time == 3
+
+def test_leaving_band_restarts_dwell():
+    detector = settle_detector(775,tolerance=2,dwell=3)
+    for t,value in ((0,775),(2,775),(2.5,780),(3,775),(5,775)):
+        assert detector.update(t,value) is None
+    assert detector.update(6,775) == 'settled'
+
+def test_slope():
+    detector = settle_detector(775,tolerance=5,dwell=2,max_slope=0.5)
+    # Inside the band but still climbing at 1 C/s.
+    for t,value in ((0,771),(1,772),(2,773),(3,774)):
+        assert detector.update(t,value) is None
+    # The last 2 s of readings flatten out to 0.15 C/s.
+    assert detector.update(4,774.2) is None
+    assert detector.update(5,774.3) == 'settled'
+
+def test_slope_needs_two_readings():
+    detector = settle_detector(775,tolerance=2,max_slope=1)
+    assert detector.update(0,775) is None
+    assert detector.update(1,775) == 'settled'
+
+def test_timeout():
+    detector = settle_detector(775,tolerance=2,timeout=10,start=100)
+    assert detector.remaining(104) == 6
+    assert detector.update(105,500) is None
+    assert detector.update(110,600) == 'timeout'
+    assert detector.remaining(120) == 0
+    # Once it has timed out, later readings are ignored.
+    assert detector.update(111,775) == 'timeout'
+
+def test_no_timeout():
+    detector = settle_detector(775)
+    assert detector.remaining(1e9) is None
+    assert detector.update(1e9,0) is None
@@ -0,0 +1,137 @@
+'''
+Tests for the shared memory telemetry ring in shared_telemetry.py.
+'''
+import os, subprocess
+from multiprocessing import resource_tracker
+import pytest
+from shared_telemetry import telemetry_writer, telemetry_reader
+
+@pytest.fixture
+def ring(request):
+    # A writer on a ring of 8 readings, with a name no other test uses.
+    writer = telemetry_writer('cvd_test_' + str(os.getpid()) + '_' +
+        request.node.name[-20:],capacity=8,run_start=1700000000)
+    yield writer
+    writer.close()
+
+def attach(ring):
+    # A reader in the writer's own process.  Attaching drops the ring from
+    # the resource tracker, which the writer still needs to remove it.
+    reader = telemetry_reader(ring.name)
+    resource_tracker.register(reader._memory._name,'shared_memory')
+    return reader
+
+class moving_seq:
+    # Stands in for the header of a ring, handing out the sequence counter
+    # values given in turn, as if the writer were busy in between.
+    def __init__(self,header,seqs):
+        self.header = header
+        self.seqs = list(seqs)
+        self.reads = 0
+
+    def __getitem__(self,key):
+        if key == 'seq':
+            self.reads = self.reads + 1
+            if self.seqs:
+                return self.seqs.pop(0)
+        return self.header[key]
+
+def dead_pid():
+    process = subprocess.Popen(['true'])
+    process.wait()
+    return process.pid
+
+def test_read_new_readings(ring):
+    reader = attach(ring)
+    ring.append('Temp',0.5,25)
+    ring.append('Press',0.6,745.5)
+    assert reader.read() == [('Temp',0.5,25),('Press',0.6,745.5)]
+    assert reader.read() == []
+    ring.append('Temp',1.5,26)
+    assert reader.read() == [('Temp',1.5,26)]
+    assert reader.lost == 0
+    reader.close()
+
+def test_wraparound(ring):
+    reader = attach(ring)
+    for i in range(5):
+        ring.append('Temp',i,i)
+    assert [t for _,t,_ in reader.read()] == [0,1,2,3,4]
+    # Runs past the end of the ring without overwriting anything unread.
+    for i in range(5,11):
+        ring.append('Temp',i,i)
+    assert [t for _,t,_ in reader.read()] == [5,6,7,8,9,10]
+    assert reader.lost == 0
+    # The oldest 12 of 20 are overwritten before the reader gets to them.
+    for i in range(11,31):
+        ring.append('Temp',i,i)
+    assert [t for _,t,_ in reader.read()] == list(range(23,31))
+    assert reader.lost == 12
+    reader.close()
+
+def test_torn_read_is_retried(ring):
+    reader = attach(ring)
+    ring.append('Temp',0,25)
+    ring.append('Temp',1,26)
+    header = reader._header
+    # The counter moves during the first copy, then holds.
+    reader._header = moving_seq(header,[4,6,6,6])
+    assert reader.read() == [('Temp',0,25),('Temp',1,26)]
+    assert reader._header.reads == 4
+    # A write which never finishes leaves the counter odd; the reader gives up
+    # for now without losing its place.
+    ring.append('Temp',2,27)
+    reader._header = moving_seq(header,[7]*5)
+    assert reader.read(retries=5) == []
+    reader._header = header
+    assert reader.read() == [('Temp',2,27)]
+    reader.close()
+
+def test_status(ring):
+    reader = attach(ring)
+    status = reader.status()
+    assert status['state'] == 'starting' and status['step'] == -1
+    assert status['run_start'] == 1700000000
+    assert status['writer_pid'] == os.getpid() and not status['stale']
+    ring.set_state('running')
+    ring.set_progress(2,5,'holding')
+    status = reader.status()
+    assert (status['state'],status['step'],status['steps'],status['phase']) \
+        == ('running',2,5,'holding')
+    reader.request_stop()
+    assert ring.stop_requested()
+    reader.close()
+
+def test_stale_writer(ring):
+    reader = attach(ring)
+    ring.set_state('running')
+    # Stuck half way through a write.
+    header = reader._header
+    reader._header = moving_seq(header,[9]*6)
+    status = reader.status(retries=3)
+    assert status['stale'] and status['state'] == 'failed'
+    reader._header = header
+    # The writer has died.
+    ring._header['writer_pid'] = dead_pid()
+    status = reader.status()
+    assert status['stale'] and status['state'] == 'failed'
+    # A run which finished is not failed by its writer going away.
+    ring.set_state('completed')
+    status = reader.status()
+    assert not status['stale'] and status['state'] == 'completed'
+    reader.close()
+
+def test_takeover(ring):
+    # A ring whose writer is still running cannot be taken over.
+    ring._header['writer_pid'] = os.getppid()
+    with pytest.raises(FileExistsError):
+        telemetry_writer(ring.name,capacity=8)
+    # One left behind by a writer which died can.
+    ring._header['writer_pid'] = dead_pid()
+    ring.append('Temp',0,25)
+    writer = telemetry_writer(ring.name,capacity=16)
+    reader = attach(ring)
+    assert reader.capacity == 16 and reader.read() == []
+    reader.close()
+    # The fixture closes the ring through the new writer's name.
+    writer._memory.close()
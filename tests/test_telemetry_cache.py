@@ -0,0 +1,54 @@
+'''
+Tests for the shared telemetry stream in telemetry_cache.py.
+'''
+import threading
+from telemetry_cache import telemetry_cache
+
+def test_latest_skips_failed_reads():
+    cache = telemetry_cache()
+    cache.publish(0,{'Temp':(25,0.1),'Press':(745,0.2)})
+    cache.publish(1,{'Temp':(None,1.1),'Press':(746,1.2)})
+    assert cache.latest('Temp') == (25,0.1)
+    assert cache.latest() == {'Temp':(25,0.1),'Press':(746,1.2)}
+    assert cache.latest('Argon') is None
+    assert cache.published == 2
+
+def test_subscribers_get_every_set():
+    cache = telemetry_cache()
+    received = []
+    callback = lambda tick_time,readings: received.append(tick_time)
+    cache.subscribe(callback)
+    cache.publish(0,{'Temp':(25,0)})
+    cache.publish(1,{'Temp':(None,1)})
+    cache.unsubscribe(callback)
+    cache.publish(2,{'Temp':(26,2)})
+    assert received == [0,1]
+
+def test_wait():
+    cache = telemetry_cache()
+    cache.publish(0,{'Temp':(25,0.5)})
+    assert cache.wait('Temp',after=0) == (25,0.5)
+    assert cache.wait('Temp',after=0.5,timeout=0.01) is None
+    threading.Timer(0.05,cache.publish,(1,{'Temp':(26,1.5)})).start()
+    assert cache.wait('Temp',after=0.5,timeout=5) == (26,1.5)
+
+def test_since_returns_every_reading():
+    cache = telemetry_cache()
+    for t in range(5):
+        cache.publish(t,{'Temp':(25 + t,t)})
+    assert cache.since('Temp',after=1.5) == [(27,2),(28,3),(29,4)]
+    assert cache.since('Temp',after=4,timeout=0.01) == []
+
+def test_since_keeps_recent():
+    cache = telemetry_cache(recent=3)
+    for t in range(5):
+        cache.publish(t,{'Temp':(25 + t,t)})
+    assert cache.since('Temp') == [(27,2),(28,3),(29,4)]
+
+def test_close_wakes_waits():
+    cache = telemetry_cache()
+    threading.Timer(0.05,cache.close).start()
+    assert cache.wait('Temp',timeout=5) is None
+    assert cache.since('Temp',timeout=0) == []
+    cache.clear()
+    assert not cache.closed and cache.latest() == {}